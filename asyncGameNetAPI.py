@@ -0,0 +1,153 @@
+import asyncio
+from typing import Optional, Tuple
+from packet import HUDPPacket, MAX_PAYLOAD_SIZE, FLAG_FRAGMENT
+from sender import HUDPSender, PACING_BURST, OUTBOUND_LIMIT, WINDOW_SIZE
+from receiver import HUDPReceiver, MAX_ACK_DELAY, ACK_EVERY, SKIP_THRESHOLD
+from dispatcher import route_packet
+from metrics import GameNetMetrics
+from compression import PayloadCompressor
+from impairment import ImpairedSocket, LinkConditions
+
+class HUDPProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams from the event loop into an AsyncGameNetAPI"""
+
+    def __init__(self):
+        self.api: Optional['AsyncGameNetAPI'] = None
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        try:
+            packet = HUDPPacket.deserialize(data)
+        except ValueError as e:
+            print(f"[asyncGameNetAPI] Error: {e}")
+            return
+        if self.api is not None:
+            route_packet(packet, addr, self.api.sender, self.api.receiver)
+
+    def error_received(self, exc: Exception):
+        print(f"[asyncGameNetAPI] Error: {exc}")
+
+
+class AsyncGameNetAPI(GameNetMetrics):
+    """H-UDP API driven by an asyncio event loop instead of threads.
+
+    Uses the same HUDPSender, HUDPReceiver and SelectiveRepeatBuffer as GameNetAPI,
+    with the transport in place of the socket and the loop in place of the TimerQueue,
+    so many sessions can share one loop. Create with `await AsyncGameNetAPI.create(...)`.
+    """
+
+    def __init__(self, transport: asyncio.DatagramTransport, protocol: HUDPProtocol,
+                 remote_addr: Tuple[str, int], max_ack_delay: float = MAX_ACK_DELAY,
+                 ack_every: int = ACK_EVERY, bundle_delay: Optional[float] = None,
+                 congestion_control: Optional[str] = None, pacing_rate: Optional[float] = None,
+                 pacing_burst: int = PACING_BURST, compression_dict: Optional[bytes] = None,
+                 sequenced_unreliable: bool = False, impairment: Optional[LinkConditions] = None,
+                 window_size: int = WINDOW_SIZE, skip_threshold: float = SKIP_THRESHOLD,
+                 fec_block: Optional[int] = None, fec_repair: int = 1, outbound_limit: int = OUTBOUND_LIMIT):
+        super().__init__()
+        loop = asyncio.get_running_loop()
+        self.transport = transport
+        self.remote_addr = remote_addr
+        self.ready_queue: asyncio.Queue = asyncio.Queue()
+        compressor = PayloadCompressor(compression_dict) if compression_dict else None
+        self.send_transport = ImpairedSocket(transport, impairment, loop) if impairment else transport
+        self.receiver = HUDPReceiver(self.send_transport, loop, max_ack_delay, ack_every, self.ready_queue, compressor,
+                                     sequenced_unreliable, window_size, skip_threshold, fec_block is not None)
+        self.sender = HUDPSender(self.send_transport, remote_addr, loop, self.receiver.take_piggyback_ack, bundle_delay,
+                                 congestion_control, pacing_rate, pacing_burst, compressor, window_size,
+                                 fec_block=fec_block, fec_repair=fec_repair, outbound_limit=outbound_limit,
+                                 skip_threshold=skip_threshold)
+        # send() waits on this instead of blocking in HUDPSender when the window is full
+        self.window_open = asyncio.Event()
+        self.sender.on_window_open = self.window_open.set
+        self.closed = False
+        protocol.api = self
+
+    @classmethod
+    async def create(cls, local_addr: Tuple[str, int], remote_addr: Tuple[str, int],
+                     **kwargs) -> 'AsyncGameNetAPI':
+        """Bind a datagram endpoint on the running loop and return the API for it"""
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(HUDPProtocol, local_addr=local_addr)
+        return cls(transport, protocol, remote_addr, **kwargs)
+
+    async def send(self, payload: bytes, reliable: bool = False, stream: int = 0) -> int:
+        """Send data on either reliable or unreliable channel, waiting for window space if needed
+        (see GameNetAPI.send for streams)"""
+        if reliable and len(payload) > MAX_PAYLOAD_SIZE:
+            # Send fragments one at a time so each waits for window space here rather than in HUDPSender
+            fragments = self.sender.make_fragments(payload)
+            seq = await self._send_reliable(fragments[0], FLAG_FRAGMENT, stream)
+            for fragment in fragments[1:]:
+                await self._send_reliable(fragment, FLAG_FRAGMENT, stream)
+        elif reliable:
+            seq = await self._send_reliable(payload, 0, stream)
+        else:
+            seq = self.sender.send_unreliable(payload)
+        self._record_sent(seq, reliable)
+        return seq
+
+    def send_nowait(self, payload: bytes, stream: int = 0) -> asyncio.Future:
+        """Send data on a reliable stream without waiting for window space (see GameNetAPI.send_nowait).
+        The returned future can be awaited for the outcome"""
+        future = asyncio.wrap_future(self.sender.send_reliable_nowait(payload, stream))
+        self._record_sent(-1, True)  # Queued messages have no seq yet
+        return future
+
+    async def _send_reliable(self, payload: bytes, flags: int = 0, stream: int = 0) -> int:
+        """Wait until HUDPSender.send_reliable will not block, then send. Raises
+        ConnectionAbortedError if the API is closed meanwhile"""
+        if self.sender.window_full(stream):
+            # Counted as waiting so lower priority streams leave the congestion window to this one
+            self.sender.set_waiting(stream, True)
+            try:
+                while self.sender.window_full(stream):
+                    if self.closed:
+                        raise ConnectionAbortedError("AsyncGameNetAPI is closed")
+                    self.window_open.clear()
+                    await self.window_open.wait()
+            finally:
+                self.sender.set_waiting(stream, False)
+                self.window_open.set()
+        return self.sender.send_reliable(payload, flags, stream)
+
+    async def recv(self, timeout: Optional[float] = None) -> Optional[HUDPPacket]:
+        """Receive data from either channel, or None on timeout or after close()"""
+        try:
+            packet = await asyncio.wait_for(self.ready_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if packet is None:
+            # Put the close sentinel back for every later (or concurrent) recv
+            self.ready_queue.put_nowait(None)
+            return None
+        self._record_received(packet)
+        return packet
+
+    def __aiter__(self) -> 'AsyncGameNetAPI':
+        return self
+
+    async def __anext__(self) -> HUDPPacket:
+        """Iterate over received packets until close()"""
+        packet = await self.recv()
+        if packet is None:
+            raise StopAsyncIteration
+        return packet
+
+    async def __aenter__(self) -> 'AsyncGameNetAPI':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the API and cleanup resources"""
+        if self.closed:
+            return
+        self.closed = True
+        # Close the sender first so pending bundles are flushed
+        self.sender.close()
+        self.receiver.close()
+        self.transport.close()
+        # Wake up recv() and end async iteration, and fail sends waiting for window space
+        self.ready_queue.put_nowait(None)
+        self.window_open.set()
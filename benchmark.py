@@ -0,0 +1,228 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from congestion import CONGESTION_CONTROLLERS
+from impairment import add_impairment_arguments, conditions_from_args
+from receiver import SKIP_THRESHOLD
+from runner import ExperimentConfig, run_experiment
+from sender import WINDOW_SIZE
+
+# Swept ExperimentConfig fields, in the order they appear in reports
+SWEEP_PARAMETERS = ("rate", "duration", "payload_size", "reliable_ratio", "window_size", "skip_threshold",
+                    "fec_block", "fec_repair")
+
+# Metrics summarised per configuration, with whether a higher value is better (for --compare)
+METRICS = {
+    "send_rate_per_sec": True,
+    "reliable_delivery_pct": True,
+    "reliable_throughput_bps": True,
+    "reliable_latency_p50_ms": False,
+    "reliable_latency_p99_ms": False,
+    "reliable_jitter_ms": False,
+    "reliable_overhead_pct": False,
+    "unreliable_delivery_pct": True,
+    "unreliable_throughput_bps": True,
+    "unreliable_latency_p50_ms": False,
+    "unreliable_latency_p99_ms": False,
+    "unreliable_jitter_ms": False,
+}
+
+# Two-sided 95% Student's t critical values by degrees of freedom; the normal value is used beyond 30
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+Z_95 = 1.96
+
+def trial_metrics(result: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """Flatten one run_experiment result into the METRICS values"""
+    metrics = result["metrics"]
+    values: Dict[str, Optional[float]] = {"send_rate_per_sec": metrics["send_rate_per_sec"]}
+    for channel in ("reliable", "unreliable"):
+        summary = metrics[channel]
+        percentiles = summary["latency_percentiles_ms"]
+        values[f"{channel}_delivery_pct"] = summary["delivery_ratio_pct"]
+        values[f"{channel}_throughput_bps"] = summary["throughput_bytes_per_sec"]
+        values[f"{channel}_latency_p50_ms"] = percentiles.get("p50")
+        values[f"{channel}_latency_p99_ms"] = percentiles.get("p99")
+        values[f"{channel}_jitter_ms"] = summary["jitter_ms"]
+    values["reliable_overhead_pct"] = metrics["reliable"]["overhead_pct"]
+    return values
+
+def confidence_interval(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Mean, sample standard deviation and 95% confidence half-width of the mean"""
+    if not samples:
+        return {"mean": None, "stdev": None, "ci95": None, "n": 0}
+    n = len(samples)
+    mean = statistics.fmean(samples)
+    if n < 2:
+        return {"mean": mean, "stdev": None, "ci95": None, "n": n}
+    stdev = statistics.stdev(samples)
+    t = T_95[n - 2] if n - 1 <= len(T_95) else Z_95
+    return {"mean": mean, "stdev": stdev, "ci95": t * stdev / math.sqrt(n), "n": n}
+
+def summarize(trials: List[Dict[str, Optional[float]]]) -> Dict[str, Dict[str, Optional[float]]]:
+    """Confidence interval of each metric over the trials it was measured in"""
+    return {name: confidence_interval([trial[name] for trial in trials if trial[name] is not None])
+            for name in METRICS}
+
+def config_key(parameters: Dict[str, Any]) -> Tuple:
+    # Reports from before a parameter was swept match runs with its default
+    defaults = {"fec_block": None, "fec_repair": 1}
+    return tuple(parameters.get(name, defaults.get(name)) for name in SWEEP_PARAMETERS)
+
+
+def useful_fec(parameters: Dict[str, Any], grid: Dict[str, List[Any]]) -> bool:
+    """False for combinations with more repair packets than the block has, or that only differ
+    from another in fec_repair while FEC is disabled"""
+    if parameters["fec_block"] is None:
+        return parameters["fec_repair"] == grid["fec_repair"][0]
+    return parameters["fec_repair"] <= parameters["fec_block"]
+
+def sweep(grid: Dict[str, List[Any]], trials: int, base: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Run every combination of the grid values `trials` times and summarise each combination"""
+    combinations = [values for values in itertools.product(*(grid[name] for name in SWEEP_PARAMETERS))
+                    if useful_fec(dict(zip(SWEEP_PARAMETERS, values)), grid)]
+    rows = []
+    for index, values in enumerate(combinations, 1):
+        parameters = dict(zip(SWEEP_PARAMETERS, values))
+        runs = []
+        for trial in range(trials):
+            print(f"[Benchmark] {index}/{len(combinations)} trial {trial + 1}/{trials}: "
+                  + " ".join(f"{name}={value}" for name, value in parameters.items()), file=sys.stderr)
+            runs.append(trial_metrics(run_experiment(ExperimentConfig(**parameters, **base))))
+        rows.append({"config": parameters, "metrics": summarize(runs), "trials": runs})
+    return rows
+
+
+def write_json(path: str, rows: List[Dict[str, Any]], metadata: Dict[str, Any]):
+    with open(path, "w") as f:
+        json.dump({"metadata": metadata, "results": rows}, f, indent=2)
+
+def write_csv(path: str, rows: List[Dict[str, Any]]):
+    """One line per configuration: the swept parameters, then mean and ci95 of each metric"""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(SWEEP_PARAMETERS) + ["trials"]
+                        + [f"{name}_{field}" for name in METRICS for field in ("mean", "ci95")])
+        for row in rows:
+            metrics = row["metrics"]
+            writer.writerow([row["config"][name] for name in SWEEP_PARAMETERS] + [len(row["trials"])]
+                            + [metrics[name][field] for name in METRICS for field in ("mean", "ci95")])
+
+def compare(rows: List[Dict[str, Any]], baseline_path: str) -> List[str]:
+    """Describe metrics that got worse than a previous JSON report by more than the
+    two confidence intervals combined. Configurations missing from the baseline are skipped"""
+    with open(baseline_path) as f:
+        baseline = {config_key(row["config"]): row["metrics"] for row in json.load(f)["results"]}
+
+    regressions = []
+    for row in rows:
+        old_metrics = baseline.get(config_key(row["config"]))
+        if old_metrics is None:
+            continue
+        for name, higher_is_better in METRICS.items():
+            new, old = row["metrics"][name], old_metrics.get(name)
+            if old is None or new["mean"] is None or old["mean"] is None:
+                continue
+            margin = (new["ci95"] or 0.0) + (old["ci95"] or 0.0)
+            change = new["mean"] - old["mean"]
+            if (-change if higher_is_better else change) > margin:
+                label = " ".join(f"{key}={value}" for key, value in row["config"].items())
+                regressions.append(f"{label}: {name} {old['mean']:.2f} -> {new['mean']:.2f} (margin {margin:.2f})")
+    return regressions
+
+
+def format_metric(summary: Dict[str, Optional[float]]) -> str:
+    if summary["mean"] is None:
+        return "N/A"
+    if summary["ci95"] is None:
+        return f"{summary['mean']:.1f}"
+    return f"{summary['mean']:.1f}±{summary['ci95']:.1f}"
+
+def print_table(rows: List[Dict[str, Any]]):
+    columns = [("send/s", "send_rate_per_sec"), ("rel %", "reliable_delivery_pct"),
+               ("rel p99 ms", "reliable_latency_p99_ms"), ("rel overhead %", "reliable_overhead_pct"),
+               ("unrel %", "unreliable_delivery_pct"),
+               ("unrel p99 ms", "unreliable_latency_p99_ms")]
+    header = " ".join(f"{name:>9}" for name in ("rate", "dur", "payload", "rel", "window", "skip", "fec", "repair"))
+    print(header + " " + " ".join(f"{label:>16}" for label, _ in columns))
+    print("-" * (len(header) + 17 * len(columns)))
+    for row in rows:
+        config = row["config"]
+        print(" ".join(f"{'-' if config[name] is None else config[name]:>9}" for name in SWEEP_PARAMETERS) + " "
+              + " ".join(f"{format_metric(row['metrics'][metric]):>16}" for _, metric in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sweep runner.py configurations over a grid with repeated trials and report "
+                    "metrics with 95% confidence intervals")
+    parser.add_argument("--rate", type=float, nargs="+", default=[20.0], help="Messages per second (0 for unpaced)")
+    parser.add_argument("--duration", type=float, nargs="+", default=[2.0], help="Send duration in seconds")
+    parser.add_argument("--payload-size", type=int, nargs="+", default=[None],
+                        help="Payload sizes in bytes (natural mock data size by default)")
+    parser.add_argument("--reliable-ratio", type=float, nargs="+", default=[0.5],
+                        help="Fractions of messages sent reliably")
+    parser.add_argument("--window-size", type=int, nargs="+", default=[WINDOW_SIZE],
+                        help="Selective repeat window sizes")
+    parser.add_argument("--skip-threshold", type=float, nargs="+", default=[SKIP_THRESHOLD],
+                        help="Receiver skip thresholds in seconds")
+    parser.add_argument("--fec-block", type=int, nargs="+", default=[0],
+                        help="Reliable packets per FEC block (0 for no FEC), to weigh tail latency against overhead")
+    parser.add_argument("--fec-repair", type=int, nargs="+", default=[1], help="FEC repair packets per block")
+    parser.add_argument("--trials", type=int, default=3, help="Runs per configuration")
+    parser.add_argument("--max-throughput", action="store_true",
+                        help="Send without pacing sleeps (rate 0) to find the saturation point of the stack")
+    parser.add_argument("--congestion-control", choices=sorted(CONGESTION_CONTROLLERS), default=None,
+                        help="Congestion control for every run (fixed window by default)")
+    parser.add_argument("--json", type=str, default=None, help="Write the full report, including every trial, here")
+    parser.add_argument("--csv", type=str, default=None, help="Write one summary line per configuration here")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="JSON report of a previous run; exit with status 1 if any metric regressed")
+    add_impairment_arguments(parser)
+    args = parser.parse_args()
+
+    grid = {
+        "rate": [0.0] if args.max_throughput else args.rate,
+        "duration": args.duration,
+        "payload_size": args.payload_size,
+        "reliable_ratio": args.reliable_ratio,
+        "window_size": args.window_size,
+        "skip_threshold": args.skip_threshold,
+        "fec_block": [block or None for block in args.fec_block],
+        "fec_repair": args.fec_repair,
+    }
+    base = {
+        "congestion_control": args.congestion_control,
+        "sender_impairment": conditions_from_args(args, 0),
+        "receiver_impairment": conditions_from_args(args, 1),
+    }
+    rows = sweep(grid, args.trials, base)
+    print_table(rows)
+
+    if args.json:
+        metadata = {"time": time.time(), "trials": args.trials, "congestion_control": args.congestion_control,
+                    "impaired": base["sender_impairment"] is not None, "python": sys.version.split()[0]}
+        write_json(args.json, rows, metadata)
+        print(f"[Benchmark] Wrote {args.json}")
+    if args.csv:
+        write_csv(args.csv, rows)
+        print(f"[Benchmark] Wrote {args.csv}")
+    if args.compare:
+        regressions = compare(rows, args.compare)
+        for regression in regressions:
+            print(f"[Benchmark] Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"[Benchmark] No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
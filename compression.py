@@ -0,0 +1,137 @@
+import argparse
+import itertools
+import zlib
+from collections import Counter
+from typing import Iterable, List, Optional
+
+from packet import MAX_PAYLOAD_SIZE
+
+DICTIONARY_SIZE = 2048  # bytes
+COMPRESSION_LEVEL = 6
+# A 4 KiB window covers the dictionary plus a full datagram; a small window and hash table
+# keep the per-packet copy of the compressor state cheap (~5us instead of ~17us)
+WINDOW_BITS = 12
+MEM_LEVEL = 1
+MIN_SUBSTRING = 4
+MAX_SUBSTRING = 24
+
+class PayloadCompressor:
+    """Raw deflate with a preset dictionary shared by both ends.
+
+    Game payloads are tiny, so generic compression has nothing to work with. A
+    dictionary holding the recurring keys and values lets even a 20-byte message
+    refer back to it. Compressor state is primed with the dictionary once and
+    copied per packet instead of being rebuilt.
+    """
+
+    def __init__(self, zdict: bytes, level: int = COMPRESSION_LEVEL):
+        self.zdict = zdict
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -WINDOW_BITS, MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+        self.decompressor = zlib.decompressobj(-WINDOW_BITS, zdict)
+
+    def compress(self, data: bytes) -> Optional[bytes]:
+        """Compress data, or return None if that would not make it smaller"""
+        compressor = self.compressor.copy()
+        compressed = compressor.compress(data) + compressor.flush()
+        return compressed if len(compressed) < len(data) else None
+
+    def decompress(self, data: bytes, max_size: int = MAX_PAYLOAD_SIZE) -> bytes:
+        """Decompress data, refusing output larger than max_size"""
+        decompressor = self.decompressor.copy()
+        decompressed = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError("Invalid compressed payload")
+        return decompressed
+
+    @staticmethod
+    def from_file(path: str) -> 'PayloadCompressor':
+        """Load a dictionary written by `python compression.py train`"""
+        with open(path, 'rb') as f:
+            return PayloadCompressor(f.read())
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = DICTIONARY_SIZE) -> bytes:
+    """Build a preset dictionary from captured payloads.
+
+    Scores every substring of MIN_SUBSTRING..MAX_SUBSTRING bytes by the bytes it would save
+    across the samples (counted once per sample), then greedily keeps the best ones that are
+    not already covered. The best substrings go last, since deflate encodes nearer matches
+    more cheaply.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        seen = set()
+        for start in range(len(sample)):
+            for length in range(MIN_SUBSTRING, min(MAX_SUBSTRING, len(sample) - start) + 1):
+                seen.add(sample[start:start + length])
+        counts.update(seen)
+
+    # Substrings seen only once cannot help future packets
+    candidates = sorted((s for s, n in counts.items() if n > 1), key=lambda s: counts[s] * len(s), reverse=True)
+    chosen: List[bytes] = []
+    total = 0
+    for candidate in candidates:
+        if total + len(candidate) > size:
+            continue
+        if any(candidate in existing for existing in chosen):
+            continue
+        chosen.append(candidate)
+        total += len(candidate)
+    return b''.join(reversed(chosen))
+
+
+def mock_samples(count: int) -> List[bytes]:
+    """Payloads from sender_app.generate_mock_game_data, standing in for a traffic capture"""
+    from sender_app import generate_mock_game_data
+    return [generate_mock_game_data(i, i % 2 == 0).encode() for i in range(count)]
+
+def read_samples(path: str) -> List[bytes]:
+    """One captured payload per line"""
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\n') for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and benchmark preset compression dictionaries")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train", help="Train a dictionary from captured payloads")
+    train.add_argument("--samples", type=str, help="File with one captured payload per line (default: mock game data)")
+    train.add_argument("--mock", type=int, default=5000, help="Number of mock payloads when --samples is not given")
+    train.add_argument("--size", type=int, default=DICTIONARY_SIZE, help="Dictionary size in bytes")
+    train.add_argument("--out", type=str, required=True, help="Output dictionary file")
+    bench = subparsers.add_parser("bench", help="Report compression ratio against CPU cost per packet")
+    bench.add_argument("--dict", type=str, help="Dictionary file (default: train on mock data)")
+    bench.add_argument("--samples", type=str, help="File with one payload per line (default: fresh mock game data)")
+    bench.add_argument("--iterations", type=int, default=20000, help="Operations per measurement")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        samples = read_samples(args.samples) if args.samples else mock_samples(args.mock)
+        zdict = train_dictionary(samples, args.size)
+        with open(args.out, 'wb') as f:
+            f.write(zdict)
+        print(f"Wrote {len(zdict)} byte dictionary trained on {len(samples)} samples to {args.out}")
+        return
+
+    from microbench import measure
+    zdict = open(args.dict, 'rb').read() if args.dict else train_dictionary(mock_samples(5000))
+    samples = read_samples(args.samples) if args.samples else mock_samples(2000)
+    with_dict = PayloadCompressor(zdict)
+    without_dict = PayloadCompressor(b'')
+
+    print(f"{'codec':<16} {'ratio':>7} {'compress ns':>12} {'decompress ns':>14}")
+    print("-" * 52)
+    for name, compressor in [("deflate", without_dict), ("deflate+dict", with_dict)]:
+        raw = sum(len(s) for s in samples)
+        # Payloads that would grow are sent uncompressed
+        encoded = [compressor.compress(s) or s for s in samples]
+        ratio = raw / sum(len(e) for e in encoded)
+        payloads = itertools.cycle(samples)
+        compress = measure(lambda: compressor.compress(next(payloads)), args.iterations)
+        compressed = itertools.cycle([e for e, s in zip(encoded, samples) if e is not s] or [b''])
+        decompress = measure(lambda: compressor.decompress(next(compressed)), args.iterations)
+        print(f"{name:<16} {ratio:>7.2f} {compress['ns_per_op']:>12.0f} {decompress['ns_per_op']:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+INITIAL_CWND = 4.0  # packets
+MIN_CWND = 2.0
+MAX_CWND = 1024.0  # The selective repeat window still caps packets in flight
+VEGAS_ALPHA = 2.0  # Grow while fewer than this many packets are queued in the network
+VEGAS_BETA = 4.0  # Shrink while more than this many packets are queued in the network
+
+class CongestionController(ABC):
+    """Congestion window (in packets) for the reliable channel, driven by ACKs and timeouts"""
+
+    def __init__(self, initial_cwnd: float = INITIAL_CWND):
+        self.cwnd = initial_cwnd
+        self.ssthresh = MAX_CWND
+        self.recovery_seq = 0  # Losses of packets sent before this seq were already reacted to
+
+    @abstractmethod
+    def on_ack(self, acked: int, rtt: Optional[float]):
+        """Called once per ACK with the number of newly acknowledged packets and an RTT sample, if any"""
+
+    def on_loss(self, seq: int, next_seq: int):
+        """Called when the packet sent seq-th timed out or was skipped by the receiver.
+        Reduces the window at most once per window of data"""
+        if seq < self.recovery_seq:
+            return
+        self.recovery_seq = next_seq
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+
+
+class NewRenoController(CongestionController):
+    """Loss-based AIMD: slow start to ssthresh, then one packet per RTT, halved on loss"""
+
+    def on_ack(self, acked: int, rtt: Optional[float]):
+        if self.cwnd < self.ssthresh:
+            # Slow start: double every RTT
+            self.cwnd += acked
+        else:
+            # Congestion avoidance: one packet per RTT
+            self.cwnd += acked / self.cwnd
+        self.cwnd = min(self.cwnd, MAX_CWND)
+
+
+class DelayBasedController(CongestionController):
+    """Vegas-style: keep between VEGAS_ALPHA and VEGAS_BETA packets queued, estimated from RTT above the minimum"""
+
+    def __init__(self, initial_cwnd: float = INITIAL_CWND):
+        super().__init__(initial_cwnd)
+        self.base_rtt: Optional[float] = None
+
+    def on_ack(self, acked: int, rtt: Optional[float]):
+        if rtt is None:
+            return
+        if self.base_rtt is None or rtt < self.base_rtt:
+            self.base_rtt = rtt
+        # Packets queued = (expected rate - actual rate) * base RTT
+        queued = self.cwnd * (1 - self.base_rtt / rtt)
+        if queued < VEGAS_ALPHA:
+            self.cwnd += acked / self.cwnd
+        elif queued > VEGAS_BETA:
+            self.cwnd = max(self.cwnd - acked / self.cwnd, MIN_CWND)
+        self.cwnd = min(self.cwnd, MAX_CWND)
+
+
+CONGESTION_CONTROLLERS = {
+    'newreno': NewRenoController,
+    'delay': DelayBasedController,
+}
+
+def make_congestion_controller(name: Optional[str]) -> Optional[CongestionController]:
+    """Create a controller by name, or None for a fixed window"""
+    if name is None:
+        return None
+    if name not in CONGESTION_CONTROLLERS:
+        raise ValueError(f"Unknown congestion control: {name} (expected one of {', '.join(CONGESTION_CONTROLLERS)})")
+    return CONGESTION_CONTROLLERS[name]()
@@ -0,0 +1,85 @@
+import socket
+import threading
+from typing import Callable, Tuple
+from packet import (HUDPPacket, CHANNEL_RELIABLE, CHANNEL_UNRELIABLE, CHANNEL_ACK, CHANNEL_FEC, CHANNEL_RESET,
+                    CHANNEL_RESET_ACK, MAX_DATAGRAM_SIZE, decode_ack)
+from sender import HUDPSender
+from receiver import HUDPReceiver
+
+POLL_INTERVAL = 0.1  # How often the receive loop checks for shutdown
+
+class HUDPDispatcher:
+    """Single I/O loop that owns the socket and hands each datagram to a handler,
+    typically route_packet for the sender and receiver of the peer it came from"""
+
+    def __init__(self, sock: socket.socket, handler: Callable[[HUDPPacket, Tuple[str, int]], None]):
+        self.sock = sock
+        self.handler = handler
+        # Set once here instead of on every recvfrom call
+        self.sock.settimeout(POLL_INTERVAL)
+        # Datagrams are received into one preallocated buffer and parsed in place
+        self.recv_buffer = bytearray(MAX_DATAGRAM_SIZE)
+        self.recv_view = memoryview(self.recv_buffer)
+
+        self.shutdown_event = threading.Event()
+        self.receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self.receive_thread.start()
+
+    def _receive_loop(self):
+        """Background thread to receive and demultiplex packets"""
+        while not self.shutdown_event.is_set():
+            try:
+                size, addr = self.sock.recvfrom_into(self.recv_buffer)
+                packet = HUDPPacket.deserialize(self.recv_view, size)
+                # ACKs are fully consumed here, but data payloads outlive the buffer,
+                # so copy them out once
+                if packet.channel_type != CHANNEL_ACK:
+                    packet.payload = bytes(packet.payload)
+                self.handler(packet, addr)
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.shutdown_event.is_set():
+                    break
+                print(f"[Dispatcher] Error: {e}")
+
+    def close(self):
+        """Stop the receive thread"""
+        self.shutdown_event.set()
+        if self.receive_thread.is_alive():
+            self.receive_thread.join()
+
+
+def route_packet(packet: HUDPPacket, addr: Tuple[str, int], sender: HUDPSender, receiver: HUDPReceiver):
+    """Route a packet by channel type: ACKs to the sender, data to the receiver"""
+    if packet.channel_type == CHANNEL_RESET:
+        # The sender confirms before renumbering, as the peer only accepts packets sent after the
+        # confirmation. A repeated nonce (our confirmation was lost) is confirmed again without another reset
+        if receiver.reset(packet.seq_num, packet.timestamp):
+            sender.reset(confirm=packet.seq_num)
+        else:
+            sender.send_control(CHANNEL_RESET_ACK, packet.seq_num)
+        return
+    if packet.channel_type == CHANNEL_RESET_ACK:
+        return  # Only expected by the GameNetServer that sent the reset, which handles it itself
+    if packet.timestamp < receiver.reset_time:
+        # Sent (and delayed) before the last reset, so its seq and ACKs are numbered for the previous
+        # sequence space and would acknowledge or fill the wrong packets. Only unreliable data is kept
+        if packet.channel_type == CHANNEL_UNRELIABLE:
+            receiver.handle_unreliable(packet)
+        return
+    if packet.channel_type == CHANNEL_ACK:
+        # seq_num of an ACK is the stream it acknowledges
+        sack_bitmap, skip_bitmap = decode_ack(packet.payload, packet.flags)
+        sender.handle_ack(packet.ack_num, sack_bitmap, packet.seq_num, skip_bitmap)
+        return
+
+    # Data packets may carry a piggybacked cumulative ACK for stream 0 (0 acknowledges nothing)
+    if packet.ack_num:
+        sender.handle_ack(packet.ack_num)
+    if packet.channel_type == CHANNEL_RELIABLE:
+        receiver.handle_reliable(packet, addr)
+    elif packet.channel_type == CHANNEL_UNRELIABLE:
+        receiver.handle_unreliable(packet)
+    elif packet.channel_type == CHANNEL_FEC:
+        receiver.handle_fec(packet, addr)
@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from typing import List, Tuple
+
+from packet import FEC_HEADER, FEC_RECORD
+
+# Fraction of the RTO after which a block that is still not full is protected as it is,
+# so its repairs arrive before the lost packets would be retransmitted
+FEC_FLUSH_FRACTION = 0.5
+FEC_HISTORY = 256  # Received packets kept per stream to reconstruct others from repair packets
+FEC_PENDING = 32  # Repair packets per stream kept until enough of their group has arrived
+
+def check_fec_ratio(block: int, repair: int):
+    """Raise ValueError unless `repair` repair packets per `block` reliable packets can be encoded"""
+    if not 1 <= repair <= block <= 255:
+        raise ValueError(f"FEC needs 1 <= repair ({repair}) <= block ({block}) <= 255")
+
+def fec_record(flags: int, payload: bytes) -> bytes:
+    """What a repair packet protects of a reliable packet: its flags and payload (after
+    compression, without the stream prefix). The timestamp is left out, as retransmissions
+    change it; a rebuilt packet takes the repair packet's, like a retransmitted one would"""
+    return FEC_RECORD.pack(flags, len(payload)) + payload
+
+def parse_record(record: bytes) -> Tuple[int, bytes]:
+    """Return (flags, payload) from a record, ignoring XOR padding after the payload"""
+    flags, length = FEC_RECORD.unpack_from(record)
+    return flags, bytes(record[FEC_RECORD.size:FEC_RECORD.size + length])
+
+def xor_records(records: List[bytes]) -> bytes:
+    """XOR of byte strings, each zero-padded to the longest"""
+    size = max(len(record) for record in records)
+    result = 0
+    for record in records:
+        # Left-justify so the shorter records are padded at the end
+        result ^= int.from_bytes(record, 'big') << (8 * (size - len(record)))
+    return result.to_bytes(size, 'big')
+
+
+class FecEncoder:
+    """Sender side of FEC for one reliable stream.
+
+    Every `block` packets sent for the first time form a block, protected by `repair`
+    XOR parity packets: repair j covers the packets whose index in the block is j modulo
+    `repair`, so up to `repair` losses per block can be recovered if they fall in different
+    groups (consecutive losses do, as long as the burst is no longer than `repair`).
+    """
+
+    def __init__(self, stream_id: int, block: int, repair: int):
+        self.stream_id = stream_id
+        self.block = block
+        self.repair = repair
+        self.first_seq = 0  # Seq of the first packet in the open block
+        self.records: List[bytes] = []  # Records of the open block's packets, in seq order
+        self.timer = None  # Flushes the open block if it is not filled in time
+
+    def add(self, seq: int, record: bytes) -> List[bytes]:
+        """Add a packet to the open block, returning the repair payloads if that fills it"""
+        if not self.records:
+            self.first_seq = seq
+        self.records.append(record)
+        if len(self.records) == self.block:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[bytes]:
+        """Close the open block, returning the repair payloads for the packets it has"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        records, self.records = self.records, []
+        repairs = []
+        interleave = min(self.repair, len(records))
+        for index in range(interleave):
+            repairs.append(FEC_HEADER.pack(self.stream_id, len(records), interleave, index)
+                           + xor_records(records[index::interleave]))
+        return repairs
+
+
+class FecDecoder:
+    """Receiver side of FEC for one reliable stream: keeps recent packets and reconstructs
+    a missing one once a repair packet and every other packet of its group are at hand"""
+
+    def __init__(self, history: int = FEC_HISTORY, pending: int = FEC_PENDING):
+        self.history = history
+        self.pending_limit = pending
+        self.records: 'OrderedDict[int, bytes]' = OrderedDict()  # seq -> record, oldest first
+        # (group seqs, XOR of their records) for repairs still missing more than one packet
+        self.pending: List[Tuple[List[int], bytes]] = []
+
+    def add_source(self, seq: int, record: bytes, rcv_base: int) -> List[Tuple[int, bytes]]:
+        """Remember a received packet and return (seq, record) of any packets it lets pending repairs rebuild"""
+        self._remember(seq, record)
+        if not self.pending:
+            return []
+        return self._retry_pending(rcv_base)
+
+    def add_repair(self, first_seq: int, count: int, interleave: int, index: int, data: bytes,
+                   rcv_base: int) -> List[Tuple[int, bytes]]:
+        """Use a repair payload (after FEC_HEADER) and return (seq, record) of the packets it rebuilds"""
+        group = list(range(first_seq + index, first_seq + count, interleave))
+        self.pending.append((group, data))
+        if len(self.pending) > self.pending_limit:
+            self.pending.pop(0)
+        return self._retry_pending(rcv_base)
+
+    def _remember(self, seq: int, record: bytes):
+        self.records[seq] = record
+        while len(self.records) > self.history:
+            self.records.popitem(last=False)
+
+    def _retry_pending(self, rcv_base: int) -> List[Tuple[int, bytes]]:
+        """Solve every pending repair with exactly one missing packet, repeating while that
+        recovers packets other repairs need"""
+        recovered = []
+        progress = True
+        while progress:
+            progress = False
+            remaining = []
+            for group, data in self.pending:
+                missing = [seq for seq in group if seq not in self.records]
+                if not missing or missing[-1] < rcv_base:
+                    continue  # Nothing left to recover: all received, delivered or skipped
+                if len(missing) > 1:
+                    remaining.append((group, data))
+                    continue
+                seq = missing[0]
+                record = xor_records([data] + [self.records[other] for other in group if other != seq])
+                self._remember(seq, record)
+                recovered.append((seq, record))
+                progress = True
+            self.pending = remaining
+        return recovered
@@ -1,15 +1,29 @@
 import socket
-from typing import Optional, Tuple
-from packet import HUDPPacket
-from sender import HUDPSender, MAX_SEND_RATE
-from receiver import HUDPReceiver
 import time
-from packet import CHANNEL_RELIABLE, CHANNEL_UNRELIABLE
+from concurrent.futures import Future
+from typing import Callable, Hashable, List, Optional, Tuple
+from packet import HUDPPacket
+from sender import HUDPSender, MAX_SEND_RATE, PACING_BURST, WINDOW_SIZE, OUTBOUND_LIMIT
+from receiver import HUDPReceiver, ReadyQueue, unreliable_key, MAX_ACK_DELAY, ACK_EVERY, SKIP_THRESHOLD, RECV_BATCH
+from dispatcher import HUDPDispatcher, route_packet
+from timers import TimerQueue
+from metrics import GameNetMetrics
+from compression import PayloadCompressor
+from impairment import ImpairedSocket, LinkConditions
 
-class GameNetAPI:
+class GameNetAPI(GameNetMetrics):
     """H-UDP API for game networking with reliable and unreliable channels"""
     
-    def __init__(self, local_addr: Tuple[str, int], remote_addr: Tuple[str, int]):
+    def __init__(self, local_addr: Tuple[str, int], remote_addr: Tuple[str, int],
+                 max_ack_delay: float = MAX_ACK_DELAY, ack_every: int = ACK_EVERY,
+                 bundle_delay: Optional[float] = None, congestion_control: Optional[str] = None,
+                 pacing_rate: Optional[float] = None, pacing_burst: int = PACING_BURST,
+                 compression_dict: Optional[bytes] = None, sequenced_unreliable: bool = False,
+                 coalesce_key: Optional[Callable[[bytes], Optional[Hashable]]] = None,
+                 impairment: Optional[LinkConditions] = None, window_size: int = WINDOW_SIZE,
+                 skip_threshold: float = SKIP_THRESHOLD, fec_block: Optional[int] = None, fec_repair: int = 1,
+                 outbound_limit: int = OUTBOUND_LIMIT):
+        super().__init__()
         self.local_addr = local_addr
         self.remote_addr = remote_addr
         
@@ -17,73 +31,77 @@ class GameNetAPI:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind(local_addr)
         
-        # Create sender and receiver (they will manage their own threads)
-        self.sender = HUDPSender(self.sock, remote_addr)
-        self.receiver = HUDPReceiver(self.sock)
-        
-        # Track packet statistics
-        self.sent_reliable = 0
-        self.sent_unreliable = 0
-        self.reliable_bytes_received = 0
-        self.unreliable_bytes_received = 0
-        self.reliable_latencies = []
-        self.unreliable_latencies = []
-        # J(i) = J(i-1) + (|D(i-1,i)| - J(i-1))/16
-        self.reliable_jitter = 0
-        self.unreliable_jitter = 0
+        # Create sender and receiver, a single dispatcher thread that reads the socket
+        # and routes ACKs to the sender and data packets to the receiver,
+        # and a timer thread that drives retransmissions and delayed ACKs.
+        # Pending ACKs are piggybacked on outgoing data packets when possible
+        self.timers = TimerQueue()
+        # Outgoing datagrams (data and ACKs) go through the impairment emulator if one is configured
+        self.send_sock = ImpairedSocket(self.sock, impairment, self.timers) if impairment else self.sock
+        compressor = PayloadCompressor(compression_dict) if compression_dict else None
+        # With coalesce_key, only the newest undelivered unreliable message per key is kept
+        ready_queue = ReadyQueue(unreliable_key(coalesce_key)) if coalesce_key else None
+        self.receiver = HUDPReceiver(self.send_sock, self.timers, max_ack_delay, ack_every, ready_queue, compressor,
+                                     sequenced_unreliable, window_size, skip_threshold, fec_block is not None)
+        self.sender = HUDPSender(self.send_sock, remote_addr, self.timers, self.receiver.take_piggyback_ack, bundle_delay,
+                                 congestion_control, pacing_rate, pacing_burst, compressor, window_size,
+                                 fec_block, fec_repair, outbound_limit, skip_threshold)
+        self.dispatcher = HUDPDispatcher(self.sock, self._dispatch)
+
+    def _dispatch(self, packet: HUDPPacket, addr: Tuple[str, int]):
+        """Dispatcher handler: route every datagram to this endpoint's sender and receiver"""
+        route_packet(packet, addr, self.sender, self.receiver)
 
-    def send(self, payload: bytes, reliable: bool = False) -> int:
-        """Send data on either reliable or unreliable channel"""
+    def send(self, payload: bytes, reliable: bool = False, stream: int = 0) -> int:
+        """Send data on either reliable or unreliable channel. Reliable messages are ordered
+        within their stream (0 to MAX_STREAMS - 1, lower is higher priority) but not across streams"""
         if reliable:
-            seq = self.sender.send_reliable(payload)
-            self.sent_reliable += 1
-            print(f"[gameNetAPI] Sent RELIABLE seq={seq}")
-            return seq
+            seq = self.sender.send_reliable(payload, stream=stream)
         else:
             seq = self.sender.send_unreliable(payload)
-            self.sent_unreliable += 1
-            print(f"[gameNetAPI] Sent UNRELIABLE seq={seq}")
-            return seq
+        self._record_sent(seq, reliable)
+        return seq
+
+    def send_nowait(self, payload: bytes, stream: int = 0) -> Future:
+        """Send data on a reliable stream without blocking, queueing it if the window is full.
+        Returns a Future resolving to 'delivered', 'skipped' or 'dropped'; raises queue.Full
+        if the outbound queue has no room (see HUDPSender.send_reliable_nowait)"""
+        future = self.sender.send_reliable_nowait(payload, stream)
+        self._record_sent(-1, True)  # Queued messages have no seq yet
+        return future
+
+    def outbound_depth(self, stream: Optional[int] = None) -> int:
+        """Messages' packets queued by send_nowait waiting for window space, on one stream or all"""
+        return self.sender.outbound_depth(stream)
+
+    @property
+    def backpressure(self) -> bool:
+        """True from when the send_nowait queue fills to 75% of its limit until it drains to 25%"""
+        return self.sender.backpressure
 
-    def recv(self, timeout: Optional[float] = 1 / MAX_SEND_RATE) -> Optional[HUDPPacket]:
-        """Receive data from either channel"""
-        packet = self.receiver.recv(timeout=timeout)
+    def recv(self, timeout: Optional[float] = 1 / MAX_SEND_RATE, channel: Optional[int] = None) -> Optional[HUDPPacket]:
+        """Receive data from either channel, or only from channel (CHANNEL_RELIABLE or CHANNEL_UNRELIABLE)"""
+        packet = self.receiver.recv(timeout=timeout, channel=channel)
         if packet:
-            latency_ms = (time.time() - packet.timestamp) * 1000
-            if packet.channel_type == CHANNEL_RELIABLE:
-                print(f"[gameNetAPI] Received RELIABLE seq={packet.seq_num}, latency={latency_ms:.1f} ms")
-                self.reliable_bytes_received += len(packet.payload)
-                latency_diff = abs(latency_ms - self.reliable_latencies[-1] if self.reliable_latencies else 0)
-                self.reliable_jitter = self.reliable_jitter + (latency_diff - self.reliable_jitter) / 16
-                self.reliable_latencies.append(latency_ms)
-            elif packet.channel_type == CHANNEL_UNRELIABLE:
-                print(f"[gameNetAPI] Received UNRELIABLE seq={packet.seq_num}, latency={latency_ms:.1f} ms")
-                self.unreliable_bytes_received += len(packet.payload)
-                latency_diff = abs(latency_ms - self.unreliable_latencies[-1] if self.unreliable_latencies else 0)
-                self.unreliable_jitter = self.unreliable_jitter + (latency_diff - self.unreliable_jitter) / 16
-                self.unreliable_latencies.append(latency_ms)
+            self._record_received(packet)
         return packet
 
-    def display_metrics(self, duration: float):
-        """Display collected metrics"""
-        print()
-        print(f"[gameNetAPI] SENT METRICS:")
-        print(f"  RELIABLE: Packets sent = {self.sent_reliable}")
-        print(f"  UNRELIABLE: Packets sent = {self.sent_unreliable}")
-        print(f"[gameNetAPI] RECEIVED METRICS:")
-        print(f"  RELIABLE: Packets received = {len(self.reliable_latencies)}, throughput = {(self.reliable_bytes_received / duration):.2f} bytes/s")
-        if self.reliable_latencies:
-            avg_reliable_latency = sum(self.reliable_latencies) / len(self.reliable_latencies)
-            print(f"    Average latency = {avg_reliable_latency:.2f} ms")
-        print(f"    Jitter = {self.reliable_jitter:.2f} ms")
-        print(f"  UNRELIABLE: Packets received = {len(self.unreliable_latencies)}, throughput = {(self.unreliable_bytes_received / duration):.2f} bytes/s")
-        if self.unreliable_latencies:
-            avg_unreliable_latency = sum(self.unreliable_latencies) / len(self.unreliable_latencies)
-            print(f"    Average latency = {avg_unreliable_latency:.2f} ms")
-        print(f"    Jitter = {self.unreliable_jitter:.2f} ms")
+    def recv_many(self, max_n: int = RECV_BATCH, timeout: Optional[float] = 0.0,
+                  channel: Optional[int] = None) -> List[HUDPPacket]:
+        """Receive up to max_n packets that are ready, oldest first, waiting up to timeout
+        (None to wait forever) for the first one. Returns an empty list on timeout"""
+        packets = self.receiver.recv_many(max_n, timeout, channel)
+        if packets:
+            now = time.time()
+            for packet in packets:
+                self._record_received(packet, now)
+        return packets
 
     def close(self):
         """Close the API and cleanup resources"""
+        # Close the sender first so pending bundles are flushed
         self.sender.close()
         self.receiver.close()
+        self.dispatcher.close()
+        self.timers.close()
         self.sock.close()
@@ -0,0 +1,328 @@
+import queue
+import random
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from packet import HUDPPacket, CHANNEL_ACK, CHANNEL_UNRELIABLE, CHANNEL_RESET, CHANNEL_RESET_ACK
+from sender import HUDPSender, MAX_SEND_RATE, MAX_RETRIES, PACING_BURST, OUTBOUND_LIMIT
+from receiver import HUDPReceiver, ReadyQueue, unreliable_key, MAX_ACK_DELAY, ACK_EVERY, RECV_BATCH
+from dispatcher import HUDPDispatcher, route_packet
+from timers import Timer, TimerQueue
+from metrics import GameNetMetrics, LatencyHistogram, print_latency
+from compression import PayloadCompressor
+from impairment import ImpairedSocket, LinkConditions
+from tracing import (TRACER, TRACE_EVENTS, EVENT_SESSION_OPEN, EVENT_SESSION_CLOSE, EVENT_SESSION_REFUSED,
+                     peer_fields)
+
+IDLE_TIMEOUT = 30.0  # Seconds without datagrams from a peer before its session is evicted
+MAX_SESSIONS = 1024
+# GameNetMetrics counters summed by GameNetServer.totals
+SESSION_COUNTERS = ('sent_reliable', 'sent_unreliable', 'received_reliable', 'received_unreliable',
+                    'reliable_bytes_received', 'unreliable_bytes_received')
+
+class PeerQueue:
+    """Tags packets delivered by one session's receiver with the peer address"""
+
+    def __init__(self, ready_queue: ReadyQueue, addr: Tuple[str, int]):
+        self.ready_queue = ready_queue
+        self.addr = addr
+
+    def put_nowait(self, packet: HUDPPacket):
+        self.ready_queue.put_nowait((self.addr, packet))
+
+
+class PeerSession(GameNetMetrics):
+    """Per-peer state of a GameNetServer: sender window, receive buffer, metrics and timers"""
+
+    def __init__(self, sock: socket.socket, addr: Tuple[str, int], timers: TimerQueue,
+                 ready_queue: ReadyQueue, max_ack_delay: float, ack_every: int,
+                 sequenced_unreliable: bool = False, **sender_options):
+        super().__init__()
+        self.addr = addr
+        self.receiver = HUDPReceiver(sock, timers, max_ack_delay, ack_every, PeerQueue(ready_queue, addr),
+                                     sender_options.get('compressor'), sequenced_unreliable,
+                                     fec=sender_options.get('fec_block') is not None)
+        self.sender = HUDPSender(sock, addr, timers, self.receiver.take_piggyback_ack, **sender_options)
+        self.last_active = time.monotonic()
+        # Nonce of the CHANNEL_RESET the peer has not confirmed yet, or None once it has
+        self.reset_nonce: Optional[int] = None
+        self.reset_attempts = 0
+        self.reset_timer: Optional[Timer] = None  # Resends the reset until it is confirmed
+
+    def close(self):
+        """Flush pending bundles and cancel this session's timers"""
+        if self.reset_timer is not None:
+            self.reset_timer.cancel()
+        self.sender.close()
+        self.receiver.close()
+
+
+class GameNetServer:
+    """H-UDP server endpoint: one bound socket serving many peers, each with its own session.
+
+    Datagrams are dispatched to sessions with a dict lookup on the source address.
+    A session is created for the first data packet from a new address and evicted
+    after idle_timeout seconds without datagrams from it.
+
+    The peer may still hold sequence state from an evicted session (or from before the
+    server restarted), so every new session starts with a CHANNEL_RESET handshake: until
+    the peer confirms it has restarted its streams from seq 0, only unreliable data is
+    accepted from it, and reliable packets sent to it are resent once it has.
+    """
+
+    def __init__(self, local_addr: Tuple[str, int], idle_timeout: float = IDLE_TIMEOUT,
+                 max_sessions: int = MAX_SESSIONS, max_ack_delay: float = MAX_ACK_DELAY,
+                 ack_every: int = ACK_EVERY, bundle_delay: Optional[float] = None,
+                 congestion_control: Optional[str] = None, pacing_rate: Optional[float] = None,
+                 pacing_burst: int = PACING_BURST, compression_dict: Optional[bytes] = None,
+                 sequenced_unreliable: bool = False,
+                 coalesce_key: Optional[Callable[[bytes], Optional[Hashable]]] = None,
+                 impairment: Optional[LinkConditions] = None, reuse_port: bool = False,
+                 fec_block: Optional[int] = None, fec_repair: int = 1, outbound_limit: int = OUTBOUND_LIMIT):
+        self.local_addr = local_addr
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_ack_delay = max_ack_delay
+        self.ack_every = ack_every
+        self.sequenced_unreliable = sequenced_unreliable
+        # Passed to each session's HUDPSender; the compressor is shared by every session's sender and receiver
+        self.sender_options = dict(bundle_delay=bundle_delay, congestion_control=congestion_control,
+                                   pacing_rate=pacing_rate, pacing_burst=pacing_burst,
+                                   compressor=PayloadCompressor(compression_dict) if compression_dict else None,
+                                   fec_block=fec_block, fec_repair=fec_repair, outbound_limit=outbound_limit)
+
+        # Create UDP socket. With reuse_port, several servers (see gameNetWorkers.py) can bind
+        # the same port and the kernel spreads peers across them by hashing the 4-tuple
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise OSError("SO_REUSEPORT is not supported on this platform")
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(local_addr)
+
+        peer_key = None
+        if coalesce_key:
+            # Coalesce per peer: only the newest undelivered unreliable message per (addr, key) is kept
+            packet_key = unreliable_key(coalesce_key)
+
+            def peer_key(item: Tuple[Tuple[str, int], HUDPPacket]) -> Optional[Hashable]:
+                key = packet_key(item[1])
+                return None if key is None else (item[0], key)
+        # (addr, packet) from every session, queued by the packet's channel
+        self.ready_queue = ReadyQueue(peer_key, channel=lambda item: item[1].channel_type)
+        self.sessions: Dict[Tuple[str, int], PeerSession] = {}
+        self.lock = threading.Lock() # Lock for sessions and the closed sessions' metrics
+        # Metrics of sessions already evicted or closed, so totals and merged_latency cover every peer served
+        self.closed_counters = dict.fromkeys(SESSION_COUNTERS, 0)
+        self.closed_reliable_latency = LatencyHistogram()
+        self.closed_unreliable_latency = LatencyHistogram()
+        self.closed = False
+        self.timers = TimerQueue()
+        self.eviction_timer = self.timers.call_later(self.idle_timeout / 2, self._evict_idle_sessions)
+        # Datagrams to every peer go through the impairment emulator if one is configured
+        self.send_sock = ImpairedSocket(self.sock, impairment, self.timers) if impairment else self.sock
+        self.dispatcher = HUDPDispatcher(self.sock, self._dispatch)
+
+    def _dispatch(self, packet: HUDPPacket, addr: Tuple[str, int]):
+        """Dispatcher handler: route a datagram to the session of the peer it came from"""
+        session = self.sessions.get(addr)
+        if session is None:
+            # Only data packets open a session; a stray ACK has nothing to acknowledge
+            if packet.channel_type in (CHANNEL_ACK, CHANNEL_RESET, CHANNEL_RESET_ACK):
+                return
+            session = self._open_session(addr)
+            if session is None:
+                return
+        session.last_active = time.monotonic()
+        if session.reset_nonce is not None:
+            if packet.channel_type == CHANNEL_RESET_ACK and packet.seq_num == session.reset_nonce:
+                self._finish_reset(session, packet.timestamp)
+            elif packet.channel_type == CHANNEL_UNRELIABLE:
+                session.receiver.handle_unreliable(packet)
+            # Anything else is numbered for the peer's previous session
+            return
+        route_packet(packet, addr, session.sender, session.receiver)
+
+    def _open_session(self, addr: Tuple[str, int]) -> Optional[PeerSession]:
+        """Create the session for a new peer, or None if the server is full or closed"""
+        with self.lock:
+            session = self.sessions.get(addr)
+            if session is None and self.closed:
+                return None
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    if TRACER.level >= TRACE_EVENTS:
+                        TRACER.record(EVENT_SESSION_REFUSED, 0, *peer_fields(addr))
+                    return None
+                session = PeerSession(self.send_sock, addr, self.timers, self.ready_queue,
+                                      self.max_ack_delay, self.ack_every, self.sequenced_unreliable,
+                                      **self.sender_options)
+                self.sessions[addr] = session
+                if TRACER.level >= TRACE_EVENTS:
+                    TRACER.record(EVENT_SESSION_OPEN, 0, *peer_fields(addr))
+                session.reset_nonce = random.randint(1, 0xFFFFFFFF)
+                self._send_reset(session)
+            return session
+
+    def _send_reset(self, session: PeerSession):
+        """(Re)send a session's CHANNEL_RESET, backing off like a retransmission"""
+        session.sender.send_control(CHANNEL_RESET, session.reset_nonce)
+        session.reset_timer = self.timers.call_later(session.sender.rtt.backoff_timeout(session.reset_attempts),
+                                                     self._on_reset_timer, session)
+
+    def _on_reset_timer(self, session: PeerSession):
+        """Timer callback: resend an unconfirmed reset, or give up on the peer after MAX_RETRIES"""
+        with self.lock:
+            if session.reset_nonce is None or self.sessions.get(session.addr) is not session:
+                return
+            if session.reset_attempts < MAX_RETRIES:
+                session.reset_attempts += 1
+                self._send_reset(session)
+                return
+            self._remove_session(session.addr)
+        self._close_session(session)
+
+    def _finish_reset(self, session: PeerSession, timestamp: float):
+        """The peer confirmed the reset at timestamp: accept its reliable traffic sent from then
+        on and resend anything already sent to it, whose ACKs were ignored as belonging to the old session"""
+        with self.lock:
+            if session.reset_nonce is None:
+                return
+            session.reset_nonce = None
+            session.reset_timer.cancel()
+            # The peer confirms before restarting its streams, so anything it sent earlier is stale
+            session.receiver.reset_time = timestamp
+        session.sender.reset()
+
+    def _evict_idle_sessions(self):
+        """Timer callback: close sessions that have been idle for idle_timeout"""
+        deadline = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [self._remove_session(addr) for addr, session in list(self.sessions.items())
+                    if session.last_active < deadline]
+        for session in idle:
+            self._close_session(session)
+        self.eviction_timer = self.timers.call_later(self.idle_timeout / 2, self._evict_idle_sessions)
+
+    def _remove_session(self, addr: Tuple[str, int]) -> PeerSession:
+        """Remove a peer's session, keeping its metrics, and return it. Caller must hold self.lock
+        and pass the session to _close_session once it is released, as closing resolves delivery
+        futures whose callbacks may send through this server"""
+        session = self.sessions.pop(addr)
+        for name in SESSION_COUNTERS:
+            self.closed_counters[name] += getattr(session, name)
+        self.closed_reliable_latency.merge(session.reliable_latency)
+        self.closed_unreliable_latency.merge(session.unreliable_latency)
+        return session
+
+    def _close_session(self, session: PeerSession):
+        """Close a session returned by _remove_session, without holding self.lock"""
+        session.close()
+        if TRACER.level >= TRACE_EVENTS:
+            TRACER.record(EVENT_SESSION_CLOSE, 0, *peer_fields(session.addr))
+
+    def _session_for_send(self, addr: Tuple[str, int]) -> PeerSession:
+        """The session to send to a peer through, opened if there is none yet"""
+        session = self.sessions.get(addr) or self._open_session(addr)
+        if session is None:
+            if self.closed:
+                raise ConnectionAbortedError("GameNetServer is closed")
+            raise ConnectionRefusedError(f"Session limit reached, cannot send to {addr}")
+        return session
+
+    def send(self, addr: Tuple[str, int], payload: bytes, reliable: bool = False, stream: int = 0) -> int:
+        """Send data to a peer on either reliable or unreliable channel (see GameNetAPI.send for streams)"""
+        session = self._session_for_send(addr)
+        if reliable:
+            seq = session.sender.send_reliable(payload, stream=stream)
+        else:
+            seq = session.sender.send_unreliable(payload)
+        session._record_sent(seq, reliable)
+        return seq
+
+    def send_nowait(self, addr: Tuple[str, int], payload: bytes, stream: int = 0) -> Future:
+        """Send data to a peer on a reliable stream without blocking (see GameNetAPI.send_nowait).
+        Each session has its own outbound queue"""
+        session = self._session_for_send(addr)
+        future = session.sender.send_reliable_nowait(payload, stream)
+        session._record_sent(-1, True)  # Queued messages have no seq yet
+        return future
+
+    def recv(self, timeout: Optional[float] = 1 / MAX_SEND_RATE,
+             channel: Optional[int] = None) -> Optional[Tuple[Tuple[str, int], HUDPPacket]]:
+        """Receive (peer address, packet) from any session, from one channel only if given"""
+        try:
+            addr, packet = self.ready_queue.get(timeout=timeout, channel=channel)
+        except queue.Empty:
+            return None
+        session = self.sessions.get(addr)
+        if session is not None:
+            session._record_received(packet)
+        return addr, packet
+
+    def recv_many(self, max_n: int = RECV_BATCH, timeout: Optional[float] = 0.0,
+                  channel: Optional[int] = None) -> List[Tuple[Tuple[str, int], HUDPPacket]]:
+        """Receive up to max_n (peer address, packet) pairs that are ready, waiting up to
+        timeout for the first one (see GameNetAPI.recv_many)"""
+        items = self.ready_queue.get_many(max_n, timeout, channel)
+        now = time.time()
+        for addr, packet in items:
+            session = self.sessions.get(addr)
+            if session is not None:
+                session._record_received(packet, now)
+        return items
+
+    def display_metrics(self, duration: float):
+        """Display collected metrics for every session"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        print(f"\n[gameNetServer] {len(sessions)} active sessions")
+        for session in sessions:
+            print(f"\n[gameNetServer] Session {session.addr}")
+            session.display_metrics(duration)
+
+        reliable, unreliable = self.merged_latency()
+        print(f"\n[gameNetServer] All sessions:")
+        print(f"  RELIABLE: Packets received = {reliable.count}")
+        print_latency(reliable)
+        print(f"  UNRELIABLE: Packets received = {unreliable.count}")
+        print_latency(unreliable)
+
+    def merged_latency(self, reset: bool = False) -> Tuple[LatencyHistogram, LatencyHistogram]:
+        """Reliable and unreliable latency histograms merged across all sessions, closed ones
+        included, optionally resetting the histograms to start a new reporting interval"""
+        reliable, unreliable = LatencyHistogram(), LatencyHistogram()
+        with self.lock:
+            sessions = list(self.sessions.values())
+            reliable.merge(self.closed_reliable_latency.snapshot(reset))
+            unreliable.merge(self.closed_unreliable_latency.snapshot(reset))
+        for session in sessions:
+            reliable.merge(session.reliable_latency.snapshot(reset))
+            unreliable.merge(session.unreliable_latency.snapshot(reset))
+        return reliable, unreliable
+
+    def totals(self) -> Dict[str, int]:
+        """Packet and byte counters summed across all sessions, closed ones included,
+        and the number of active sessions"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+            totals = dict(self.closed_counters)
+        totals["sessions"] = len(sessions)
+        for session in sessions:
+            for name in SESSION_COUNTERS:
+                totals[name] += getattr(session, name)
+        return totals
+
+    def close(self):
+        """Close the server and cleanup resources"""
+        self.eviction_timer.cancel()
+        with self.lock:
+            self.closed = True  # Delivery callbacks run by closing the sessions cannot open new ones
+            sessions = [self._remove_session(addr) for addr in list(self.sessions)]
+        for session in sessions:
+            self._close_session(session)
+        self.dispatcher.close()
+        self.timers.close()
+        self.sock.close()
@@ -0,0 +1,256 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from gameNetAPI import GameNetAPI
+from gameNetServer import GameNetServer, SESSION_COUNTERS
+from metrics import LatencyHistogram, print_latency
+from packet import HUDPPacket, CHANNEL_RELIABLE
+from receiver import RECV_BATCH
+
+STATS_INTERVAL = 1.0  # Seconds between stats reports from each worker
+JOIN_TIMEOUT = 5.0  # Seconds to wait for a worker to exit before terminating it
+
+# Called in the worker process for every received message
+Handler = Callable[[GameNetServer, Tuple[str, int], HUDPPacket], None]
+
+class WorkerStats:
+    """Counters and latency histograms of one worker's GameNetServer, or of several merged.
+
+    Workers report cumulative stats, so the launcher only keeps the latest report of each
+    and a lost or late report is corrected by the next one. Histograms pickle sparsely,
+    so a report is a few hundred bytes.
+    """
+
+    def __init__(self, worker: int = -1):
+        self.worker = worker  # -1 for merged stats
+        self.pid = os.getpid()
+        self.time = time.time()
+        self.counters: Dict[str, int] = dict.fromkeys(("sessions",) + SESSION_COUNTERS, 0)
+        self.reliable_latency = LatencyHistogram()
+        self.unreliable_latency = LatencyHistogram()
+
+    @classmethod
+    def from_server(cls, worker: int, server: GameNetServer) -> 'WorkerStats':
+        stats = cls(worker)
+        stats.counters = server.totals()
+        stats.reliable_latency, stats.unreliable_latency = server.merged_latency()
+        return stats
+
+    def merge(self, other: 'WorkerStats'):
+        """Add another worker's stats to these"""
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        self.reliable_latency.merge(other.reliable_latency)
+        self.unreliable_latency.merge(other.unreliable_latency)
+
+    def display_metrics(self, duration: float):
+        """Display the metrics GameNetAPI.display_metrics reports, for all sessions together"""
+        counters = self.counters
+        print(f"  Sessions = {counters['sessions']}")
+        print(f"  SENT: reliable = {counters['sent_reliable']}, unreliable = {counters['sent_unreliable']}")
+        print(f"  RELIABLE: Packets received = {counters['received_reliable']}, "
+              f"throughput = {(counters['reliable_bytes_received'] / duration):.2f} bytes/s")
+        print_latency(self.reliable_latency)
+        print(f"  UNRELIABLE: Packets received = {counters['received_unreliable']}, "
+              f"throughput = {(counters['unreliable_bytes_received'] / duration):.2f} bytes/s")
+        print_latency(self.unreliable_latency)
+
+
+def echo(server: GameNetServer, addr: Tuple[str, int], packet: HUDPPacket):
+    """Default handler: send every message back to its sender on the channel it arrived on.
+    Reliable echoes are queued with send_nowait, so a peer with a full window never stalls the
+    worker's receive loop for the others, and dropped if that peer's outbound queue is full"""
+    if packet.channel_type != CHANNEL_RELIABLE:
+        server.send(addr, packet.payload)
+        return
+    try:
+        server.send_nowait(addr, packet.payload)
+    except queue.Full:
+        pass  # The peer is not acknowledging fast enough to take more
+
+def run_worker(worker: int, local_addr: Tuple[str, int], handler: Handler, server_options: Dict[str, Any],
+               stats_queue: multiprocessing.Queue, stop_event, stats_interval: float):
+    """Worker process: serve the peers the kernel hashes to this worker's socket,
+    reporting WorkerStats every stats_interval seconds and once more on exit"""
+    server = GameNetServer(local_addr, reuse_port=True, **server_options)
+    next_report = time.monotonic() + stats_interval
+    try:
+        while not stop_event.is_set():
+            for addr, packet in server.recv_many(RECV_BATCH, timeout=0.05):
+                handler(server, addr, packet)
+            if time.monotonic() >= next_report:
+                stats_queue.put(WorkerStats.from_server(worker, server))
+                next_report += stats_interval
+    finally:
+        stats_queue.put(WorkerStats.from_server(worker, server))
+        server.close()
+
+
+class GameNetWorkers:
+    """Runs a GameNetServer in each of several worker processes, all bound to one port with
+    SO_REUSEPORT, so a busy server is not limited to the one core the GIL allows a process.
+
+    The kernel picks the worker for each datagram by hashing its 4-tuple, so every peer
+    stays with one worker and each worker's sessions are independent. Workers are forked,
+    so the handler does not need to be picklable, and report their stats over a
+    multiprocessing queue (see stats and display_metrics). The port must be fixed, since
+    workers binding port 0 would each get a different one.
+    """
+
+    def __init__(self, local_addr: Tuple[str, int], handler: Handler = echo, workers: Optional[int] = None,
+                 stats_interval: float = STATS_INTERVAL, **server_options):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise OSError("SO_REUSEPORT is not supported on this platform")
+        if local_addr[1] == 0:
+            raise ValueError("Worker processes need a fixed port to share")
+        self.local_addr = local_addr
+        self.workers = workers or os.cpu_count() or 1
+        context = multiprocessing.get_context("fork")
+        self.stats_queue = context.Queue()
+        self.stop_event = context.Event()
+        self.processes = [
+            context.Process(target=run_worker, name=f"GameNetWorker-{worker}", daemon=True,
+                            args=(worker, local_addr, handler, server_options, self.stats_queue,
+                                  self.stop_event, stats_interval))
+            for worker in range(self.workers)
+        ]
+        self.latest: Dict[int, WorkerStats] = {}  # Newest report of each worker
+
+    def start(self):
+        """Fork the workers"""
+        for process in self.processes:
+            process.start()
+        print(f"[gameNetWorkers] Started {self.workers} workers on port {self.local_addr[1]}")
+
+    def _collect(self, timeout: float = 0.0):
+        """Take the reports waiting in the stats queue, waiting up to timeout for the first"""
+        try:
+            stats = self.stats_queue.get(timeout=timeout) if timeout else self.stats_queue.get_nowait()
+            while True:
+                self.latest[stats.worker] = stats
+                stats = self.stats_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def stats(self) -> WorkerStats:
+        """Stats of all workers merged, as of their latest reports"""
+        self._collect()
+        merged = WorkerStats()
+        for stats in self.latest.values():
+            merged.merge(stats)
+        return merged
+
+    def display_metrics(self, duration: float):
+        """Display each worker's message counts and the merged metrics of all workers"""
+        merged = self.stats()
+        print(f"\n[gameNetWorkers] {len(self.latest)} of {self.workers} workers reporting")
+        for worker, stats in sorted(self.latest.items()):
+            counters = stats.counters
+            print(f"  Worker {worker} (pid {stats.pid}): {counters['sessions']} sessions, "
+                  f"{counters['received_reliable'] + counters['received_unreliable']} packets received")
+        print(f"\n[gameNetWorkers] All workers:")
+        merged.display_metrics(duration)
+
+    def close(self):
+        """Stop the workers and collect their final reports"""
+        self.stop_event.set()
+        deadline = time.monotonic() + JOIN_TIMEOUT
+        for process in self.processes:
+            if process.pid is None:
+                continue
+            # Read reports while waiting, as a worker cannot exit while its queue feeder is blocked
+            while process.is_alive() and time.monotonic() < deadline:
+                self._collect(timeout=0.05)
+            process.join(timeout=0)
+            if process.is_alive():
+                print(f"[gameNetWorkers] {process.name} did not stop, terminating it")
+                process.terminate()
+        self._collect()
+
+
+def run_client(server_addr: Tuple[str, int], duration: float, rate: float, reliable_ratio: float):
+    """Load generator process: send messages to the server for duration and drain the echoes"""
+    api = GameNetAPI(("127.0.0.1", 0), server_addr)
+    interval = 1.0 / rate if rate > 0 else 0.0
+    start = time.time()
+    sent = 0
+    try:
+        while time.time() - start < duration:
+            reliable = reliable_ratio > 0 and sent % round(1 / reliable_ratio) == 0
+            api.send(b'{"client": %d, "seq": %d}' % (os.getpid(), sent), reliable=reliable)
+            sent += 1
+            api.recv_many(timeout=0)
+            if interval:
+                time.sleep(max(start + sent * interval - time.time(), 0))
+    finally:
+        api.close()
+
+def scaling_benchmark(port: int, worker_counts: List[int], clients: int, duration: float, rate: float,
+                      reliable_ratio: float):
+    """Messages per second the server handles with each number of workers, for the same client load"""
+    context = multiprocessing.get_context("fork")
+    results = []
+    for workers in worker_counts:
+        pool = GameNetWorkers(("127.0.0.1", port), workers=workers)
+        pool.start()
+        time.sleep(0.5)  # Let every worker bind before the first client sends
+        loaders = [context.Process(target=run_client, args=(("127.0.0.1", port), duration, rate, reliable_ratio))
+                   for _ in range(clients)]
+        for loader in loaders:
+            loader.start()
+        for loader in loaders:
+            loader.join()
+        pool.close()
+        stats = pool.stats()
+        received = stats.counters["received_reliable"] + stats.counters["received_unreliable"]
+        results.append((workers, received / duration, stats))
+
+    base = results[0][1] or 1.0
+    print(f"\n{'workers':>8} {'msgs/s':>10} {'speedup':>8} {'rel p99 ms':>11} {'unrel p99 ms':>13}")
+    print("-" * 54)
+    for workers, throughput, stats in results:
+        reliable_p99 = stats.reliable_latency.percentile(99)
+        unreliable_p99 = stats.unreliable_latency.percentile(99)
+        print(f"{workers:>8} {throughput:>10.0f} {throughput / base:>8.2f} "
+              f"{reliable_p99 if reliable_p99 is not None else float('nan'):>11.2f} "
+              f"{unreliable_p99 if unreliable_p99 is not None else float('nan'):>13.2f}")
+    print(f"({os.cpu_count()} CPUs; clients run on the same machine and compete with the workers)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Echo server on SO_REUSEPORT worker processes, "
+                                                 "or a benchmark of how it scales with workers")
+    parser.add_argument("--port", type=int, default=10500, help="Port shared by the workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1],
+                        help="Worker processes (several values with --benchmark to compare them)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to serve, or to load each configuration")
+    parser.add_argument("--benchmark", action="store_true", help="Load the server from local client processes")
+    parser.add_argument("--clients", type=int, default=8, help="Client processes for --benchmark")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Messages per second per client for --benchmark (0 for unpaced)")
+    parser.add_argument("--reliable-ratio", type=float, default=0.1,
+                        help="Fraction of benchmark messages sent reliably")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        scaling_benchmark(args.port, args.workers, args.clients, args.duration, args.rate, args.reliable_ratio)
+        return
+
+    pool = GameNetWorkers(("0.0.0.0", args.port), workers=args.workers[0])
+    pool.start()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+        pool.display_metrics(args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+from typing import Optional, Tuple, Union
+from timers import TimerQueue
+
+IP_UDP_OVERHEAD = 28  # IPv4 + UDP header bytes counted against the bandwidth cap
+REORDER_DELAY = 0.01  # Extra seconds a reordered datagram is held so later ones overtake it
+MAX_QUEUE_DELAY = 0.2  # Longest a datagram may queue behind the bandwidth cap before it is dropped
+
+class BernoulliLoss:
+    """Independent loss with a fixed probability"""
+
+    def __init__(self, probability: float):
+        self.probability = probability
+
+    def lost(self, rng: random.Random) -> bool:
+        return rng.random() < self.probability
+
+
+class GilbertElliottLoss:
+    """Two-state Markov loss model producing bursts.
+
+    Each datagram first moves the channel between the good and bad states (good to bad with
+    probability p, bad to good with probability r), then is lost with the state's loss rate.
+    The mean burst length is 1/r and the long-run loss rate is
+    (p * loss_bad + r * loss_good) / (p + r).
+    """
+
+    def __init__(self, p: float, r: float, loss_good: float = 0.0, loss_bad: float = 1.0):
+        self.p = p
+        self.r = r
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.bad = False
+
+    def lost(self, rng: random.Random) -> bool:
+        if rng.random() < (self.r if self.bad else self.p):
+            self.bad = not self.bad
+        return rng.random() < (self.loss_bad if self.bad else self.loss_good)
+
+
+class LinkConditions:
+    """Impairments applied to datagrams leaving one endpoint (see ImpairedSocket)"""
+
+    def __init__(self, loss: Union[BernoulliLoss, GilbertElliottLoss, None] = None, delay: float = 0.0,
+                 jitter: float = 0.0, reorder: float = 0.0, duplicate: float = 0.0,
+                 bandwidth: Optional[float] = None, seed: Optional[int] = None):
+        self.loss = loss
+        self.delay = delay  # One-way delay in seconds
+        self.jitter = jitter  # Standard deviation of the delay in seconds
+        self.reorder = reorder  # Probability a datagram is held back by REORDER_DELAY
+        self.duplicate = duplicate  # Probability a datagram is sent twice
+        self.bandwidth = bandwidth  # Bytes per second, or None for no cap
+        self.seed = seed
+
+
+class ImpairedSocket:
+    """Stands in for the socket (or transport) an endpoint sends with, and applies
+    LinkConditions to every outgoing datagram.
+
+    Delayed datagrams are scheduled on the endpoint's TimerQueue (or event loop) instead of
+    sleeping, so the calling thread is never blocked. Wrap both endpoints to impair both
+    directions. Everything other than sendto is passed through to the wrapped socket.
+    """
+
+    def __init__(self, sock: Union[socket.socket, asyncio.DatagramTransport], conditions: LinkConditions,
+                 timers: Union[TimerQueue, asyncio.AbstractEventLoop]):
+        self.sock = sock
+        self.conditions = conditions
+        self.timers = timers
+        self.rng = random.Random(conditions.seed)
+        self.link_free = 0.0  # time.monotonic() at which the bandwidth-capped link is idle again
+        self.lock = threading.Lock() # sendto is called from application, timer and dispatcher threads
+
+        # Counters
+        self.sent = 0
+        self.lost = 0
+        self.queue_dropped = 0
+        self.duplicated = 0
+        self.reordered = 0
+
+    def sendto(self, data: bytes, addr: Tuple[str, int]) -> int:
+        """Apply loss, bandwidth cap, delay, jitter, reordering and duplication to one datagram"""
+        conditions = self.conditions
+        with self.lock:
+            self.sent += 1
+            if conditions.loss is not None and conditions.loss.lost(self.rng):
+                self.lost += 1
+                return len(data)
+
+            copies = 1
+            if conditions.duplicate and self.rng.random() < conditions.duplicate:
+                self.duplicated += 1
+                copies = 2
+
+            now = time.monotonic()
+            delays = []
+            for _ in range(copies):
+                queue_delay = 0.0
+                if conditions.bandwidth:
+                    # Each datagram occupies the link for its serialization time after those queued before it
+                    start = max(now, self.link_free)
+                    if start - now > MAX_QUEUE_DELAY:
+                        self.queue_dropped += 1
+                        continue
+                    self.link_free = start + (len(data) + IP_UDP_OVERHEAD) / conditions.bandwidth
+                    queue_delay = self.link_free - now
+                delay = queue_delay + conditions.delay
+                if conditions.jitter:
+                    delay += self.rng.gauss(0.0, conditions.jitter)
+                if conditions.reorder and self.rng.random() < conditions.reorder:
+                    self.reordered += 1
+                    delay += REORDER_DELAY
+                delays.append(max(delay, 0.0))
+
+        for delay in delays:
+            if delay > 0:
+                # Keep a copy in case the caller reuses its buffer (free for bytes)
+                self.timers.call_later(delay, self._send_now, bytes(data), addr)
+            else:
+                self._send_now(data, addr)
+        return len(data)
+
+    def _send_now(self, data: bytes, addr: Tuple[str, int]):
+        try:
+            self.sock.sendto(data, addr)
+        except OSError:
+            pass # The endpoint was closed while the datagram was in flight
+
+    def __getattr__(self, name: str):
+        return getattr(self.sock, name)
+
+    def stats(self) -> str:
+        """One-line summary of what was done to the datagrams"""
+        return (f"sent={self.sent} lost={self.lost} queue_dropped={self.queue_dropped} "
+                f"duplicated={self.duplicated} reordered={self.reordered}")
+
+
+def add_impairment_arguments(parser):
+    """Add the link impairment options used by runner.py to an argparse parser"""
+    group = parser.add_argument_group("link impairment (applied in each direction)")
+    loss = group.add_mutually_exclusive_group()
+    loss.add_argument("--loss", type=float, default=0.0, help="Independent (Bernoulli) loss probability")
+    loss.add_argument("--burst-loss", type=float, nargs=2, metavar=("P", "R"), default=None,
+                      help="Gilbert-Elliott loss: good-to-bad and bad-to-good transition probabilities")
+    group.add_argument("--delay", type=float, default=0.0, help="One-way delay in ms")
+    group.add_argument("--jitter", type=float, default=0.0, help="Delay standard deviation in ms")
+    group.add_argument("--reorder", type=float, default=0.0, help="Probability a datagram is delayed past later ones")
+    group.add_argument("--duplicate", type=float, default=0.0, help="Probability a datagram is duplicated")
+    group.add_argument("--bandwidth", type=float, default=None, help="Bandwidth cap in kbit/s")
+    group.add_argument("--impair-seed", type=int, default=None, help="Random seed for reproducible impairment")
+
+def conditions_from_args(args, direction: int = 0) -> Optional[LinkConditions]:
+    """LinkConditions from add_impairment_arguments options, or None if nothing is impaired.
+    direction offsets the seed so both directions get independent but reproducible losses"""
+    if args.burst_loss:
+        loss = GilbertElliottLoss(*args.burst_loss)
+    elif args.loss:
+        loss = BernoulliLoss(args.loss)
+    else:
+        loss = None
+    if (loss is None and not args.delay and not args.jitter and not args.reorder and not args.duplicate
+            and not args.bandwidth):
+        return None
+    return LinkConditions(
+        loss=loss,
+        delay=args.delay / 1000,
+        jitter=args.jitter / 1000,
+        reorder=args.reorder,
+        duplicate=args.duplicate,
+        bandwidth=args.bandwidth * 1000 / 8 if args.bandwidth else None,
+        seed=None if args.impair_seed is None else args.impair_seed + direction,
+    )
@@ -0,0 +1,236 @@
+import threading
+import time
+from typing import Dict, List, Optional
+from packet import HUDPPacket, CHANNEL_RELIABLE, CHANNEL_UNRELIABLE
+from tracing import TRACER, TRACE_PACKETS, EVENT_DELIVER
+
+SUB_BUCKET_BITS = 7  # 128 linear sub-buckets per power of two: values are kept within 1/64 (~1.6%)
+MAX_TRACKABLE_US = 3600 * 1000000  # Latencies are recorded in microseconds, clamped to one hour
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+class LatencyHistogram:
+    """HDR-style log-bucketed latency histogram.
+
+    Values below 2**SUB_BUCKET_BITS microseconds get a bucket each; above that, every power
+    of two is split into 2**(SUB_BUCKET_BITS - 1) linear buckets, so recording is O(1), memory
+    is fixed (under 2k counters) and percentiles have bounded relative error. Histograms with
+    the same layout can be merged, e.g. across server sessions.
+    """
+
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (self._index(MAX_TRACKABLE_US) + 1)
+        self.count = 0
+        self.total_us = 0
+        self.min_us: Optional[int] = None
+        self.max_us = 0
+        self.lock = threading.Lock() # Recorded by the application thread, snapshotted by dashboards
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        """Bucket index of a value in microseconds"""
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return cls.SUB_BUCKETS + (shift - 1) * cls.HALF_SUB_BUCKETS + (value >> shift) - cls.HALF_SUB_BUCKETS
+
+    @classmethod
+    def _bucket_value(cls, index: int) -> float:
+        """Midpoint of a bucket's value range in microseconds"""
+        if index < cls.SUB_BUCKETS:
+            return float(index)
+        shift, sub = divmod(index - cls.SUB_BUCKETS, cls.HALF_SUB_BUCKETS)
+        shift += 1
+        return ((sub + cls.HALF_SUB_BUCKETS) << shift) + ((1 << shift) - 1) / 2
+
+    def record(self, latency_ms: float):
+        """Add one latency sample"""
+        value = min(max(int(latency_ms * 1000), 0), MAX_TRACKABLE_US)
+        with self.lock:
+            self.counts[self._index(value)] += 1
+            self.count += 1
+            self.total_us += value
+            if self.min_us is None or value < self.min_us:
+                self.min_us = value
+            if value > self.max_us:
+                self.max_us = value
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Mean latency in ms, or None if empty"""
+        return self.total_us / self.count / 1000 if self.count else None
+
+    @property
+    def max(self) -> Optional[float]:
+        """Exact maximum latency in ms, or None if empty"""
+        return self.max_us / 1000 if self.count else None
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Latency in ms at or below which `percentile` percent of samples fall, or None if empty"""
+        with self.lock:
+            if not self.count:
+                return None
+            rank = max(1, -(-self.count * percentile // 100))  # Ceiling without float rounding surprises
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= rank:
+                    # Never report beyond the exact extremes
+                    value = min(max(self._bucket_value(index), self.min_us), self.max_us)
+                    return value / 1000
+        return self.max
+
+    def percentiles(self) -> Dict[str, Optional[float]]:
+        """p50/p90/p99/p99.9 and max in ms"""
+        summary = {f"p{p:g}": self.percentile(p) for p in PERCENTILES}
+        summary["max"] = self.max
+        return summary
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Add another histogram's samples to this one"""
+        with other.lock:
+            counts, count, total_us = list(other.counts), other.count, other.total_us
+            min_us, max_us = other.min_us, other.max_us
+        if not count:
+            return
+        with self.lock:
+            for index, bucket_count in enumerate(counts):
+                if bucket_count:
+                    self.counts[index] += bucket_count
+            self.count += count
+            self.total_us += total_us
+            if self.min_us is None or min_us < self.min_us:
+                self.min_us = min_us
+            self.max_us = max(self.max_us, max_us)
+
+    def snapshot(self, reset: bool = False) -> 'LatencyHistogram':
+        """Copy of the histogram, optionally resetting this one so the next snapshot covers a fresh interval"""
+        copy = LatencyHistogram()
+        with self.lock:
+            copy.counts, copy.count, copy.total_us = list(self.counts), self.count, self.total_us
+            copy.min_us, copy.max_us = self.min_us, self.max_us
+            if reset:
+                self._clear()
+        return copy
+
+    def __getstate__(self) -> Dict:
+        """Pickled without the lock and with only the non-empty buckets, so histograms are
+        cheap to send between processes"""
+        with self.lock:
+            return {"counts": {index: count for index, count in enumerate(self.counts) if count},
+                    "count": self.count, "total_us": self.total_us, "min_us": self.min_us, "max_us": self.max_us}
+
+    def __setstate__(self, state: Dict):
+        self.__init__()
+        for index, count in state["counts"].items():
+            self.counts[index] = count
+        self.count, self.total_us = state["count"], state["total_us"]
+        self.min_us, self.max_us = state["min_us"], state["max_us"]
+
+    def reset(self):
+        """Discard all samples"""
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        """Caller must hold self.lock"""
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+
+class GameNetMetrics:
+    """Packet statistics shared by the GameNetAPI front ends.
+
+    Subclasses set self.sender to their HUDPSender.
+    """
+
+    def __init__(self):
+        # Track packet statistics
+        self.sent_reliable = 0
+        self.sent_unreliable = 0
+        self.reliable_bytes_received = 0
+        self.unreliable_bytes_received = 0
+        # Fixed-size latency histograms, so long runs do not grow memory
+        self.reliable_latency = LatencyHistogram()
+        self.unreliable_latency = LatencyHistogram()
+        self.received_reliable = 0
+        self.received_unreliable = 0
+        self.last_reliable_latency: Optional[float] = None
+        self.last_unreliable_latency: Optional[float] = None
+        # J(i) = J(i-1) + (|D(i-1,i)| - J(i-1))/16
+        self.reliable_jitter = 0
+        self.unreliable_jitter = 0
+
+    @property
+    def rtt(self) -> Optional[float]:
+        """Smoothed RTT of the reliable channel in seconds, or None before the first sample"""
+        return self.sender.rtt.srtt
+
+    @property
+    def rto(self) -> float:
+        """Current retransmission timeout of the reliable channel in seconds"""
+        return self.sender.rtt.rto
+
+    @property
+    def cwnd(self) -> Optional[float]:
+        """Congestion window of the reliable channel in packets, or None without congestion control"""
+        return self.sender.congestion.cwnd if self.sender.congestion is not None else None
+
+    def _record_sent(self, seq: int, reliable: bool):
+        """Count a sent packet"""
+        # Datagrams are traced by HUDPSender, which knows their stream
+        if reliable:
+            self.sent_reliable += 1
+        else:
+            self.sent_unreliable += 1
+
+    def _record_received(self, packet: HUDPPacket, now: Optional[float] = None):
+        """Update byte counts, latency and jitter for a delivered packet, received at now
+        (time.time(), read here if not given)"""
+        latency_ms = ((time.time() if now is None else now) - packet.timestamp) * 1000
+        if TRACER.level >= TRACE_PACKETS:
+            TRACER.record(EVENT_DELIVER, packet.channel_type, packet.seq_num, max(int(latency_ms * 1000), 0))
+        if packet.channel_type == CHANNEL_RELIABLE:
+            self.reliable_bytes_received += len(packet.payload)
+            self.received_reliable += 1
+            latency_diff = abs(latency_ms - self.last_reliable_latency if self.last_reliable_latency is not None else 0)
+            self.reliable_jitter = self.reliable_jitter + (latency_diff - self.reliable_jitter) / 16
+            self.last_reliable_latency = latency_ms
+            self.reliable_latency.record(latency_ms)
+        elif packet.channel_type == CHANNEL_UNRELIABLE:
+            self.unreliable_bytes_received += len(packet.payload)
+            self.received_unreliable += 1
+            latency_diff = abs(latency_ms - self.last_unreliable_latency if self.last_unreliable_latency is not None else 0)
+            self.unreliable_jitter = self.unreliable_jitter + (latency_diff - self.unreliable_jitter) / 16
+            self.last_unreliable_latency = latency_ms
+            self.unreliable_latency.record(latency_ms)
+
+    def display_metrics(self, duration: float):
+        """Display collected metrics"""
+        print()
+        print(f"[gameNetAPI] SENT METRICS:")
+        print(f"  RELIABLE: Packets sent = {self.sent_reliable}")
+        print(f"  UNRELIABLE: Packets sent = {self.sent_unreliable}")
+        if self.rtt is not None:
+            print(f"  RTT = {self.rtt * 1000:.2f} ms, RTO = {self.rto * 1000:.2f} ms")
+        if self.cwnd is not None:
+            print(f"  Congestion window = {self.cwnd:.1f} packets")
+        print(f"[gameNetAPI] RECEIVED METRICS:")
+        print(f"  RELIABLE: Packets received = {self.received_reliable}, throughput = {(self.reliable_bytes_received / duration):.2f} bytes/s")
+        print_latency(self.reliable_latency)
+        print(f"    Jitter = {self.reliable_jitter:.2f} ms")
+        print(f"  UNRELIABLE: Packets received = {self.received_unreliable}, throughput = {(self.unreliable_bytes_received / duration):.2f} bytes/s")
+        print_latency(self.unreliable_latency)
+        print(f"    Jitter = {self.unreliable_jitter:.2f} ms")
+
+
+def print_latency(histogram: LatencyHistogram):
+    """Print the mean and percentiles of a latency histogram, if it has samples"""
+    if histogram.count:
+        print(f"    Average latency = {histogram.mean:.2f} ms")
+        print("    Latency " + ", ".join(f"{name} = {value:.2f}" for name, value in histogram.percentiles().items()) + " ms")
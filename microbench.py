@@ -0,0 +1,243 @@
+import argparse
+import itertools
+import json
+import random
+import struct
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from packet import HUDPPacket, HEADER_SIZE, MAX_PACKET_SIZE, CHANNEL_RELIABLE, CHANNEL_UNRELIABLE
+from sender import HUDPSender, InFlightPacket, WINDOW_SIZE
+from receiver import SelectiveRepeatBuffer, ReadyQueue, RECV_BATCH
+from metrics import GameNetMetrics
+from timers import Timer
+from sender_app import generate_mock_game_data
+
+PATTERN_LENGTH = 1024  # Sequence numbers in one repetition of a synthetic arrival pattern
+LOSS_RATE = 0.05  # Fraction of packets lost in the lossy and retransmitted patterns
+RETRANSMIT_DELAY = 16  # Packets that arrive between a lost packet and its retransmission
+NEVER_SKIP = 1e18  # Timestamp far in the future, so SelectiveRepeatBuffer never gives up on a gap
+
+def measure(op: Callable[[], object], iterations: int) -> Dict[str, float]:
+    """Time op() and measure the peak memory it uses. This is the high-water mark of traced
+    bytes above the starting level, not a count or total of allocations: memory freed and
+    reused within the op (a temporary released before the next one is made) is not added up"""
+    # Warm up so one-off allocations (caches, interned objects) are not counted
+    for _ in range(min(iterations, 1000)):
+        op()
+
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        op()
+    ns_per_op = (time.perf_counter_ns() - start) / iterations
+
+    # Peak traced bytes while a single op runs, averaged over a sample of ops.
+    # tracemalloc slows everything down, so it is kept out of the timing loop
+    samples = min(iterations, 1000)
+    peak_bytes = 0
+    tracemalloc.start()
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        op()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_bytes += peak - current
+    tracemalloc.stop()
+
+    return {"ns_per_op": ns_per_op, "peak_bytes_per_op": peak_bytes / samples}
+
+
+def legacy_serialize(packet: HUDPPacket) -> bytes:
+    """Codec before the precompiled struct, for comparison"""
+    header = struct.pack('!BIId', packet.channel_type | packet.flags, packet.seq_num,
+                         packet.ack_num, packet.timestamp)
+    return header + packet.payload
+
+def legacy_deserialize(data: bytes) -> HUDPPacket:
+    """Codec before the precompiled struct, for comparison"""
+    type_and_flags, seq_num, ack_num, timestamp = struct.unpack('!BIId', data[:HEADER_SIZE])
+    return HUDPPacket(type_and_flags & 0x0F, seq_num, ack_num, timestamp, data[HEADER_SIZE:])
+
+
+def codec_benchmarks() -> Dict[str, Callable[[], object]]:
+    """Encode and decode a typical game packet"""
+    packet = HUDPPacket(CHANNEL_RELIABLE, 1234, 567, time.time(), generate_mock_game_data(0, True).encode())
+    data = packet.serialize()
+    recv_buffer = bytearray(MAX_PACKET_SIZE)
+    recv_buffer[:len(data)] = data
+    recv_view = memoryview(recv_buffer)
+    size = len(data)
+
+    def legacy_receive():
+        # recvfrom returns a new bytes object per datagram, which is then sliced twice
+        return legacy_deserialize(bytes(recv_view[:size]))
+
+    def receive():
+        # What HUDPDispatcher does after recvfrom_into: parse in place and copy the data payload once
+        decoded = HUDPPacket.deserialize(recv_view, size)
+        decoded.payload = bytes(decoded.payload)
+        return decoded
+
+    return {
+        "serialize/legacy": lambda: legacy_serialize(packet),
+        "serialize": packet.serialize,
+        "deserialize/legacy": lambda: legacy_deserialize(data),
+        "deserialize": lambda: HUDPPacket.deserialize(data),
+        "deserialize/memoryview": lambda: HUDPPacket.deserialize(recv_view, size),
+        "receive/legacy": legacy_receive,
+        "receive": receive,
+    }
+
+
+def arrival_pattern(name: str, rng: random.Random) -> List[int]:
+    """Order in which the sequence numbers 0..PATTERN_LENGTH-1 arrive at the receiver.
+    Every packet in one repetition is delivered (or skipped) before the next one starts"""
+    order = list(range(PATTERN_LENGTH))
+    if name == "reordered":
+        # Each packet overtakes up to 3 of its predecessors
+        order.sort(key=lambda seq: seq + rng.uniform(0, 4))
+    elif name == "retransmitted":
+        # Lost packets arrive RETRANSMIT_DELAY packets late, as selective repeat would resend them
+        last = PATTERN_LENGTH - RETRANSMIT_DELAY - 1
+        order.sort(key=lambda seq: seq + (RETRANSMIT_DELAY + 0.5 if seq < last and rng.random() < LOSS_RATE else 0))
+    elif name == "lossy":
+        # Lost packets never arrive, and the gaps are skipped as soon as a later packet is buffered
+        order = [seq for seq in order if rng.random() >= LOSS_RATE]
+    return order
+
+def insert_benchmark(name: str) -> Callable[[], object]:
+    """Insert one packet of a repeating arrival pattern into a SelectiveRepeatBuffer"""
+    order = arrival_pattern(name, random.Random(1))
+    # Packets are reused across repetitions; the lossy pattern's timestamps let gaps be skipped immediately
+    timestamp = 0.0 if name == "lossy" else NEVER_SKIP
+    packets = [HUDPPacket(CHANNEL_RELIABLE, seq, 0, timestamp, b"x" * 32) for seq in range(PATTERN_LENGTH)]
+    buffer = SelectiveRepeatBuffer(WINDOW_SIZE, lambda packet: None)
+    arrivals = itertools.cycle(enumerate(order))
+    base = -PATTERN_LENGTH
+
+    def insert():
+        nonlocal base
+        index, seq = next(arrivals)
+        if index == 0:
+            base += PATTERN_LENGTH
+        packet = packets[seq]
+        packet.seq_num = base + seq
+        return buffer.insert(packet)
+
+    return insert
+
+def receive_buffer_benchmarks() -> Dict[str, Callable[[], object]]:
+    """SelectiveRepeatBuffer.insert under the synthetic arrival patterns"""
+    return {f"sr_insert/{name}": insert_benchmark(name)
+            for name in ("in_order", "reordered", "retransmitted", "lossy")}
+
+
+class NullSocket:
+    """Discards datagrams, for driving HUDPSender without a network"""
+
+    def sendto(self, data: bytes, addr: Tuple[str, int]) -> int:
+        return len(data)
+
+def ack_benchmarks() -> Dict[str, Callable[[], object]]:
+    """HUDPSender.handle_ack, including putting the acknowledged packets in flight"""
+    sender = HUDPSender(NullSocket(), ("127.0.0.1", 0), None)
+    state = sender.stream(0)
+    packet = HUDPPacket(CHANNEL_RELIABLE, 0, 0, time.time(), b"x" * 32)
+
+    def put_in_flight(count: int) -> int:
+        # What _send_reliable_packet leaves behind for each packet, minus the datagram
+        first = state.next_seq
+        for seq in range(first, first + count):
+            entry = state.window[seq] = InFlightPacket(packet, time.monotonic(), seq)
+            entry.timer = Timer(0.0, put_in_flight, ())
+        state.next_seq += count
+        sender.in_flight += count
+        return first
+
+    def cumulative():
+        # One packet in flight, acknowledged by the next cumulative ACK
+        seq = put_in_flight(1)
+        sender.handle_ack(seq + 1)
+
+    def sack_window():
+        # A full window in flight: the first packet is lost, so a SACK covers the rest,
+        # then the retransmission is acknowledged with a cumulative ACK for the whole window
+        first = put_in_flight(WINDOW_SIZE)
+        sender.handle_ack(first, (1 << (WINDOW_SIZE - 1)) - 1)
+        sender.handle_ack(first + WINDOW_SIZE)
+
+    return {"handle_ack/cumulative": cumulative, f"handle_ack/sack_window{WINDOW_SIZE}": sack_window}
+
+def metrics_benchmarks() -> Dict[str, Callable[[], object]]:
+    """Latency, jitter and byte counting done by GameNetAPI.recv for each delivered packet"""
+    metrics = GameNetMetrics()
+    now = time.time()
+    packets = itertools.cycle([HUDPPacket(CHANNEL_RELIABLE, 0, 0, now, b"x" * 32),
+                               HUDPPacket(CHANNEL_UNRELIABLE, 0, 0, now, b"x" * 32)])
+    return {"recv_metrics": lambda: metrics._record_received(next(packets))}
+
+
+def ready_queue_benchmarks() -> Dict[str, Callable[[], object]]:
+    """Queue RECV_BATCH ready packets of both channels, then take them one at a time or in one batch"""
+    ready = ReadyQueue()
+    now = time.time()
+    packets = [HUDPPacket(CHANNEL_RELIABLE if i % 4 == 0 else CHANNEL_UNRELIABLE, i, 0, now, b"x" * 32)
+               for i in range(RECV_BATCH)]
+
+    def get_each():
+        for packet in packets:
+            ready.put_nowait(packet)
+        return [ready.get(timeout=0) for _ in range(RECV_BATCH)]
+
+    def get_many():
+        for packet in packets:
+            ready.put_nowait(packet)
+        return ready.get_many(RECV_BATCH)
+
+    return {f"ready_queue/get_x{RECV_BATCH}": get_each, f"ready_queue/get_many{RECV_BATCH}": get_many}
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    with open(path) as f:
+        return json.load(f)
+
+def save_baseline(path: str, results: List[Tuple[str, Dict[str, float]]]):
+    """Save results for a later run's --baseline"""
+    with open(path, "w") as f:
+        json.dump(dict(results), f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket-free microbenchmarks for per-packet hot paths")
+    parser.add_argument("--iterations", type=int, default=200000, help="Operations per benchmark")
+    parser.add_argument("--filter", type=str, default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--save-baseline", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Compare against results saved with --save-baseline")
+    args = parser.parse_args()
+
+    benchmarks = {**codec_benchmarks(), **receive_buffer_benchmarks(), **ack_benchmarks(), **metrics_benchmarks(),
+                  **ready_queue_benchmarks()}
+    results: List = []
+    for name, op in benchmarks.items():
+        if args.filter in name:
+            results.append((name, measure(op, args.iterations)))
+
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    print(f"{'benchmark':<32} {'ns/op':>10} {'peak B/op':>12}" + (f" {'base ns/op':>11} {'change':>8}" if baseline else ""))
+    print("-" * (77 if baseline else 56))
+    for name, result in results:
+        line = f"{name:<32} {result['ns_per_op']:>10.1f} {result['peak_bytes_per_op']:>12.1f}"
+        if name in baseline:
+            base = baseline[name]["ns_per_op"]
+            line += f" {base:>11.1f} {(result['ns_per_op'] - base) / base:>+8.1%}"
+        print(line)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+        print(f"Saved baseline to {args.save_baseline}")
+
+
+if __name__ == "__main__":
+    main()
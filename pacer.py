@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+from packet import HUDPPacket, CHANNEL_UNRELIABLE
+
+PACER_QUEUE_LIMIT = 256  # Datagrams; unreliable ones are dropped beyond this
+
+class Pacer:
+    """Token-bucket pacer shared by both channels of a sender.
+
+    Datagrams go out immediately while tokens are available (up to `burst` back to back),
+    and are otherwise queued and released by a timer at `rate` datagrams per second,
+    so callers are never blocked.
+    """
+
+    def __init__(self, rate: float, burst: int, timers, transmit: Callable[[HUDPPacket], None]):
+        self.rate = rate
+        self.burst = burst
+        self.timers = timers
+        self.transmit = transmit
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.queue: Deque[HUDPPacket] = deque()
+        self.drain_timer = None
+        self.dropped = 0  # Unreliable datagrams dropped because the queue was full
+        self.lock = threading.Lock() # Lock for tokens and queue
+
+    def send(self, packet: HUDPPacket):
+        """Transmit now if a token is available, otherwise queue behind earlier datagrams"""
+        with self.lock:
+            self._refill()
+            if not self.queue and self.tokens >= 1:
+                self.tokens -= 1
+                self.transmit(packet)
+                return
+            if len(self.queue) >= PACER_QUEUE_LIMIT and packet.channel_type == CHANNEL_UNRELIABLE:
+                self.dropped += 1
+                return
+            self.queue.append(packet)
+            if self.drain_timer is None:
+                self.drain_timer = self.timers.call_later(self._time_to_next_token(), self._drain)
+
+    def _refill(self):
+        """Add tokens for the time since the last refill. Caller must hold self.lock"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _time_to_next_token(self) -> float:
+        """Caller must hold self.lock"""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def _drain(self):
+        """Timer callback: release queued datagrams as tokens become available"""
+        with self.lock:
+            self._refill()
+            while self.queue and self.tokens >= 1:
+                self.tokens -= 1
+                self.transmit(self.queue.popleft())
+            self.drain_timer = self.timers.call_later(self._time_to_next_token(), self._drain) if self.queue else None
+
+    def close(self):
+        """Cancel the drain timer and send whatever is still queued"""
+        with self.lock:
+            if self.drain_timer is not None:
+                self.drain_timer.cancel()
+                self.drain_timer = None
+            while self.queue:
+                self.transmit(self.queue.popleft())
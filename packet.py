@@ -1,39 +1,128 @@
+import socket
 import struct
+from typing import List, Optional, Tuple, Union
 
-HEADER_SIZE = 17  # 1 + 4 + 4 + 8 bytes
+HEADER = struct.Struct('!BIId') # Compiled once instead of re-parsing the format string per packet
+HEADER_SIZE = HEADER.size  # 1 + 4 + 4 + 8 = 17 bytes
 CHANNEL_RELIABLE = 0
 CHANNEL_UNRELIABLE = 1
+# Acknowledgement for the reliable channel, routed to the sender.
+# ack_num is cumulative: every seq < ack_num was received (or skipped) by the receiver.
+# The payload is a selective-ACK bitmap where bit i set means seq ack_num + 1 + i was received.
+# seq_num holds the reliable stream being acknowledged. With FLAG_SKIPS, the bitmap is followed by
+# one of the same size where bit i set means seq ack_num - 1 - i was skipped rather than received.
+CHANNEL_ACK = 2
+# Forward error correction for a block of reliable packets, routed to the receiver (see fec.py).
+# seq_num is the first seq of the block and the payload is FEC_HEADER followed by the XOR of
+# the FEC_RECORDs of the packets the repair covers.
+CHANNEL_FEC = 3
+# Resynchronisation handshake, sent by a GameNetServer when it opens a session for a peer that
+# may still hold sequence state from an evicted one. seq_num is a nonce: the peer restarts every
+# reliable stream from seq 0 in both directions (resending unacknowledged packets renumbered)
+# and echoes the nonce in a CHANNEL_RESET_ACK. Both carry no payload.
+CHANNEL_RESET = 4
+CHANNEL_RESET_ACK = 5
+# The first header byte holds the channel type in the low nibble and flags in the high nibble
+CHANNEL_MASK = 0x0F
+FLAG_BUNDLED = 0x10 # Payload holds several length-prefixed messages (see bundle_messages)
+FLAG_FRAGMENT = 0x20 # Payload is one fragment of a larger message, prefixed with FRAGMENT_HEADER
+FLAG_COMPRESSED = 0x40 # Payload is deflated with the preset dictionary (see compression.PayloadCompressor)
+FLAG_STREAM = 0x80 # Reliable payload is prefixed with STREAM_HEADER; without it the packet is on stream 0
+FLAG_SKIPS = 0x10 # ACK payload ends with a skip bitmap (ACKs are never bundled, so FLAG_BUNDLED's bit is free)
+STREAM_HEADER = struct.Struct('!B') # Reliable stream ID
+MAX_STREAMS = 8 # Reliable streams per connection, each with its own sequence space
 MAX_PACKET_SIZE = 1400 # Ensures that packet with IP and UDP header will not exceed MTU of 1500 bytes
-MAX_PAYLOAD_SIZE = MAX_PACKET_SIZE - HEADER_SIZE
+MAX_PAYLOAD_SIZE = MAX_PACKET_SIZE - HEADER_SIZE - STREAM_HEADER.size # Leaves room for the stream sub-header
+BUNDLE_LENGTH = struct.Struct('!H') # Length prefix of each message in a bundled payload
+FRAGMENT_HEADER = struct.Struct('!IHH') # fragment ID, fragment index, fragment count
+MAX_FRAGMENT_DATA = MAX_PAYLOAD_SIZE - FRAGMENT_HEADER.size
+MAX_FRAGMENTS = 1024
+MAX_MESSAGE_SIZE = MAX_FRAGMENTS * MAX_FRAGMENT_DATA # About 1.4 MB
+FEC_HEADER = struct.Struct('!BBBB') # stream, packets in the block, repairs per block, repair index
+FEC_RECORD = struct.Struct('!BH') # flags and payload length of a protected packet
+# Largest datagram on the wire: a repair packet protecting a full payload (still within the MTU)
+MAX_DATAGRAM_SIZE = HEADER_SIZE + FEC_HEADER.size + FEC_RECORD.size + MAX_PAYLOAD_SIZE
 
 class HUDPPacket:
     """Represents an H-UDP packet with header and payload"""
+    __slots__ = ('channel_type', 'seq_num', 'ack_num', 'timestamp', 'payload', 'flags')
     
     def __init__(self, channel_type: int, seq_num: int, ack_num: int, 
-                 timestamp: float, payload: bytes):
+                 timestamp: float, payload: Union[bytes, memoryview], flags: int = 0):
         self.channel_type = channel_type
         self.seq_num = seq_num
         self.ack_num = ack_num
         self.timestamp = timestamp
         self.payload = payload
+        self.flags = flags
     
     def serialize(self) -> bytes:
         """Serialize packet to bytes"""
-        header = struct.pack('!BIId', 
-                           self.channel_type,
-                           self.seq_num,
-                           self.ack_num,
-                           self.timestamp)
-        return header + self.payload
-    
+        return HEADER.pack(self.channel_type | self.flags, self.seq_num, self.ack_num,
+                           self.timestamp) + self.payload
+
     @staticmethod
-    def deserialize(data: bytes) -> 'HUDPPacket':
-        """Deserialize bytes to packet"""
-        if len(data) < HEADER_SIZE:
+    def deserialize(data: Union[bytes, memoryview], size: Optional[int] = None) -> 'HUDPPacket':
+        """Deserialize the first size bytes (default all) of data to a packet.
+
+        When data is a memoryview the payload is a view into the same buffer (no copy),
+        so it must be copied before the buffer is reused.
+        """
+        if size is None:
+            size = len(data)
+        if size < HEADER_SIZE:
             raise ValueError("Invalid packet size")
         
-        channel_type, seq_num, ack_num, timestamp = struct.unpack(
-            '!BIId', data[:HEADER_SIZE])
-        payload = data[HEADER_SIZE:]
+        type_and_flags, seq_num, ack_num, timestamp = HEADER.unpack_from(data)
+        payload = data[HEADER_SIZE:size]
         
-        return HUDPPacket(channel_type, seq_num, ack_num, timestamp, payload)
+        return HUDPPacket(type_and_flags & CHANNEL_MASK, seq_num, ack_num, timestamp, payload,
+                          type_and_flags & ~CHANNEL_MASK)
+
+
+def send_packet(sock: socket.socket, packet: HUDPPacket, addr: Tuple[str, int]):
+    """Serialize and send a packet. One bytes object per datagram measured faster than packing
+    into a reusable buffer and sending a memoryview of it (see microbench.py)"""
+    sock.sendto(packet.serialize(), addr)
+
+
+def encode_sack(bitmap: int, window_size: int) -> bytes:
+    """Encode a SACK bitmap covering window_size seqs after the cumulative ACK"""
+    return bitmap.to_bytes((window_size + 7) // 8, 'big')
+
+def decode_sack(payload: bytes) -> int:
+    """Decode a SACK bitmap from an ACK payload"""
+    return int.from_bytes(payload, 'big')
+
+def decode_ack(payload: bytes, flags: int) -> Tuple[int, int]:
+    """Decode the SACK bitmap and the skip bitmap (0 if there is none) of an ACK payload"""
+    if not flags & FLAG_SKIPS:
+        return decode_sack(payload), 0
+    half = len(payload) // 2
+    return decode_sack(payload[:half]), decode_sack(payload[half:])
+
+def bundle_messages(messages: List[bytes]) -> bytes:
+    """Frame several messages into one payload, each prefixed with its length"""
+    return b''.join(BUNDLE_LENGTH.pack(len(message)) + message for message in messages)
+
+def unbundle_messages(payload: bytes) -> List[bytes]:
+    """Split a bundled payload back into its messages"""
+    messages = []
+    offset = 0
+    while offset < len(payload):
+        (length,) = BUNDLE_LENGTH.unpack_from(payload, offset)
+        offset += BUNDLE_LENGTH.size
+        if offset + length > len(payload):
+            raise ValueError("Truncated bundle")
+        messages.append(payload[offset:offset + length])
+        offset += length
+    return messages
+
+def fragment_message(data: bytes, fragment_id: int) -> List[bytes]:
+    """Split a message larger than MAX_PAYLOAD_SIZE into fragment payloads"""
+    count = (len(data) + MAX_FRAGMENT_DATA - 1) // MAX_FRAGMENT_DATA
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"Payload too large: {len(data)} > {MAX_MESSAGE_SIZE}")
+    return [FRAGMENT_HEADER.pack(fragment_id, index, count) +
+            data[index * MAX_FRAGMENT_DATA:(index + 1) * MAX_FRAGMENT_DATA]
+            for index in range(count)]
@@ -1,133 +1,589 @@
+import asyncio
+import itertools
 import socket
 import time
-import threading
-from typing import Dict, Tuple, Optional
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Tuple, Optional, Union
 import queue
-from packet import HUDPPacket, CHANNEL_RELIABLE, CHANNEL_UNRELIABLE, MAX_PACKET_SIZE
-from sender import WINDOW_SIZE, MAX_SEND_RATE
+import threading
+import zlib
+from packet import (HUDPPacket, send_packet, CHANNEL_RELIABLE, CHANNEL_ACK, CHANNEL_UNRELIABLE, CHANNEL_FEC, FLAG_BUNDLED,
+                    FLAG_FRAGMENT, FLAG_COMPRESSED, FLAG_STREAM, FLAG_SKIPS, FRAGMENT_HEADER, STREAM_HEADER, FEC_HEADER, MAX_STREAMS, encode_sack,
+                    unbundle_messages)
+from sender import WINDOW_SIZE, MAX_SEND_RATE, SKIP_THRESHOLD
+from timers import Timer, TimerQueue
+from compression import PayloadCompressor
+from fec import FecDecoder, fec_record, parse_record
+from tracing import TRACER, TRACE_EVENTS, TRACE_PACKETS, EVENT_REORDER, EVENT_SKIP, EVENT_INVALID, EVENT_INCOMPLETE
+
+MAX_ACK_DELAY = 0.01  # 10ms, longest an ACK is held back waiting to be coalesced or piggybacked
+ACK_EVERY = 4  # Send an ACK after this many in-order reliable packets even if the delay has not passed
+REASSEMBLY_TIMEOUT = 2.0  # Seconds before an incomplete fragmented message is dropped
+MAX_REASSEMBLY_BYTES = 4 * 1024 * 1024  # Fragment data held for incomplete messages; the oldest is dropped beyond this
+RECV_BATCH = 64  # Default most packets returned by one recv_many call
+
+class ReceiveStream:
+    """Receive buffer, delayed ACK and gap skipping state of one reliable stream"""
+    __slots__ = ('stream_id', 'buffer', 'unacked', 'ack_timer', 'skip_timer', 'skip_deadline', 'fec')
+
+    def __init__(self, stream_id: int, buffer: 'SelectiveRepeatBuffer'):
+        self.stream_id = stream_id
+        self.buffer = buffer
+        self.unacked = 0 # Reliable packets received since the last ACK was sent or piggybacked
+        self.ack_timer: Optional[Timer] = None
+        # Releases held packets once buffer.skip_deadline passes, even if no more packets arrive
+        self.skip_timer: Optional[Timer] = None
+        self.skip_deadline: Optional[float] = None  # Deadline skip_timer was scheduled for
+        # Created with the stream if FEC is expected (HUDPReceiver.fec), otherwise when the first
+        # repair packet arrives, so packets are only kept for peers using FEC
+        self.fec: Optional[FecDecoder] = None
 
 class HUDPReceiver:
     """H-UDP receiver with demultiplexing and selective repeat"""
     
-    def __init__(self, sock: socket.socket):
+    def __init__(self, sock: socket.socket, timers: Union[TimerQueue, asyncio.AbstractEventLoop],
+                 max_ack_delay: float = MAX_ACK_DELAY, ack_every: int = ACK_EVERY,
+                 ready_queue: Optional['ReadyQueue'] = None, compressor: Optional[PayloadCompressor] = None,
+                 sequenced_unreliable: bool = False, window_size: int = WINDOW_SIZE,
+                 skip_threshold: float = SKIP_THRESHOLD, fec: bool = False):
         self.sock = sock
-        self.ready_queue = queue.Queue() # thread-safe
-        self.reliable_buffer = SelectiveRepeatBuffer(WINDOW_SIZE, self.ready_queue)
-        self.shutdown_event = threading.Event()
-        
-        # Start receiver thread
-        self.receiver_thread = threading.Thread(target=self._receive_loop, daemon=True)
-        self.receiver_thread.start()
-    
-    def _receive_loop(self):
-        """Background thread to receive and demultiplex packets"""
-        while not self.shutdown_event.is_set():
-            try:
-                self.sock.settimeout(1 / MAX_SEND_RATE)
-                data, addr = self.sock.recvfrom(MAX_PACKET_SIZE)
-                packet = HUDPPacket.deserialize(data)
-                
-                if packet.channel_type == CHANNEL_RELIABLE:
-                    self._handle_reliable(packet, addr)
-                elif packet.channel_type == CHANNEL_UNRELIABLE:
-                    self._handle_unreliable(packet)
-                    
-            except socket.timeout:
-                continue
-            except Exception as e:
-                print(f"[Receiver] Error: {e}")
+        self.timers = timers
+        # Must use the same dictionary as the peer's sender to read FLAG_COMPRESSED payloads
+        self.compressor = compressor
+        # Anything with put_nowait: a thread-safe ReadyQueue by default, or an asyncio.Queue
+        self.ready_queue = ready_queue if ready_queue is not None else ReadyQueue()
+        # Each reliable stream is reordered separately, so a gap on one never delays the others
+        self.streams: Dict[int, ReceiveStream] = {}
+        self.window_size = window_size  # Must match the peer sender's window_size
+        self.skip_threshold = skip_threshold
+        self.reassembler = Reassembler()
+        # Drop unreliable packets older than the newest one received, so stale updates are never delivered
+        self.sequenced_unreliable = sequenced_unreliable
+        self.newest_unreliable = -1
+        self.stale_dropped = 0
+        # Keep packets for FEC from each stream's first one, so losses in the first block can be
+        # recovered too. Otherwise a stream's decoder is only created when its first repair arrives
+        self.fec = fec
+        self.fec_recovered = 0  # Reliable packets rebuilt from FEC repair packets
+        self.reset_nonce: Optional[int] = None  # Nonce of the last CHANNEL_RESET applied
+        # Peer's timestamp of its last reset: seqs and ACKs of datagrams it sent before then
+        # belong to the previous sequence space (see route_packet)
+        self.reset_time = 0.0
+        # Packets are read off the socket by HUDPDispatcher and passed to handle_reliable/handle_unreliable/handle_fec
+
+        # Delayed ACK state
+        self.max_ack_delay = max_ack_delay
+        self.ack_every = ack_every
+        self.ack_addr: Optional[Tuple[str, int]] = None
+        # Lock for streams and their delayed ACK state, shared by the dispatcher,
+        # the timer thread and piggybacking senders
+        self.lock = threading.Lock()
     
-    def _handle_reliable(self, packet: HUDPPacket, addr: Tuple[str, int]):
+    def handle_reliable(self, packet: HUDPPacket, addr: Tuple[str, int]):
         """Handle reliable channel packet with selective repeat"""
+        stream_id = 0
+        if packet.flags & FLAG_STREAM:
+            stream_id, = STREAM_HEADER.unpack_from(packet.payload)
+            packet.payload = packet.payload[STREAM_HEADER.size:]
+            packet.flags &= ~FLAG_STREAM
+            if stream_id >= MAX_STREAMS:
+                if TRACER.level >= TRACE_EVENTS:
+                    TRACER.record(EVENT_INVALID, CHANNEL_RELIABLE, packet.seq_num, 0, stream_id)
+                return
+
+        with self.lock:
+            stream = self._stream(stream_id)
+            recovered = []
+            if stream.fec is not None:
+                # Keep the packet for rebuilding others of its block, which may in turn complete a repair
+                recovered = stream.fec.add_source(packet.seq_num, fec_record(packet.flags, packet.payload),
+                                                  stream.buffer.rcv_base)
+            self._receive_reliable(stream, packet, addr)
+            self._receive_recovered(stream, recovered, packet.timestamp, addr)
+
+    def handle_fec(self, packet: HUDPPacket, addr: Tuple[str, int]):
+        """Handle a repair packet, rebuilding the reliable packets it covers that were lost"""
+        stream_id, count, interleave, index = FEC_HEADER.unpack_from(packet.payload)
+        if stream_id >= MAX_STREAMS or not 0 <= index < interleave <= count:
+            if TRACER.level >= TRACE_EVENTS:
+                TRACER.record(EVENT_INVALID, CHANNEL_FEC, packet.seq_num, 0, stream_id)
+            return
+        with self.lock:
+            stream = self._stream(stream_id)
+            if stream.fec is None:
+                stream.fec = FecDecoder()
+            recovered = stream.fec.add_repair(packet.seq_num, count, interleave, index,
+                                              packet.payload[FEC_HEADER.size:], stream.buffer.rcv_base)
+            self._receive_recovered(stream, recovered, packet.timestamp, addr)
+
+    def _receive_recovered(self, stream: ReceiveStream, recovered: List[Tuple[int, bytes]], timestamp: float,
+                           addr: Tuple[str, int]):
+        """Receive packets rebuilt by the stream's FEC decoder as if they had arrived with the
+        packet that completed them. Caller must hold self.lock"""
+        for seq, record in recovered:
+            flags, payload = parse_record(record)
+            self.fec_recovered += 1
+            self._receive_reliable(stream, HUDPPacket(CHANNEL_RELIABLE, seq, 0, timestamp, payload, flags), addr)
+
+    def _stream(self, stream_id: int) -> ReceiveStream:
+        """State of a reliable stream, created on first use. Caller must hold self.lock"""
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            stream = self.streams[stream_id] = ReceiveStream(stream_id, SelectiveRepeatBuffer(
+                self.window_size, self._deliver, self.skip_threshold, stream_id))
+            if self.fec:
+                stream.fec = FecDecoder()
+        return stream
+
+    def _receive_reliable(self, stream: ReceiveStream, packet: HUDPPacket, addr: Tuple[str, int]):
+        """Buffer a reliable packet for in-order delivery and acknowledge it. Caller must hold self.lock"""
+        in_order = packet.seq_num == stream.buffer.rcv_base
         # Insert into buffer
-        self.reliable_buffer.insert(packet)
-        
-        # By right only need to ACK packets with seq_num in [rcv_base - WINDOW_SIZE, rcv_base - 1]
-        # but to keep it simple, we ACK every received packet
+        stream.buffer.insert(packet)
+        self._schedule_skip(stream)
+
+        self.ack_addr = addr
+        stream.unacked += 1
+        # Coalesce ACKs for in-order traffic, but ACK duplicates and gaps immediately
+        # so the sender can recover (a duplicate may mean our earlier ACK was lost)
+        if not in_order or stream.buffer.holding or stream.unacked >= self.ack_every:
+            self._send_ack(stream)
+        elif stream.ack_timer is None:
+            stream.ack_timer = self.timers.call_later(self.max_ack_delay, self._on_ack_timer, stream)
+
+    def _schedule_skip(self, stream: ReceiveStream):
+        """(Re)schedule the stream's skip timer for its buffer's skip deadline. Caller must hold self.lock"""
+        deadline = stream.buffer.skip_deadline
+        if deadline == stream.skip_deadline:
+            return
+        if stream.skip_timer is not None:
+            stream.skip_timer.cancel()
+            stream.skip_timer = None
+        stream.skip_deadline = deadline
+        if deadline is not None:
+            # Deadlines are in sender time.time(), like the packet timestamps they come from
+            stream.skip_timer = self.timers.call_later(max(deadline - time.time(), 0.0), self._on_skip_timer, stream)
+
+    def _on_skip_timer(self, stream: ReceiveStream):
+        """Timer callback: skip the gap holding back buffered packets and tell the sender"""
+        with self.lock:
+            stream.skip_timer = None
+            stream.skip_deadline = None
+            rcv_base = stream.buffer.rcv_base
+            stream.buffer.skip_expired()
+            if stream.buffer.rcv_base != rcv_base:
+                self._send_ack(stream)
+            self._schedule_skip(stream)
+
+    def _on_ack_timer(self, stream: ReceiveStream):
+        """Timer callback: send the ACK once max_ack_delay has passed"""
+        with self.lock:
+            stream.ack_timer = None
+            if stream.unacked:
+                self._send_ack(stream)
+
+    def _send_ack(self, stream: ReceiveStream):
+        """Send a standalone ACK for a stream. Caller must hold self.lock"""
+        if stream.ack_timer is not None:
+            stream.ack_timer.cancel()
+            stream.ack_timer = None
+        stream.unacked = 0
+
+        # ACK with the cumulative rcv_base plus a bitmap of buffered out-of-order packets,
+        # so a single ACK covers the whole window and a lost ACK is repaired by the next one
+        payload = encode_sack(stream.buffer.sack_bitmap(), self.window_size)
+        flags = 0
+        if stream.buffer.skipped:
+            # Tells the sender which seqs below rcv_base were skipped rather than received
+            payload += encode_sack(stream.buffer.skipped, self.window_size)
+            flags = FLAG_SKIPS
         ack_packet = HUDPPacket(
-            channel_type=CHANNEL_RELIABLE,
-            seq_num=0,
-            ack_num=packet.seq_num,
+            channel_type=CHANNEL_ACK,
+            seq_num=stream.stream_id,
+            ack_num=stream.buffer.rcv_base,
             timestamp=time.time(),
-            payload=b''
+            payload=payload,
+            flags=flags
         )
-        self.sock.sendto(ack_packet.serialize(), addr)
+        send_packet(self.sock, ack_packet, self.ack_addr)
+
+    def take_piggyback_ack(self) -> int:
+        """Cumulative ACK for stream 0 to piggyback on an outgoing data packet's ack_num field.
+        Other streams are always acknowledged with standalone ACKs"""
+        with self.lock:
+            stream = self.streams.get(0)
+            # Piggybacked ACKs carry no skip bitmap either, so while any seq the sender may still
+            # have in flight was skipped, leave it to standalone ACKs to tell it so (0 acknowledges
+            # nothing). Those are at most window_size below rcv_base, which buffer.skipped covers
+            if stream is None or stream.buffer.skipped:
+                return 0
+            # Piggybacked ACKs carry no SACK bitmap, so a standalone ACK is
+            # still needed while out-of-order packets are buffered
+            if stream.unacked and not stream.buffer.holding:
+                if stream.ack_timer is not None:
+                    stream.ack_timer.cancel()
+                    stream.ack_timer = None
+                stream.unacked = 0
+            return stream.buffer.rcv_base
     
-    def _handle_unreliable(self, packet: HUDPPacket):
+    def handle_unreliable(self, packet: HUDPPacket):
         """Handle unreliable channel packet (no ACK)"""
-        self.ready_queue.put(packet)
+        # Only called from the dispatcher thread (or event loop), so newest_unreliable needs no lock
+        if self.sequenced_unreliable:
+            if packet.seq_num <= self.newest_unreliable:
+                self.stale_dropped += 1
+                return
+            self.newest_unreliable = packet.seq_num
+        self._deliver(packet)
+
+    def _deliver(self, packet: HUDPPacket):
+        """Hand a packet to the application, splitting bundled datagrams into individual
+        messages and holding fragments back until their message is complete"""
+        if packet.flags & FLAG_COMPRESSED:
+            try:
+                if self.compressor is None:
+                    raise ValueError("no compression dictionary configured")
+                packet.payload = self.compressor.decompress(packet.payload)
+            except (ValueError, zlib.error):
+                if TRACER.level >= TRACE_EVENTS:
+                    TRACER.record(EVENT_INVALID, packet.channel_type, packet.seq_num)
+                return
+            packet.flags &= ~FLAG_COMPRESSED
+        if packet.flags & FLAG_FRAGMENT:
+            message = self.reassembler.add(packet)
+            if message is not None:
+                self.ready_queue.put_nowait(message)
+        elif packet.flags & FLAG_BUNDLED:
+            for message in unbundle_messages(packet.payload):
+                self.ready_queue.put_nowait(HUDPPacket(packet.channel_type, packet.seq_num, packet.ack_num,
+                                                packet.timestamp, message))
+        else:
+            self.ready_queue.put_nowait(packet)
+
+    def reset(self, nonce: int, timestamp: float) -> bool:
+        """Forget every reliable stream (and the newest unreliable seq) because the peer's
+        sender starts over from seq 0 as of its timestamp (see CHANNEL_RESET). Returns False,
+        changing nothing, if the reset with this nonce was already applied"""
+        with self.lock:
+            if nonce == self.reset_nonce:
+                return False
+            self.reset_nonce = nonce
+            self.reset_time = timestamp
+            self._cancel_timers()
+            self.streams.clear()
+            self.newest_unreliable = -1
+            return True
+
+    def close(self):
+        """Cancel pending delayed ACKs and skip timers"""
+        with self.lock:
+            self._cancel_timers()
 
-    def recv(self, timeout: Optional[float] = 1 / MAX_SEND_RATE) -> Optional[HUDPPacket]:
-        """Receive data from ready queue"""
+    def _cancel_timers(self):
+        """Cancel every stream's delayed ACK and skip timer. Caller must hold self.lock"""
+        for stream in self.streams.values():
+            if stream.ack_timer is not None:
+                stream.ack_timer.cancel()
+                stream.ack_timer = None
+            if stream.skip_timer is not None:
+                stream.skip_timer.cancel()
+                stream.skip_timer = None
+
+    def recv(self, timeout: Optional[float] = 1 / MAX_SEND_RATE, channel: Optional[int] = None) -> Optional[HUDPPacket]:
+        """Receive data from ready queue, from one channel only if given"""
         try:
-            packet = self.ready_queue.get(timeout=timeout)
+            packet = self.ready_queue.get(timeout=timeout, channel=channel)
             return packet
         except queue.Empty:
             return None
-    
-    def close(self):
-        """Stop receiver thread"""
-        self.shutdown_event.set()
-        if self.receiver_thread.is_alive():
-            self.receiver_thread.join()
+
+    def recv_many(self, max_n: int, timeout: Optional[float] = 0.0, channel: Optional[int] = None) -> List[HUDPPacket]:
+        """Receive up to max_n packets that are ready, waiting up to timeout for the first one"""
+        return self.ready_queue.get_many(max_n, timeout, channel)
+
+
+def packet_channel(packet: HUDPPacket) -> int:
+    return packet.channel_type
+
+
+class ReadyQueue:
+    """Packets ready for the application, in one queue per channel sharing a single condition.
+
+    get and get_many take the oldest item of either channel (arrival order is kept across
+    channels) or of one channel only, so a game loop can poll state updates and events
+    separately. get_many drains up to max_n items under one lock acquisition.
+
+    With a key function, items for which it returns None are queued normally, and an item
+    whose key already has one waiting replaces it in its place in the queue, so a slow
+    consumer sees each key at most once per get cycle instead of working through a backlog
+    of stale updates. Used by HUDPReceiver and, with (addr, packet) items, GameNetServer.
+    """
+
+    def __init__(self, key: Optional[Callable[[Any], Optional[Hashable]]] = None,
+                 channel: Callable[[Any], int] = packet_channel):
+        self.key = key
+        self.channel = channel  # Channel type of an item
+        # [item, key, arrival] slots of each channel in arrival order
+        self.queues: Dict[int, Deque[list]] = {CHANNEL_RELIABLE: deque(), CHANNEL_UNRELIABLE: deque()}
+        self.pending: Dict[Hashable, list] = {}  # key -> its slot in self.queues
+        self.arrivals = itertools.count()  # Orders slots across channels
+        self.coalesced = 0  # Items replaced by a newer one before being taken
+        self.condition = threading.Condition()
+
+    def put_nowait(self, item: Any):
+        """Queue an item, replacing the pending item with the same key if there is one"""
+        key = self.key(item) if self.key is not None else None
+        with self.condition:
+            if key is not None:
+                slot = self.pending.get(key)
+                if slot is not None:
+                    slot[0] = item
+                    self.coalesced += 1
+                    return
+                slot = [item, key, next(self.arrivals)]
+                self.pending[key] = slot
+            else:
+                slot = [item, None, next(self.arrivals)]
+            self.queues[self.channel(item)].append(slot)
+            # Consumers may be waiting on different channels
+            self.condition.notify_all()
+
+    def get(self, block: bool = True, timeout: Optional[float] = None, channel: Optional[int] = None) -> Any:
+        """Take the oldest item (of one channel if given), raising queue.Empty like queue.Queue.get"""
+        with self.condition:
+            if block:
+                self.condition.wait_for(lambda: self._next_queue(channel) is not None, timeout)
+            source = self._next_queue(channel)
+            if source is None:
+                raise queue.Empty
+            return self._pop(source)
+
+    def get_nowait(self, channel: Optional[int] = None) -> Any:
+        return self.get(block=False, channel=channel)
+
+    def get_many(self, max_n: int, timeout: Optional[float] = 0.0, channel: Optional[int] = None) -> List[Any]:
+        """Take up to max_n items, oldest first, waiting up to timeout (None to wait forever)
+        for the first one. Returns an empty list on timeout"""
+        with self.condition:
+            self.condition.wait_for(lambda: self._next_queue(channel) is not None, timeout)
+            items = []
+            while len(items) < max_n:
+                source = self._next_queue(channel)
+                if source is None:
+                    break
+                items.append(self._pop(source))
+            return items
+
+    def qsize(self, channel: Optional[int] = None) -> int:
+        if channel is not None:
+            return len(self.queues[channel])
+        return sum(len(slots) for slots in self.queues.values())
+
+    def _next_queue(self, channel: Optional[int]) -> Optional[Deque[list]]:
+        """Queue holding the next item to take, or None if there is none. Caller must hold self.condition"""
+        if channel is not None:
+            return self.queues[channel] or None
+        reliable, unreliable = self.queues[CHANNEL_RELIABLE], self.queues[CHANNEL_UNRELIABLE]
+        if not reliable:
+            return unreliable or None
+        if not unreliable or reliable[0][2] < unreliable[0][2]:
+            return reliable
+        return unreliable
+
+    def _pop(self, source: Deque[list]) -> Any:
+        item, key, _ = source.popleft()
+        if key is not None:
+            del self.pending[key]
+        return item
+
+
+def unreliable_key(coalesce_key: Callable[[bytes], Optional[Hashable]]) -> Callable[[HUDPPacket], Optional[Hashable]]:
+    """Adapt a payload key function for ReadyQueue so reliable packets are never coalesced"""
+    def key(packet: HUDPPacket) -> Optional[Hashable]:
+        return coalesce_key(packet.payload) if packet.channel_type == CHANNEL_UNRELIABLE else None
+    return key
 
 
 class SelectiveRepeatBuffer:
-    """Buffer for reordering reliable packets using Selective Repeat"""
+    """Buffer for reordering reliable packets using Selective Repeat.
+
+    Packets are held in a ring of window_size slots indexed by seq % window_size, with a
+    bitmap of the occupied ones (bit i is seq rcv_base + i), so insert and in-order delivery
+    are O(1) and the next held packet after a gap is found from the lowest set bit.
+
+    A gap is skipped once skip_threshold has passed since the first packet after it was
+    sent: immediately on insert if that is already the case, otherwise by whoever owns the
+    buffer calling skip_expired() at skip_deadline (HUDPReceiver does so with a timer).
+    """
     
-    def __init__(self, window_size: int, ready_queue: queue.Queue, skip_threshold: float = 0.2):
+    def __init__(self, window_size: int, deliver: Callable[[HUDPPacket], None], skip_threshold: float = SKIP_THRESHOLD,
+                 stream: int = 0):
         self.window_size = window_size
+        self.stream = stream # Reported in trace events
         self.rcv_base = 0  # Next expected sequence number
-        self.buffer: Dict[int, HUDPPacket] = {} # seq_num -> packet
-        self.ready_queue: queue.Queue[HUDPPacket] = ready_queue
+        self.slots: List[Optional[HUDPPacket]] = [None] * window_size  # seq % window_size -> held packet
+        self.held = 0  # Bitmap of occupied slots, bit i for seq rcv_base + i
+        # Bitmap of skipped seqs among the last window_size below rcv_base, bit i for seq rcv_base - 1 - i
+        self.skipped = 0
+        self.skip_mask = (1 << window_size) - 1
+        self.deliver = deliver # Called with each packet in order
         self.skip_threshold = skip_threshold
+        # time.time() at which the gap at rcv_base should be skipped, or None if no packet is held
+        self.skip_deadline: Optional[float] = None
+
+    @property
+    def holding(self) -> bool:
+        """True while out-of-order packets are held waiting for a gap to be filled or skipped"""
+        return self.held != 0
     
     def insert(self, packet: HUDPPacket) -> bool:
         """Insert packet into buffer and check if it's in window"""
-        seq = packet.seq_num
+        offset = packet.seq_num - self.rcv_base
 
         # Check if packet is within window
-        if seq < self.rcv_base:
+        if offset < 0:
             # Duplicate packet, already delivered
             return False
         
-        if seq >= self.rcv_base + self.window_size:
+        if offset >= self.window_size:
             # Out of window, drop
             return False
     
         # Add to buffer if not already received
-        if seq not in self.buffer:
-            self.buffer[seq] = packet
-            # Detect reordering (packet arrived after a higher seq packet)
-            if seq > self.rcv_base:
-                print(f"[Receiver] Detected reordering: received seq {seq} while waiting for {self.rcv_base}")
-        
-        self._deliver_ready_packets()
-        self._check_skip_missing_packets()
-        
+        bit = 1 << offset
+        if self.held & bit:
+            return True
+        self.slots[packet.seq_num % self.window_size] = packet
+        self.held |= bit
+
+        if offset == 0:
+            self._deliver_ready_packets()
+        elif TRACER.level >= TRACE_PACKETS:
+            # Reordering: packet arrived while an earlier one is missing
+            TRACER.record(EVENT_REORDER, CHANNEL_RELIABLE, packet.seq_num, self.rcv_base, self.stream)
+
+        self._update_skip_deadline()
+        if self.skip_deadline is not None and self.skip_deadline <= time.time():
+            self.skip_expired()
         return True
     
+    def sack_bitmap(self) -> int:
+        """Bitmap of buffered packets where bit i set means seq rcv_base + 1 + i has been received"""
+        return self.held >> 1
+
+    def skip_expired(self, now: Optional[float] = None):
+        """Skip gaps whose deadline has passed and deliver the packets held behind them"""
+        now = time.time() if now is None else now
+        while self.skip_deadline is not None and self.skip_deadline <= now:
+            # Every missing seq before the first held packet was sent before it, so skip them all
+            gap = (self.held & -self.held).bit_length() - 1
+            if TRACER.level >= TRACE_EVENTS:
+                for seq in range(self.rcv_base, self.rcv_base + gap):
+                    TRACER.record(EVENT_SKIP, CHANNEL_RELIABLE, seq, 0, self.stream)
+            self.rcv_base += gap
+            self.held >>= gap
+            self.skipped = ((self.skipped << gap) | ((1 << gap) - 1)) & self.skip_mask
+            self._deliver_ready_packets()
+            self._update_skip_deadline()
+
     def _deliver_ready_packets(self):
         """Deliver all consecutive packets from rcv_base"""
-        while self.rcv_base in self.buffer:
-            packet = self.buffer.pop(self.rcv_base)
-            self.ready_queue.put(packet)
+        slots = self.slots
+        start = self.rcv_base
+        while self.held & 1:
+            index = self.rcv_base % self.window_size
+            packet = slots[index]
+            slots[index] = None
+            self.held >>= 1
             self.rcv_base += 1
-            
-    
-    def _check_skip_missing_packets(self):
-        """Skip missing packets if they exceed the threshold"""
-        if self.rcv_base not in self.buffer:
-            # Find next available packet
-            higher_seqs = [s for s in self.buffer.keys() if s > self.rcv_base]
-            if higher_seqs:
-                next_seq = min(higher_seqs)
-                packet = self.buffer.get(next_seq)
-                # If more than skip_threshold time has passed since a packet with seq > rcv_base was sent,
-                # more than skip_threshold time must have passed since packet with seq = rcv_base was FIRST sent
-                if (time.time() - packet.timestamp) >= self.skip_threshold:
-                    print(f"[Receiver] Skipping RELIABLE seq {self.rcv_base}")
-                    self.rcv_base += 1
-                    # Recursively deliver and check for more skips
-                    self._deliver_ready_packets()
-                    self._check_skip_missing_packets()
\ No newline at end of file
+            self.deliver(packet)
+        if self.skipped:
+            self.skipped = (self.skipped << (self.rcv_base - start)) & self.skip_mask
+
+    def _update_skip_deadline(self):
+        """Deadline of the gap at rcv_base: skip_threshold after the first held packet was sent"""
+        if not self.held:
+            self.skip_deadline = None
+            return
+        # If more than skip_threshold time has passed since a packet with seq > rcv_base was sent,
+        # more than skip_threshold time must have passed since packet with seq = rcv_base was FIRST sent
+        first = self.rcv_base + (self.held & -self.held).bit_length() - 1
+        self.skip_deadline = self.slots[first % self.window_size].timestamp + self.skip_threshold
+
+
+class PartialMessage:
+    """Fragments received so far for one fragmented message"""
+    __slots__ = ('fragments', 'received', 'size', 'created', 'seq_num', 'ack_num', 'timestamp')
+
+    def __init__(self, count: int, created: float, packet: HUDPPacket):
+        self.fragments: List[Optional[bytes]] = [None] * count
+        self.received = 0
+        self.size = 0  # Bytes of fragment data held
+        self.created = created  # time.monotonic()
+        # Header fields reported for the reassembled message, taken from the first fragment
+        self.seq_num = packet.seq_num
+        self.ack_num = packet.ack_num
+        self.timestamp = packet.timestamp
+
+
+class Reassembler:
+    """Bounded-memory table of partially received fragmented messages.
+
+    Incomplete messages are dropped as a whole once they are older than REASSEMBLY_TIMEOUT,
+    or oldest first when more than MAX_REASSEMBLY_BYTES of fragment data is held.
+    """
+
+    def __init__(self, timeout: float = REASSEMBLY_TIMEOUT, max_bytes: int = MAX_REASSEMBLY_BYTES):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        # (channel, fragment ID) -> partial message, oldest first
+        self.pending: 'OrderedDict[Tuple[int, int], PartialMessage]' = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock() # Reliable and unreliable fragments are delivered from different threads
+
+    def add(self, packet: HUDPPacket) -> Optional[HUDPPacket]:
+        """Store a fragment and return the reassembled message once all fragments have arrived"""
+        fragment_id, index, count = FRAGMENT_HEADER.unpack_from(packet.payload)
+        data = packet.payload[FRAGMENT_HEADER.size:]
+        key = (packet.channel_type, fragment_id)
+        now = time.monotonic()
+
+        with self.lock:
+            # Drop incomplete messages that have timed out
+            while self.pending:
+                oldest_key, oldest = next(iter(self.pending.items()))
+                if now - oldest.created < self.timeout:
+                    break
+                self._drop(oldest_key)
+
+            message = self.pending.get(key)
+            if message is None:
+                message = PartialMessage(count, now, packet)
+                self.pending[key] = message
+            if index >= len(message.fragments) or message.fragments[index] is not None:
+                return None # Duplicate or malformed
+            if index == 0:
+                message.seq_num = packet.seq_num
+                message.ack_num = packet.ack_num
+                message.timestamp = packet.timestamp
+            message.fragments[index] = data
+            message.received += 1
+            message.size += len(data)
+            self.size += len(data)
+
+            if message.received == len(message.fragments):
+                del self.pending[key]
+                self.size -= message.size
+                return HUDPPacket(packet.channel_type, message.seq_num, message.ack_num,
+                                  message.timestamp, b''.join(message.fragments))
+
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.pending)))
+            return None
+
+    def _drop(self, key: Tuple[int, int]):
+        """Discard an incomplete message. Caller must hold self.lock"""
+        message = self.pending.pop(key)
+        self.size -= message.size
+        if TRACER.level >= TRACE_EVENTS:
+            TRACER.record(EVENT_INCOMPLETE, key[0], key[1], message.received)
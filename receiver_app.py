@@ -1,6 +1,7 @@
 import time
 import argparse
 from gameNetAPI import GameNetAPI
+from tracing import add_trace_arguments, configure_from_args, dump_from_args
 
 def main(local_port: int, remote_port: int, duration: float):
     """Receiver application that displays received packets with detailed logs"""
@@ -29,6 +30,9 @@ if __name__ == '__main__':
     parser.add_argument('--local-port', type=int, default=10001, help='Local port')
     parser.add_argument('--remote-port', type=int, default=10000, help='Remote port')
     parser.add_argument('--duration', type=float, default=15.0, help='Test duration in seconds')
+    add_trace_arguments(parser)
     args = parser.parse_args()
     
+    configure_from_args(args)
     main(args.local_port, args.remote_port, args.duration)
+    dump_from_args(args)
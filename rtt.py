@@ -0,0 +1,36 @@
+from typing import Optional
+
+# RFC 6298 constants
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+CLOCK_GRANULARITY = 0.001  # 1ms
+MIN_RTO = 0.02  # 20ms, far below TCP's 1s floor since game traffic is latency sensitive
+MAX_RTO = 2.0
+
+class RTTEstimator:
+    """Smoothed RTT and retransmission timeout estimation (RFC 6298)"""
+
+    def __init__(self, initial_rto: float):
+        self.srtt: Optional[float] = None  # None until the first sample
+        self.rttvar: Optional[float] = None
+        self.rto = initial_rto
+
+    def sample(self, rtt: float):
+        """Update estimates with an RTT sample.
+
+        Karn's algorithm: callers must only pass samples from packets that were never
+        retransmitted, since the ACK of a retransmitted packet is ambiguous.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            # RTTVAR is updated first since it uses the previous SRTT
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, K * self.rttvar), MIN_RTO), MAX_RTO)
+
+    def backoff_timeout(self, retries: int) -> float:
+        """Timeout for a packet that has already been retransmitted `retries` times (exponential backoff)"""
+        return min(self.rto * (2 ** retries), MAX_RTO)
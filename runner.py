@@ -1,19 +1,80 @@
 import argparse
+import math
 import threading
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from gameNetAPI import GameNetAPI
+from congestion import CONGESTION_CONTROLLERS
+from sender import WINDOW_SIZE
+from receiver import SKIP_THRESHOLD
 from sender_app import generate_mock_game_data
+from tracing import add_trace_arguments, configure_from_args, dump_from_args
+from impairment import LinkConditions, add_impairment_arguments, conditions_from_args
 
 DONE_MESSAGE = b"__HUDP_DONE__"
+DRAIN_GRACE = 0.25  # Seconds the receiver keeps reading after DONE, for unreliable packets overtaken by it
+
+
+class ExperimentConfig:
+    """One sender/receiver run over loopback (see run_experiment)"""
+
+    def __init__(
+        self,
+        duration: float = 5.0,
+        rate: float = 20.0,
+        payload_size: Optional[int] = None,
+        reliable_ratio: float = 0.5,
+        window_size: int = WINDOW_SIZE,
+        skip_threshold: float = SKIP_THRESHOLD,
+        fec_block: Optional[int] = None,
+        fec_repair: int = 1,
+        receiver_buffer: float = 1.0,
+        bundle_delay: Optional[float] = None,
+        congestion_control: Optional[str] = None,
+        pacing_rate: Optional[float] = None,
+        compression_dict: Optional[bytes] = None,
+        sequenced_unreliable: bool = False,
+        sender_impairment: Optional[LinkConditions] = None,
+        receiver_impairment: Optional[LinkConditions] = None,
+        sender_port: int = 10000,
+        receiver_port: int = 10001,
+    ):
+        self.duration = duration  # Active send duration in seconds
+        self.rate = rate  # Messages per second, or 0 to send as fast as the stack accepts them
+        self.payload_size = payload_size  # Mock payloads are truncated or space padded to this size if set
+        self.reliable_ratio = reliable_ratio  # Fraction of messages sent on the reliable channel
+        self.window_size = window_size
+        self.skip_threshold = skip_threshold
+        self.fec_block = fec_block  # Reliable packets per FEC block, or None to disable FEC
+        self.fec_repair = fec_repair  # Repair packets per FEC block
+        self.receiver_buffer = receiver_buffer  # Extra seconds the receiver listens after the sender stops
+        self.bundle_delay = bundle_delay
+        self.congestion_control = congestion_control
+        self.pacing_rate = pacing_rate
+        self.compression_dict = compression_dict
+        self.sequenced_unreliable = sequenced_unreliable
+        self.sender_impairment = sender_impairment  # Applied to data packets
+        self.receiver_impairment = receiver_impairment  # Applied to ACKs
+        self.sender_port = sender_port
+        self.receiver_port = receiver_port
+
+
+def is_reliable_message(packet_id: int, reliable_ratio: float) -> bool:
+    """Deterministic channel mix for repeatability: reliable_ratio of every run of messages are reliable"""
+    return math.ceil((packet_id + 1) * reliable_ratio) > math.ceil(packet_id * reliable_ratio)
+
+
+def mock_payload(packet_id: int, is_reliable: bool, payload_size: Optional[int] = None) -> bytes:
+    """Mock game data, truncated or space padded to payload_size bytes if given"""
+    payload = generate_mock_game_data(packet_id, is_reliable).encode()
+    if payload_size is not None:
+        payload = payload[:payload_size].ljust(payload_size)
+    return payload
 
 
 def sender_worker(
-    local_port: int,
-    remote_port: int,
-    duration: float,
-    rate: float,
+    config: ExperimentConfig,
     ready_event: threading.Event,
     stop_event: threading.Event,
     results: Dict[str, Any],
@@ -21,17 +82,21 @@ def sender_worker(
     """Send mock packets until duration elapses, then emit a done control packet."""
     ready_event.wait()
 
-    api = GameNetAPI(("0.0.0.0", local_port), ("127.0.0.1", remote_port))
-    interval = 1.0 / rate if rate > 0 else 0.0
+    api = GameNetAPI(("0.0.0.0", config.sender_port), ("127.0.0.1", config.receiver_port),
+                     bundle_delay=config.bundle_delay, congestion_control=config.congestion_control,
+                     pacing_rate=config.pacing_rate, compression_dict=config.compression_dict,
+                     impairment=config.sender_impairment, window_size=config.window_size,
+                     skip_threshold=config.skip_threshold, fec_block=config.fec_block, fec_repair=config.fec_repair)
+    interval = 1.0 / config.rate if config.rate > 0 else 0.0
     start_time = time.time()
-    end_time = start_time + duration
+    end_time = start_time + config.duration
+    send_end = None
     packet_id = 0
 
     try:
         while time.time() < end_time and not stop_event.is_set():
-            is_reliable = (packet_id % 2) == 0  # deterministic mix for repeatability
-            payload = generate_mock_game_data(packet_id, is_reliable).encode()
-            api.send(payload, reliable=is_reliable)
+            is_reliable = is_reliable_message(packet_id, config.reliable_ratio)
+            api.send(mock_payload(packet_id, is_reliable, config.payload_size), reliable=is_reliable)
             packet_id += 1
 
             if interval > 0:
@@ -40,58 +105,69 @@ def sender_worker(
                 if time_to_wait > 0:
                     time.sleep(time_to_wait)
 
-        # Let the receiver know we are finished.
+        # Let the receiver know we are finished, then stay open to retransmit the tail
+        # (DONE included) until it is acknowledged or the receiver gives up waiting
         api.send(DONE_MESSAGE, reliable=True)
-        stop_event.set()
+        send_end = time.time()
+        drain_deadline = end_time + config.receiver_buffer
+        # The receiver records its results once it stops reading, after which retransmissions are pointless
+        while api.sender.in_flight and time.time() < drain_deadline and "receiver" not in results:
+            time.sleep(0.01)
     finally:
-        elapsed = time.time() - start_time
+        elapsed = (send_end or time.time()) - start_time
         results["sender"] = {
             "sent_reliable": api.sent_reliable,
             "sent_unreliable": api.sent_unreliable,
+            "reliable_datagrams": api.sender.packets_sent,
+            "retransmissions": api.sender.retransmissions,
+            "fec_repairs": api.sender.repairs_sent,
             "duration": elapsed,
+            "impairment": api.send_sock.stats() if config.sender_impairment else None,
         }
         api.close()
 
 
 def receiver_worker(
-    local_port: int,
-    remote_port: int,
-    duration: float,
-    buffer_time: float,
+    config: ExperimentConfig,
     ready_event: threading.Event,
     stop_event: threading.Event,
     results: Dict[str, Any],
 ) -> None:
-    """Receive packets until told to stop or the extended window elapses."""
-    api = GameNetAPI(("0.0.0.0", local_port), ("127.0.0.1", remote_port))
+    """Receive packets until shortly after the done control packet, or until the extended
+    window elapses if it never arrives."""
+    api = GameNetAPI(("0.0.0.0", config.receiver_port), ("127.0.0.1", config.sender_port),
+                     compression_dict=config.compression_dict, sequenced_unreliable=config.sequenced_unreliable,
+                     impairment=config.receiver_impairment, window_size=config.window_size,
+                     skip_threshold=config.skip_threshold, fec_block=config.fec_block, fec_repair=config.fec_repair)
     ready_event.set()
 
     start_time = time.time()
-    end_time = start_time + duration + buffer_time
+    end_time = start_time + config.duration + config.receiver_buffer
 
     try:
-        while time.time() < end_time and not stop_event.is_set():
-            packet = api.recv(timeout=0.05)
-            if packet and packet.payload == DONE_MESSAGE:
-                stop_event.set()
+        while time.time() < end_time:
+            for packet in api.recv_many(timeout=0.05):
+                if packet.payload == DONE_MESSAGE and not stop_event.is_set():
+                    # Tells the sender to stop if it is still sending; packets sent just before
+                    # DONE may still arrive, so drain them for a grace period
+                    stop_event.set()
+                    end_time = min(end_time, time.time() + DRAIN_GRACE)
     finally:
         elapsed = time.time() - start_time
-        reliable_latencies = list(api.reliable_latencies)
-        unreliable_latencies = list(api.unreliable_latencies)
         results["receiver"] = {
-            "received_reliable": len(reliable_latencies),
-            "received_unreliable": len(unreliable_latencies),
+            "received_reliable": api.received_reliable,
+            "received_unreliable": api.received_unreliable,
             "reliable_bytes": api.reliable_bytes_received,
             "unreliable_bytes": api.unreliable_bytes_received,
-            "avg_reliable_latency_ms": (
-                sum(reliable_latencies) / len(reliable_latencies) if reliable_latencies else None
-            ),
-            "avg_unreliable_latency_ms": (
-                sum(unreliable_latencies) / len(unreliable_latencies) if unreliable_latencies else None
-            ),
+            "avg_reliable_latency_ms": api.reliable_latency.mean,
+            "avg_unreliable_latency_ms": api.unreliable_latency.mean,
+            "reliable_latency_percentiles_ms": api.reliable_latency.percentiles(),
+            "unreliable_latency_percentiles_ms": api.unreliable_latency.percentiles(),
             "reliable_jitter_ms": api.reliable_jitter,
             "unreliable_jitter_ms": api.unreliable_jitter,
+            "fec_recovered": api.receiver.fec_recovered,
             "duration": elapsed,
+            "impairment": api.send_sock.stats() if config.receiver_impairment else None,
         }
         api.close()
 
@@ -110,6 +186,7 @@ def compute_channel_metrics(
         throughput = (bytes_rcv / duration) if duration > 0 else 0.0
         delivery_ratio = (received / sent * 100.0) if sent > 0 else None
         avg_latency = receiver_stats.get(f"avg_{channel}_latency_ms")
+        latency_percentiles = receiver_stats.get(f"{channel}_latency_percentiles_ms", {})
         jitter = receiver_stats.get(f"{channel}_jitter_ms")
 
         return {
@@ -120,58 +197,42 @@ def compute_channel_metrics(
             "bytes_received": bytes_rcv,
             "throughput_bytes_per_sec": throughput,
             "avg_latency_ms": avg_latency,
+            "latency_percentiles_ms": latency_percentiles,
             "jitter_ms": jitter,
         }
 
+    sent = sender_stats.get("sent_reliable", 0) + sender_stats.get("sent_unreliable", 0)
+    send_duration = sender_stats.get("duration", 0.0)
+    reliable = channel_summary("reliable")
+    # Extra reliable-channel datagrams, retransmitted or FEC repair, per original datagram
+    datagrams = sender_stats.get("reliable_datagrams", 0)
+    extra = sender_stats.get("retransmissions", 0) + sender_stats.get("fec_repairs", 0)
+    reliable["overhead_pct"] = (extra / datagrams * 100.0) if datagrams > 0 else None
+    reliable["fec_recovered"] = receiver_stats.get("fec_recovered", 0)
     return {
-        "reliable": channel_summary("reliable"),
+        "reliable": reliable,
         "unreliable": channel_summary("unreliable"),
         "duration": duration,
+        # Messages per second the sender got through send(); the stack's saturation point when unpaced
+        "send_rate_per_sec": (sent / send_duration) if send_duration > 0 else 0.0,
     }
 
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description="Local runner for sender/receiver apps.")
-    parser.add_argument("--sender-port", type=int, default=10000, help="Local port for sender.")
-    parser.add_argument("--receiver-port", type=int, default=10001, help="Local port for receiver.")
-    parser.add_argument("--duration", type=float, default=5.0, help="Active send duration in seconds.")
-    parser.add_argument("--rate", type=float, default=20.0, help="Packets per second for the sender.")
-    parser.add_argument(
-        "--receiver-buffer",
-        type=float,
-        default=1.0,
-        help="Extra time (seconds) the receiver listens after sender stops.",
-    )
-    args = parser.parse_args()
-
+def run_experiment(config: ExperimentConfig) -> Dict[str, Any]:
+    """Run a sender and a receiver thread for one configuration and return their
+    stats together with the metrics from compute_channel_metrics."""
     ready_event = threading.Event()
     stop_event = threading.Event()
     results: Dict[str, Any] = {}
 
     receiver_thread = threading.Thread(
         target=receiver_worker,
-        args=(
-            args.receiver_port,
-            args.sender_port,
-            args.duration,
-            args.receiver_buffer,
-            ready_event,
-            stop_event,
-            results,
-        ),
+        args=(config, ready_event, stop_event, results),
         name="ReceiverThread",
     )
     sender_thread = threading.Thread(
         target=sender_worker,
-        args=(
-            args.sender_port,
-            args.receiver_port,
-            args.duration,
-            args.rate,
-            ready_event,
-            stop_event,
-            results,
-        ),
+        args=(config, ready_event, stop_event, results),
         name="SenderThread",
     )
 
@@ -179,12 +240,118 @@ def main() -> None:
     sender_thread.start()
 
     sender_thread.join()
-    stop_event.set()
     receiver_thread.join()
 
     sender_stats = results.get("sender", {})
     receiver_stats = results.get("receiver", {})
-    metrics = compute_channel_metrics(sender_stats, receiver_stats)
+    return {
+        "sender": sender_stats,
+        "receiver": receiver_stats,
+        "metrics": compute_channel_metrics(sender_stats, receiver_stats),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local runner for sender/receiver apps.")
+    parser.add_argument("--sender-port", type=int, default=10000, help="Local port for sender.")
+    parser.add_argument("--receiver-port", type=int, default=10001, help="Local port for receiver.")
+    parser.add_argument("--duration", type=float, default=5.0, help="Active send duration in seconds.")
+    parser.add_argument("--rate", type=float, default=20.0, help="Packets per second for the sender (0 for unpaced).")
+    parser.add_argument(
+        "--payload-size",
+        type=int,
+        default=None,
+        help="Truncate or pad mock payloads to this many bytes (natural size by default).",
+    )
+    parser.add_argument(
+        "--reliable-ratio",
+        type=float,
+        default=0.5,
+        help="Fraction of packets sent on the reliable channel.",
+    )
+    parser.add_argument("--window-size", type=int, default=WINDOW_SIZE, help="Selective repeat window size.")
+    parser.add_argument(
+        "--skip-threshold",
+        type=float,
+        default=SKIP_THRESHOLD,
+        help="Seconds before the receiver skips a missing reliable packet.",
+    )
+    parser.add_argument(
+        "--fec-block",
+        type=int,
+        default=None,
+        help="Protect every this many reliable packets with FEC repair packets (disabled by default).",
+    )
+    parser.add_argument("--fec-repair", type=int, default=1, help="XOR repair packets per FEC block.")
+    parser.add_argument(
+        "--receiver-buffer",
+        type=float,
+        default=1.0,
+        help="Extra time (seconds) the receiver listens after sender stops.",
+    )
+    parser.add_argument(
+        "--bundle-delay",
+        type=float,
+        default=None,
+        help="Bundle messages sent within this many seconds into one datagram (disabled by default).",
+    )
+    parser.add_argument(
+        "--congestion-control",
+        choices=sorted(CONGESTION_CONTROLLERS),
+        default=None,
+        help="Congestion control for the reliable channel (fixed window by default).",
+    )
+    parser.add_argument(
+        "--pacing-rate",
+        type=float,
+        default=None,
+        help="Pace datagrams of both channels to this many per second (disabled by default).",
+    )
+    parser.add_argument(
+        "--compression-dict",
+        type=str,
+        default=None,
+        help="Compress payloads with this preset dictionary (see `python compression.py train`).",
+    )
+    parser.add_argument(
+        "--sequenced-unreliable",
+        action="store_true",
+        help="Drop unreliable packets older than the newest one received.",
+    )
+    add_impairment_arguments(parser)
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    compression_dict = None
+    if args.compression_dict:
+        with open(args.compression_dict, "rb") as f:
+            compression_dict = f.read()
+
+    config = ExperimentConfig(
+        duration=args.duration,
+        rate=args.rate,
+        payload_size=args.payload_size,
+        reliable_ratio=args.reliable_ratio,
+        window_size=args.window_size,
+        skip_threshold=args.skip_threshold,
+        fec_block=args.fec_block,
+        fec_repair=args.fec_repair,
+        receiver_buffer=args.receiver_buffer,
+        bundle_delay=args.bundle_delay,
+        congestion_control=args.congestion_control,
+        pacing_rate=args.pacing_rate,
+        compression_dict=compression_dict,
+        sequenced_unreliable=args.sequenced_unreliable,
+        sender_impairment=conditions_from_args(args, 0),
+        receiver_impairment=conditions_from_args(args, 1),
+        sender_port=args.sender_port,
+        receiver_port=args.receiver_port,
+    )
+    result = run_experiment(config)
+    sender_stats = result["sender"]
+    receiver_stats = result["receiver"]
+    metrics = result["metrics"]
 
     def fmt_ms(value: Any) -> str:
         """Format millisecond values with 2 decimal places."""
@@ -201,21 +368,32 @@ def main() -> None:
     print("\n" + "=" * 60)
     print("H-UDP CHANNEL PERFORMANCE")
     print("=" * 60)
-    print(f"Send rate:          {args.rate:.1f} packets/s")
+    print(f"Send rate:          {args.rate:.1f} packets/s (achieved {metrics['send_rate_per_sec']:.1f})")
     print(f"Send duration:      {args.duration:.2f}s")
+    if sender_stats.get("impairment"):
+        print(f"Data link:          {sender_stats['impairment']}")
+        print(f"ACK link:           {receiver_stats.get('impairment')}")
 
     for channel_name, label in [("reliable", "RELIABLE"), ("unreliable", "UNRELIABLE")]:
         channel = metrics[channel_name]
         print(f"\n{label} CHANNEL")
         print("-" * 60)
         print(f"  Latency:                   {fmt_ms(channel['avg_latency_ms'])}")
+        for name, value in channel["latency_percentiles_ms"].items():
+            print(f"  Latency {name + ':':<19}{fmt_ms(value)}")
         print(f"  Jitter:                    {fmt_ms(channel['jitter_ms'])}\n")
         print(f"  Packets sent:              {channel['packets_sent']}")
         print(f"  Packets received:          {channel['packets_received']}")
         print(f"  Packet delivery ratio:     {fmt_ratio(channel['delivery_ratio_pct'])}\n")
         print(f"  Bytes received:            {channel['bytes_received']}")
         print(f"  Throughput:                {fmt_throughput(channel['throughput_bytes_per_sec'])} ({channel['bytes_received']} bytes / {metrics['duration']:.2f}s)")
+        if channel_name == "reliable":
+            print(f"\n  Retransmissions:           {sender_stats.get('retransmissions', 0)}")
+            print(f"  FEC repairs sent:          {sender_stats.get('fec_repairs', 0)}")
+            print(f"  FEC recovered:             {channel['fec_recovered']}")
+            print(f"  Datagram overhead:         {fmt_ratio(channel['overhead_pct'])}")
     print("=" * 60)
+    dump_from_args(args)
 
 
 if __name__ == "__main__":
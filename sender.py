@@ -1,142 +1,727 @@
+import asyncio
+import itertools
+import queue
 import socket
 import time
 import threading
-from typing import Dict, Tuple
-from packet import HUDPPacket, CHANNEL_RELIABLE, CHANNEL_UNRELIABLE, MAX_PAYLOAD_SIZE, MAX_PACKET_SIZE
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+from timers import Timer, TimerQueue
+from rtt import RTTEstimator
+from congestion import make_congestion_controller
+from pacer import Pacer
+from compression import PayloadCompressor
+from fec import FEC_FLUSH_FRACTION, FecEncoder, check_fec_ratio, fec_record
+from tracing import TRACER, TRACE_EVENTS, TRACE_PACKETS, EVENT_SEND, EVENT_ACK, EVENT_RETRANSMIT, EVENT_DROP
+from packet import (HUDPPacket, send_packet, CHANNEL_RELIABLE, CHANNEL_UNRELIABLE, CHANNEL_FEC, CHANNEL_RESET_ACK,
+                    MAX_PAYLOAD_SIZE, MAX_STREAMS, FLAG_BUNDLED, FLAG_FRAGMENT, FLAG_COMPRESSED, FLAG_STREAM, STREAM_HEADER,
+                    BUNDLE_LENGTH, bundle_messages, fragment_message)
 
 WINDOW_SIZE = 32
-TIMEOUT = 0.2  # 200ms
+TIMEOUT = 0.2  # 200ms, initial RTO before any RTT sample, capped at half the skip threshold
+# Seconds after a later reliable packet was sent before the receiver skips a missing one. The first
+# retransmission has to arrive well before then, so the initial RTO is at most half of it
+SKIP_THRESHOLD = 0.2
 MAX_RETRIES = 5
 MAX_SEND_RATE = 100  # packets per second
+PACING_BURST = 4  # Datagrams that may be sent back to back when pacing
+OUTBOUND_LIMIT = 256  # Reliable packets send_reliable_nowait may queue for window space, on all streams
+BACKPRESSURE_HIGH = 0.75  # Fraction of the outbound limit queued at which backpressure is signalled
+BACKPRESSURE_LOW = 0.25  # Fraction of the outbound limit queued at which backpressure is cleared
+
+# Outcomes a send_reliable_nowait future resolves to
+DELIVERED = 'delivered'
+SKIPPED = 'skipped'  # The receiver gave up waiting for a packet of the message (see skip_threshold)
+DROPPED = 'dropped'  # A packet was not acknowledged after MAX_RETRIES, or the sender was closed first
+
+class Delivery:
+    """Outcome of a message sent with send_reliable_nowait, settled once all its packets are"""
+    __slots__ = ('future', 'remaining', 'outcome')
+
+    def __init__(self, packets: int):
+        self.future: Future = Future()
+        self.remaining = packets  # Packets not yet acknowledged, skipped or dropped
+        self.outcome = DELIVERED  # Worst outcome of its packets so far
+
+    def settle(self, outcome: str) -> bool:
+        """Record the outcome of one packet and return True once every packet has one"""
+        if self.outcome == DELIVERED:
+            self.outcome = outcome
+        self.remaining -= 1
+        return self.remaining == 0
+
+class InFlightPacket:
+    """Reliable packet awaiting acknowledgement"""
+    __slots__ = ('packet', 'first_sent', 'send_order', 'retries', 'timer', 'delivery')
+
+    def __init__(self, packet: HUDPPacket, first_sent: float, send_order: int,
+                 delivery: Optional[Delivery] = None):
+        self.packet = packet
+        # Kept separately from packet.timestamp, which is overwritten on retransmission
+        self.first_sent = first_sent  # time.monotonic()
+        # Position among reliable packets of all streams, for congestion control
+        self.send_order = send_order
+        self.retries = 0
+        self.timer: Optional[Timer] = None  # Retransmit timer, armed once the packet is actually sent
+        self.delivery = delivery  # Settled when the packet is acknowledged or dropped (send_reliable_nowait only)
+
+class ReliableStream:
+    """Sequence space and selective repeat window of one reliable stream"""
+    __slots__ = ('stream_id', 'send_base', 'next_seq', 'window', 'waiting', 'fec', 'outbound')
+
+    def __init__(self, stream_id: int):
+        self.stream_id = stream_id  # Also its priority: lower IDs are served first
+        self.send_base = 0 # Earliest packet sent but not yet acknowledged
+        self.next_seq = 0
+        self.window: Dict[int, InFlightPacket] = {}  # seq -> in-flight packet
+        self.waiting = 0  # Senders blocked waiting for window space on this stream
+        self.fec: Optional[FecEncoder] = None  # Repair packet encoder when FEC is enabled
+        # (payload, flags, delivery) of send_reliable_nowait packets waiting for window space
+        self.outbound: Deque[Tuple[bytes, int, Delivery]] = deque()
+
+class Bundle:
+    """Messages collected into one datagram while bundling is enabled"""
+    __slots__ = ('seq', 'timestamp', 'messages', 'size', 'timer')
+
+    def __init__(self, seq: int, timestamp: float):
+        self.seq = seq
+        self.timestamp = timestamp  # time.time() of the first message
+        self.messages: List[bytes] = []
+        self.size = 0  # Bundled payload size including length prefixes
+        self.timer: Optional[Timer] = None
 
 class HUDPSender:
     """H-UDP sender with reliable and unreliable channels"""
     
-    def __init__(self, sock: socket.socket, dest_addr: Tuple[str, int]):
+    def __init__(self, sock: socket.socket, dest_addr: Tuple[str, int],
+                 timers: Union[TimerQueue, asyncio.AbstractEventLoop],
+                 ack_provider: Optional[Callable[[], int]] = None, bundle_delay: Optional[float] = None,
+                 congestion_control: Optional[str] = None, pacing_rate: Optional[float] = None,
+                 pacing_burst: int = PACING_BURST, compressor: Optional[PayloadCompressor] = None,
+                 window_size: int = WINDOW_SIZE, fec_block: Optional[int] = None, fec_repair: int = 1,
+                 outbound_limit: int = OUTBOUND_LIMIT, skip_threshold: float = SKIP_THRESHOLD):
         self.sock = sock
         self.dest_addr = dest_addr
+        self.timers = timers
+        # Returns the cumulative ACK to piggyback on outgoing packets (HUDPReceiver.take_piggyback_ack)
+        self.ack_provider = ack_provider
+        # Seconds a message may wait to be bundled with later ones, or None to send each message immediately
+        self.bundle_delay = bundle_delay
+        self.bundles: Dict[Tuple[int, int], Bundle] = {}  # (channel, stream) -> open bundle
+        # Deflates datagram payloads with a preset dictionary when that makes them smaller (None to disable)
+        self.compressor = compressor
+        # Send fec_repair XOR parity packets per fec_block reliable packets, so the receiver can
+        # rebuild lost ones without waiting for a retransmission (None to disable, see fec.py)
+        if fec_block is not None:
+            check_fec_ratio(fec_block, fec_repair)
+        self.fec_block = fec_block
+        self.fec_repair = fec_repair
         self.unreliable_seq = 0
+        self.fragment_ids = itertools.count()
         
-        # Reliable channel state
-        self.send_base = 0 # Earliest packet sent but not yet acknowledged
-        self.next_seq = 0 
-        self.window: Dict[int, Tuple[HUDPPacket, int]] = {}  # seq -> (packet, retries)
-        self.lock = threading.Lock() # Lock for send_base, next_seq, and window
+        # Reliable channel state: independent streams sharing the RTT estimate and congestion window,
+        # so loss on one stream does not hold up delivery on the others
+        self.streams: Dict[int, ReliableStream] = {}
+        self.window_size = window_size  # Selective repeat window of each stream; must match the receiver's
+        self.packets_sent = 0  # Reliable packets sent on all streams
+        self.in_flight = 0  # Reliable packets awaiting acknowledgement on all streams
+        self.retransmissions = 0  # Reliable packets sent again after a timeout
+        self.repairs_sent = 0  # FEC repair packets
+        # skip_threshold is the receiver's: until the first RTT sample, a lost packet is retransmitted
+        # early enough to arrive before the receiver gives up on it
+        self.rtt = RTTEstimator(min(TIMEOUT, skip_threshold / 2))
+        # Limits packets in flight below window_size ('newreno', 'delay' or None for a fixed window)
+        self.congestion = make_congestion_controller(congestion_control)
+        # Spaces datagrams of both channels at pacing_rate per second (None to send immediately)
+        self.pacer = Pacer(pacing_rate, pacing_burst, timers, self._transmit_now) if pacing_rate else None
+        self.lock = threading.Lock() # Lock for streams, bundles and in_flight
         self.condition = threading.Condition(self.lock)
-        
-        self.shutdown_event = threading.Event()
-        # A daemon thread is a background thread that will automatically terminate when the main program exits, 
-        # regardless of whether the daemon thread has completed its task
-        self.ack_thread = threading.Thread(target=self._ack_receiver, daemon=True)
-        self.ack_thread.start()
-    
-        self.timer_thread = threading.Thread(target=self._retransmit_timer, daemon=True)
-        self.timer_thread.start()
+        # Called (with self.lock held) whenever window space may have been freed,
+        # for callers that cannot block on self.condition such as AsyncGameNetAPI
+        self.on_window_open: Optional[Callable[[], None]] = None
+
+        # Datagrams are built under self.lock but only sent once it is released (see _release),
+        # so a slow sendto never holds up ACK processing or other senders
+        self.outbox: Deque[HUDPPacket] = deque()
+        # send_reliable_nowait queue bound and backpressure state
+        self.outbound_limit = outbound_limit
+        self.queued = 0  # Packets waiting in the streams' outbound queues
+        self.backpressure = False  # Set at BACKPRESSURE_HIGH of the limit, cleared at BACKPRESSURE_LOW
+        # Called with the new backpressure state whenever it changes (without self.lock held)
+        self.on_backpressure: Optional[Callable[[bool], None]] = None
+        self.settled: List[Delivery] = []  # Deliveries to resolve once self.lock is released
+        self.backpressure_changed = False
+        self.closed = False  # Set by close; reliable sends then raise ConnectionAbortedError
+        # ACKs are read off the socket by HUDPDispatcher and passed to handle_ack,
+        # and retransmissions are scheduled on the shared TimerQueue
     
     def send_unreliable(self, data: bytes) -> int:
         """Send data on unreliable channel (fire and forget)"""
         if len(data) > MAX_PAYLOAD_SIZE:
-            raise ValueError(f"Payload too large: {len(data)} > {MAX_PAYLOAD_SIZE}")
+            # Each fragment is a datagram with its own seq; the receiver drops the
+            # whole message if any of them is lost
+            timestamp = time.time()
+            fragments = self.make_fragments(data)
+            with self.lock:
+                # Flush first, as the open bundle has reserved an earlier seq and would
+                # otherwise be dropped as stale by a sequenced_unreliable receiver
+                if (CHANNEL_UNRELIABLE, 0) in self.bundles:
+                    self._flush_bundle(CHANNEL_UNRELIABLE)
+                seq = self.unreliable_seq
+                self.unreliable_seq += len(fragments)
+            for index, fragment in enumerate(fragments):
+                self._send_unreliable_packet(seq + index, fragment, FLAG_FRAGMENT, timestamp)
+            self._release()
+            return seq
+
+        if self.bundle_delay is not None:
+            with self.lock:
+                seq = self._add_to_bundle(CHANNEL_UNRELIABLE, 0, data)
+            self._release()
+            return seq
         
         seq = self.unreliable_seq
+        self.unreliable_seq += 1
+        self._send_unreliable_packet(seq, data, 0, time.time())
+        self._release()
+        return seq
+
+    def _send_unreliable_packet(self, seq: int, payload: bytes, flags: int, timestamp: float):
+        """Build and send one unreliable datagram"""
+        payload, flags = self._compress(payload, flags)
         packet = HUDPPacket(
             channel_type=CHANNEL_UNRELIABLE,
             seq_num=seq,
-            ack_num=0,
-            timestamp=time.time(),
-            payload=data
+            ack_num=self._piggyback_ack(),
+            timestamp=timestamp,
+            payload=payload,
+            flags=flags
         )
-        self.unreliable_seq += 1
+        if TRACER.level >= TRACE_PACKETS:
+            TRACER.record(EVENT_SEND, CHANNEL_UNRELIABLE, seq)
+        self._transmit(packet)
+
+    def _compress(self, payload: bytes, flags: int) -> Tuple[bytes, int]:
+        """Compress a datagram payload if a compressor is set and it saves space"""
+        if self.compressor is not None:
+            compressed = self.compressor.compress(payload)
+            if compressed is not None:
+                return compressed, flags | FLAG_COMPRESSED
+        return payload, flags
+
+    def _transmit(self, packet: HUDPPacket):
+        """Queue a datagram to be sent by _release"""
+        self.outbox.append(packet)
+
+    def _release(self):
+        """Send the datagrams in the outbox (through the pacer if pacing is enabled) and resolve
+        settled deliveries. Called after every operation that may have queued either, once
+        self.lock is released, so futures' callbacks may call back into the sender"""
+        outbox = self.outbox
+        while outbox:
+            try:
+                packet = outbox.popleft()  # Another thread may be emptying the outbox too
+            except IndexError:
+                break
+            if self.pacer is not None:
+                self.pacer.send(packet)
+            else:
+                send_packet(self.sock, packet, self.dest_addr)
+
+        if self.settled or self.backpressure_changed:
+            with self.lock:
+                settled, self.settled = self.settled, []
+                changed, self.backpressure_changed = self.backpressure_changed, False
+                backpressure = self.backpressure
+            for delivery in settled:
+                # False if the application cancelled the future
+                if delivery.future.set_running_or_notify_cancel():
+                    delivery.future.set_result(delivery.outcome)
+            if changed and self.on_backpressure is not None:
+                self.on_backpressure(backpressure)
+
+    def _transmit_now(self, packet: HUDPPacket):
+        """Pacer callback: send a datagram immediately"""
+        send_packet(self.sock, packet, self.dest_addr)
+        if packet.channel_type == CHANNEL_RELIABLE:
+            self._on_paced(packet)
+
+    def _start_timer(self, state: ReliableStream, seq: int, entry: InFlightPacket):
+        """Arm an in-flight packet's retransmit timer for the (re)transmission just queued.
+        With pacing the packet may wait in the pacer's queue, so _on_paced arms it once the
+        packet actually goes out instead. Caller must hold self.lock"""
+        if self.pacer is None:
+            entry.timer = self.timers.call_later(self.rtt.backoff_timeout(entry.retries), self._on_timeout, state, seq)
+
+    def _on_paced(self, packet: HUDPPacket):
+        """Arm the retransmit timer of a reliable packet the pacer has just sent, and start its
+        RTT measurement then if it is the first transmission"""
+        stream_id = STREAM_HEADER.unpack_from(packet.payload)[0] if packet.flags & FLAG_STREAM else 0
+        with self.lock:
+            state = self.streams.get(stream_id)
+            entry = state.window.get(packet.seq_num) if state is not None else None
+            if entry is None or entry.packet is not packet or self.closed:
+                return  # Acknowledged while queued, or sent by Pacer.close
+            if entry.retries == 0:
+                entry.first_sent = time.monotonic()
+            if entry.timer is not None:
+                entry.timer.cancel()
+            entry.timer = self.timers.call_later(self.rtt.backoff_timeout(entry.retries), self._on_timeout,
+                                                 state, packet.seq_num)
+    
+    def send_reliable(self, data: bytes, flags: int = 0, stream: int = 0) -> int:
+        """Send data on a reliable stream with Selective Repeat.
+
+        Messages larger than MAX_PAYLOAD_SIZE are fragmented, and each fragment waits for
+        window space in turn, so fragments are pipelined within the window. Returns the
+        seq of the first fragment within the stream. Pass flags to send an already framed
+        payload (such as a fragment from make_fragments) as its own datagram.
+        """
+        if len(data) > MAX_PAYLOAD_SIZE:
+            if flags:
+                raise ValueError(f"Payload too large: {len(data)} > {MAX_PAYLOAD_SIZE}")
+            fragments = self.make_fragments(data)
+            seq = self.send_reliable(fragments[0], FLAG_FRAGMENT, stream)
+            for fragment in fragments[1:]:
+                self.send_reliable(fragment, FLAG_FRAGMENT, stream)
+            return seq
+
+        with self.lock:
+            self._check_open()
+            state = self.stream(stream)
+            if self.bundle_delay is not None and not flags and len(data) + BUNDLE_LENGTH.size <= MAX_PAYLOAD_SIZE:
+                seq = self._add_to_bundle(CHANNEL_RELIABLE, stream, data)
+            else:
+                # Flush first so bundled messages keep their place in the sequence
+                if (CHANNEL_RELIABLE, stream) in self.bundles:
+                    self._flush_bundle(CHANNEL_RELIABLE, stream)
+                self._wait_for_window_space(state)
+                seq = self._send_reliable_packet(data, flags, time.time(), state)
+        self._release()
+        return seq
+
+    def send_reliable_nowait(self, data: bytes, stream: int = 0) -> Future:
+        """Send data on a reliable stream without ever blocking.
+
+        The message is sent at once if the window has space, and otherwise queued behind
+        earlier messages of the stream and sent as ACKs open the window. Returns a Future
+        that resolves to DELIVERED, SKIPPED or DROPPED once every packet of the message has
+        been accounted for; cancelling it while the message is still queued withdraws it.
+        Raises queue.Full, sending nothing, if the message's packets would take the outbound
+        queue past outbound_limit. Watch backpressure (or on_backpressure) to shed or
+        coalesce load before that happens.
+        """
+        payloads = self.make_fragments(data) if len(data) > MAX_PAYLOAD_SIZE else [data]
+        flags = FLAG_FRAGMENT if len(payloads) > 1 else 0
+        delivery = Delivery(len(payloads))
+        with self.lock:
+            self._check_open()
+            if self.queued + len(payloads) > self.outbound_limit:
+                raise queue.Full(f"Outbound queue full ({self.queued} of {self.outbound_limit} packets)")
+            state = self.stream(stream)
+            state.outbound.extend((payload, flags, delivery) for payload in payloads)
+            self.queued += len(payloads)
+            self._drain_outbound()
+        self._release()
+        return delivery.future
+
+    def outbound_depth(self, stream: Optional[int] = None) -> int:
+        """Packets queued by send_reliable_nowait waiting for window space, on one stream or all"""
+        with self.lock:
+            if stream is None:
+                return self.queued
+            state = self.streams.get(stream)
+            return len(state.outbound) if state is not None else 0
+
+    def _drain_outbound(self):
+        """Send queued packets while there is window space, higher priority streams first.
+        Caller must hold self.lock"""
+        for stream_id in sorted(self.streams):
+            state = self.streams[stream_id]
+            if not state.outbound:
+                continue
+            # An open bundle has reserved next_seq, so send it before the queued packets
+            if (CHANNEL_RELIABLE, stream_id) in self.bundles:
+                self._flush_bundle(CHANNEL_RELIABLE, stream_id)
+            while state.outbound and self._has_window_space(state, 1):
+                payload, flags, delivery = state.outbound.popleft()
+                self.queued -= 1
+                if delivery.future.cancelled():
+                    continue
+                self._send_reliable_packet(payload, flags, time.time(), state, delivery)
+        self._update_backpressure()
+
+    def _settle(self, delivery: Delivery, outcome: str):
+        """Record the outcome of one packet of a message. Caller must hold self.lock"""
+        if delivery.settle(outcome):
+            self.settled.append(delivery)
+
+    def _update_backpressure(self):
+        """Flip backpressure when the outbound queue crosses a watermark. Caller must hold self.lock"""
+        if self.backpressure:
+            if self.queued <= self.outbound_limit * BACKPRESSURE_LOW:
+                self.backpressure = False
+                self.backpressure_changed = True
+        elif self.queued and self.queued >= self.outbound_limit * BACKPRESSURE_HIGH:
+            self.backpressure = True
+            self.backpressure_changed = True
+
+    def stream(self, stream_id: int) -> ReliableStream:
+        """State of a reliable stream, created on first use. Caller must hold self.lock"""
+        state = self.streams.get(stream_id)
+        if state is None:
+            if not 0 <= stream_id < MAX_STREAMS:
+                raise ValueError(f"Invalid stream {stream_id}, must be below {MAX_STREAMS}")
+            state = self.streams[stream_id] = ReliableStream(stream_id)
+            if self.fec_block is not None:
+                state.fec = FecEncoder(stream_id, self.fec_block, self.fec_repair)
+        return state
+
+    def make_fragments(self, data: bytes) -> List[bytes]:
+        """Split a message larger than MAX_PAYLOAD_SIZE into fragment payloads under a new fragment ID"""
+        return fragment_message(data, next(self.fragment_ids) & 0xFFFFFFFF)
+
+    def _send_reliable_packet(self, payload: bytes, flags: int, timestamp: float, state: ReliableStream,
+                              delivery: Optional[Delivery] = None) -> int:
+        """Send the stream's next_seq and add it to its window. Caller must hold self.lock and have checked for window space"""
+        seq = state.next_seq
+        payload, flags = self._compress(payload, flags)
+        repairs = state.fec.add(seq, fec_record(flags, payload)) if state.fec is not None else None
+        # The stream ID goes outside the compressed payload, as the receiver needs it before delivery
+        if state.stream_id:
+            payload = STREAM_HEADER.pack(state.stream_id) + payload
+            flags |= FLAG_STREAM
+        packet = HUDPPacket(
+            channel_type=CHANNEL_RELIABLE,
+            seq_num=seq,
+            ack_num=self._piggyback_ack(),
+            timestamp=timestamp,
+            payload=payload,
+            flags=flags
+        )
+        
+        # Send packet
+        if TRACER.level >= TRACE_PACKETS:
+            TRACER.record(EVENT_SEND, CHANNEL_RELIABLE, seq, 0, state.stream_id)
+        self._transmit(packet)
         
-        self.sock.sendto(packet.serialize(), self.dest_addr)
+        # Add to window and arm its retransmit timer
+        entry = state.window[seq] = InFlightPacket(packet, time.monotonic(), self.packets_sent, delivery)
+        self._start_timer(state, seq, entry)
+        state.next_seq += 1
+        self.packets_sent += 1
+        self.in_flight += 1
+
+        if repairs:
+            self._send_repairs(state.fec.first_seq, repairs)
+        elif repairs is not None and state.fec.timer is None:
+            # Protect a block that stops short of fec_block packets once sending pauses
+            state.fec.timer = self.timers.call_later(self.rtt.rto * FEC_FLUSH_FRACTION, self._on_fec_timer, state)
         return seq
+
+    def _send_repairs(self, first_seq: int, repairs: List[bytes]):
+        """Send the repair packets of a block starting at first_seq. Caller must hold self.lock"""
+        timestamp = time.time()
+        for payload in repairs:
+            self._transmit(HUDPPacket(CHANNEL_FEC, first_seq, 0, timestamp, payload))
+        self.repairs_sent += len(repairs)
+
+    def _on_fec_timer(self, state: ReliableStream):
+        """Timer callback: send repair packets for a stream's partly filled block"""
+        with self.lock:
+            state.fec.timer = None
+            if state.fec.records:
+                first_seq = state.fec.first_seq
+                self._send_repairs(first_seq, state.fec.flush())
+        self._release()
+
+    def _add_to_bundle(self, channel: int, stream: int, data: bytes) -> int:
+        """Append a message to the open bundle of a channel (and reliable stream) and return the bundle's seq.
+        Caller must hold self.lock"""
+        key = (channel, stream)
+        framed_size = BUNDLE_LENGTH.size + len(data)
+        while True:
+            bundle = self.bundles.get(key)
+            if bundle is not None and bundle.size + framed_size > MAX_PAYLOAD_SIZE:
+                self._flush_bundle(channel, stream)
+            elif (bundle is None and channel == CHANNEL_RELIABLE
+                  and (self.stream(stream).outbound or not self._has_window_space(self.stream(stream), 1))):
+                # Wait for window space before opening a reliable bundle, so next_seq
+                # is guaranteed a slot when the bundle is flushed from the timer thread
+                # (and for queued send_reliable_nowait packets to go first)
+                self._wait_for_window_space(self.stream(stream))
+            else:
+                break
+
+        if bundle is None:
+            if channel == CHANNEL_RELIABLE:
+                # All sends on the stream go through the bundle while it is open, so next_seq stays reserved for it
+                seq = self.stream(stream).next_seq
+            else:
+                seq = self.unreliable_seq
+                self.unreliable_seq += 1
+            bundle = Bundle(seq, time.time())
+            bundle.timer = self.timers.call_later(self.bundle_delay, self._on_bundle_timer, key, bundle)
+            self.bundles[key] = bundle
+
+        bundle.messages.append(data)
+        bundle.size += framed_size
+        # Flush early if not even an empty message would fit
+        if bundle.size + BUNDLE_LENGTH.size >= MAX_PAYLOAD_SIZE:
+            self._flush_bundle(channel, stream)
+        return bundle.seq
+
+    def _on_bundle_timer(self, key: Tuple[int, int], bundle: 'Bundle'):
+        """Timer callback: flush a bundle once bundle_delay has passed since its first message"""
+        with self.lock:
+            if self.bundles.get(key) is bundle:
+                self._flush_bundle(*key)
+        self._release()
+
+    def _flush_bundle(self, channel: int, stream: int = 0):
+        """Send the open bundle of a channel (and reliable stream) as one datagram. Caller must hold self.lock"""
+        bundle = self.bundles.pop((channel, stream))
+        bundle.timer.cancel()
+
+        # A lone message is sent as-is without the length prefix
+        if len(bundle.messages) == 1:
+            payload, flags = bundle.messages[0], 0
+        else:
+            payload, flags = bundle_messages(bundle.messages), FLAG_BUNDLED
+
+        # The timestamp is that of the first message, so measured latency includes the bundling delay
+        if channel == CHANNEL_RELIABLE:
+            self._send_reliable_packet(payload, flags, bundle.timestamp, self.stream(stream))
+        else:
+            self._send_unreliable_packet(bundle.seq, payload, flags, bundle.timestamp)
     
-    def send_reliable(self, data: bytes) -> int:
-        """Send data on reliable channel with Selective Repeat"""
+    def _piggyback_ack(self) -> int:
+        """Cumulative ACK for the reverse direction, or 0 (acknowledges nothing) if there is none"""
+        return self.ack_provider() if self.ack_provider else 0
+
+    def handle_ack(self, ack_num: int, sack_bitmap: int = 0, stream: int = 0, skip_bitmap: int = 0):
+        """Process a cumulative ACK with optional SACK and skip bitmaps for one stream and slide its window"""
         with self.lock:
-            # Wait if window is full
-            while self.next_seq >= self.send_base + WINDOW_SIZE:
+            state = self.streams.get(stream)
+            if state is None:
+                return # Nothing was sent on this stream
+            now = time.monotonic()
+            rtt_sample = None
+
+            # Everything below ack_num has been received (or skipped) by the receiver,
+            # and bit i of the bitmap covers seq ack_num + 1 + i
+            acked = list(range(state.send_base, min(ack_num, state.next_seq)))
+            while sack_bitmap:
+                lowest_bit = sack_bitmap & -sack_bitmap
+                acked.append(ack_num + lowest_bit.bit_length())
+                sack_bitmap ^= lowest_bit
+
+            # Remove ACKed packets from window
+            newly_acked = 0
+            for seq in acked:
+                entry = state.window.pop(seq, None)
+                if entry is None:
+                    continue
+                self.in_flight -= 1
+                if entry.timer is not None:
+                    entry.timer.cancel()
+                # Bit i of the skip bitmap is set if seq ack_num - 1 - i was skipped rather than received.
+                # A skipped packet was lost, so it is neither an RTT sample nor acknowledged data
+                if seq < ack_num and (skip_bitmap >> (ack_num - 1 - seq)) & 1:
+                    if entry.delivery is not None:
+                        self._settle(entry.delivery, SKIPPED)
+                    if self.congestion is not None:
+                        self.congestion.on_loss(entry.send_order, self.packets_sent)
+                    continue
+                newly_acked += 1
+                if entry.delivery is not None:
+                    self._settle(entry.delivery, DELIVERED)
+                # Karn's algorithm: only sample RTT from packets that were never retransmitted.
+                # Use the most recently sent one, as older ones may only be covered now because their own ACK was lost
+                if entry.retries == 0:
+                    rtt = now - entry.first_sent
+                    if rtt_sample is None or rtt < rtt_sample:
+                        rtt_sample = rtt
+                if TRACER.level >= TRACE_PACKETS:
+                    TRACER.record(EVENT_ACK, CHANNEL_RELIABLE, seq, entry.retries, stream)
+
+            if rtt_sample is not None:
+                self.rtt.sample(rtt_sample)
+            if self.congestion is not None and newly_acked:
+                self.congestion.on_ack(newly_acked, rtt_sample)
+            self._slide_window(state)
+        self._release()
+
+    def _slide_window(self, state: ReliableStream):
+        """Advance a stream's send_base past acknowledged or dropped packets. Caller must hold self.lock"""
+        while state.send_base not in state.window and state.send_base < state.next_seq:
+            state.send_base += 1
+
+        # Queued packets were sent before any waiting thread's, so they go first
+        if self.queued:
+            self._drain_outbound()
+        # Wake up waiting threads; with several streams waiting, priority decides who gets the space
+        self.condition.notify_all()
+        if self.on_window_open is not None:
+            self.on_window_open()
+
+    def window_full(self, stream: int = 0) -> bool:
+        """True if send_reliable on the stream could block waiting for window space"""
+        with self.lock:
+            # An open reliable bundle has reserved next_seq, and a message that
+            # does not fit in it needs a second slot for the next bundle
+            state = self.stream(stream)
+            return bool(state.outbound) or not self._has_window_space(state, 1 if (CHANNEL_RELIABLE, stream) not in self.bundles else 2)
+
+    def set_waiting(self, stream: int, waiting: bool):
+        """Count (or stop counting) a caller that waits for window space on a stream without
+        blocking in send_reliable, such as AsyncGameNetAPI, so lower priority streams leave
+        the congestion window to it"""
+        with self.lock:
+            state = self.stream(stream)
+            if waiting:
+                state.waiting += 1
+            else:
+                state.waiting -= 1
+                # Lower priority streams may have been holding back for this one
+                self.condition.notify_all()
+
+    def _wait_for_window_space(self, state: ReliableStream):
+        """Block until one more packet fits in the stream's window, after the stream's queued
+        send_reliable_nowait packets. Caller must hold self.lock"""
+        if not state.outbound and self._has_window_space(state, 1):
+            return
+        state.waiting += 1
+        try:
+            while state.outbound or not self._has_window_space(state, 1):
                 # self.lock is released while waiting and re-acquired upon wake-up
                 self.condition.wait()
-            
-            seq = self.next_seq
-            packet = HUDPPacket(
-                channel_type=CHANNEL_RELIABLE,
-                seq_num=seq,
-                ack_num=0,
-                timestamp=time.time(),
-                payload=data
-            )
-            
-            # Send packet
-            self.sock.sendto(packet.serialize(), self.dest_addr)
-            
-            # Add to window
-            self.window[seq] = (packet, 0)
-            self.next_seq += 1
-        
-        return seq
-    
-    def _ack_receiver(self):
-        """Background thread to receive ACKs"""
-        while not self.shutdown_event.is_set():
-            try:
-                self.sock.settimeout(1 / MAX_SEND_RATE) # Set timeout to periodically check self.shutdown_event
-                data, _ = self.sock.recvfrom(MAX_PACKET_SIZE)
-                packet = HUDPPacket.deserialize(data)
-                
-                if packet.channel_type == CHANNEL_RELIABLE:
-                    self._handle_ack(packet.ack_num)
-            except socket.timeout:
-                continue
-            except Exception as e:
-                print(f"[Sender] ACK receiver error: {e}")
-    
-    def _handle_ack(self, ack_num: int):
-        """Process ACK and slide window"""
+                self._check_open()
+        finally:
+            state.waiting -= 1
+            # Lower priority streams may have been holding back for this one
+            self.condition.notify_all()
+
+    def _check_open(self):
+        """Raise ConnectionAbortedError once the sender is closed. Caller must hold self.lock"""
+        if self.closed:
+            raise ConnectionAbortedError("Sender is closed")
+
+    def _has_window_space(self, state: ReliableStream, needed: int) -> bool:
+        """True if `needed` more packets (counting a reserved bundle slot) fit in both the
+        stream's selective repeat window and the congestion window shared by all streams.
+        Caller must hold self.lock"""
+        if state.next_seq + needed > state.send_base + self.window_size:
+            return False
+        if self.congestion is None:
+            return True
+        if self.in_flight + needed > max(int(self.congestion.cwnd), 1):
+            return False
+        # Leave the congestion window to waiting higher priority streams that can use it
+        for other in self.streams.values():
+            if (other.stream_id < state.stream_id and (other.waiting or other.outbound)
+                    and other.next_seq < other.send_base + self.window_size):
+                return False
+        return True
+
+    def _on_timeout(self, state: ReliableStream, seq: int):
+        """Timer callback: retransmit a timed-out packet, or drop it after MAX_RETRIES"""
+        # Each unACKed packet has its own deadline on the TimerQueue, so only
+        # the packet that actually timed out is touched
         with self.lock:
-            # Remove ACKed packet from window
-            if ack_num in self.window:
-                _, retries = self.window[ack_num]
-                print(f"[Sender] ACK received for RELIABLE seq={ack_num}, retries={retries}")
-                del self.window[ack_num]
-            
-            # Slide window base
-            while self.send_base not in self.window and self.send_base < self.next_seq:
-                self.send_base += 1
-            
-            # Wake up waiting thread
-            self.condition.notify() 
-
-    def _retransmit_timer(self):
-        """Background thread to retransmit timed-out packets"""
-        # Instead of maintaining a timer for each unACKed packet,
-        # we keep checking how long each unACKed packet has been waiting
-        while not self.shutdown_event.is_set():
-            with self.lock:
-                for seq, (packet, retries) in list(self.window.items()):
-                    if time.time() - packet.timestamp > TIMEOUT:
-                        if retries >= MAX_RETRIES:
-                            print(f"[Sender] Max retries reached for RELIABLE seq={seq}, dropping")
-                            del self.window[seq]
-
-                            # Slide window base
-                            while self.send_base not in self.window and self.send_base < self.next_seq:
-                                self.send_base += 1
-
-                            # Wake up waiting thread
-                            self.condition.notify() 
-                        else:
-                            # Retransmit
-                            packet.timestamp = time.time()
-                            self.sock.sendto(packet.serialize(), self.dest_addr)
-                            self.window[seq] = (packet, retries + 1)
-                            print(f"[Sender] Retransmitting RELIABLE seq={seq} (attempt {retries + 1})")
+            if seq not in state.window:
+                return
+            entry = state.window[seq]
+            if self.congestion is not None:
+                self.congestion.on_loss(entry.send_order, self.packets_sent)
+            if entry.retries >= MAX_RETRIES:
+                if TRACER.level >= TRACE_EVENTS:
+                    TRACER.record(EVENT_DROP, CHANNEL_RELIABLE, seq, entry.retries, state.stream_id)
+                del state.window[seq]
+                self.in_flight -= 1
+                if entry.delivery is not None:
+                    self._settle(entry.delivery, DROPPED)
+                self._slide_window(state)
+            else:
+                # Retransmit, doubling the timeout on each attempt
+                entry.packet.timestamp = time.time()
+                entry.packet.ack_num = self._piggyback_ack()
+                self._transmit(entry.packet)
+                self.retransmissions += 1
+                entry.retries += 1
+                entry.timer = None
+                self._start_timer(state, seq, entry)
+                if TRACER.level >= TRACE_PACKETS:
+                    TRACER.record(EVENT_RETRANSMIT, CHANNEL_RELIABLE, seq, entry.retries, state.stream_id)
+        self._release()
+
+    def send_control(self, channel: int, seq: int):
+        """Send a datagram without payload such as CHANNEL_RESET"""
+        self._transmit(HUDPPacket(channel, seq, 0, time.time(), b''))
+        self._release()
+
+    def reset(self, confirm: Optional[int] = None):
+        """Restart every reliable stream from seq 0 because the peer's receiver did (see
+        CHANNEL_RESET). Unacknowledged packets are resent right away, renumbered in their
+        original order, so no message is lost and each settles its future as before.
+        With confirm, a CHANNEL_RESET_ACK for that nonce is sent first, timestamped before
+        any packet numbered for the new sequence space"""
+        with self.lock:
+            if confirm is not None:
+                self._transmit(HUDPPacket(CHANNEL_RESET_ACK, confirm, 0, time.time(), b''))
+            # Give open bundles their seq first, so they are renumbered with the rest
+            for channel, stream in list(self.bundles):
+                if channel == CHANNEL_RELIABLE:
+                    self._flush_bundle(channel, stream)
+            for state in self.streams.values():
+                entries = [state.window[seq] for seq in sorted(state.window)]
+                state.window = {}
+                state.send_base = state.next_seq = 0
+                if state.fec is not None:
+                    # Blocks under the old seqs can no longer be repaired; start a new one
+                    if state.fec.timer is not None:
+                        state.fec.timer.cancel()
+                    state.fec = FecEncoder(state.stream_id, self.fec_block, self.fec_repair)
+                for entry in entries:
+                    if entry.timer is not None:
+                        entry.timer.cancel()
+                        entry.timer = None
+                    seq = state.next_seq
+                    entry.packet.seq_num = seq
+                    entry.packet.timestamp = time.time()
+                    entry.packet.ack_num = self._piggyback_ack()
+                    entry.first_sent = time.monotonic()
+                    entry.retries = 0
+                    self._start_timer(state, seq, entry)
+                    state.window[seq] = entry
+                    state.next_seq += 1
+                    self._transmit(entry.packet)
+            self.condition.notify_all()
+        self._release()
 
     def close(self):
-        """Stop sender threads"""
-        self.shutdown_event.set()
-        if self.ack_thread.is_alive():
-            self.ack_thread.join()
-        if self.timer_thread.is_alive():
-            self.timer_thread.join()
\ No newline at end of file
+        """Flush pending bundles, cancel pending retransmissions, resolve the futures of
+        messages still queued or in flight as DROPPED and wake up blocked send_reliable
+        calls, which raise ConnectionAbortedError"""
+        with self.lock:
+            self.closed = True
+            for channel, stream in list(self.bundles):
+                self._flush_bundle(channel, stream)
+            for state in self.streams.values():
+                for entry in state.window.values():
+                    if entry.timer is not None:
+                        entry.timer.cancel()
+                    if entry.delivery is not None:
+                        self._settle(entry.delivery, DROPPED)
+                for _, _, delivery in state.outbound:
+                    self._settle(delivery, DROPPED)
+                state.outbound.clear()
+                if state.fec is not None and state.fec.timer is not None:
+                    state.fec.timer.cancel()
+            self.queued = 0
+            self._update_backpressure()
+            self.condition.notify_all()
+        self._release()
+        if self.pacer is not None:
+            self.pacer.close()
@@ -3,6 +3,7 @@ import random
 import argparse
 import json
 from gameNetAPI import GameNetAPI
+from tracing import add_trace_arguments, configure_from_args, dump_from_args
 
 def generate_mock_game_data(packet_id: int, is_reliable: bool) -> str:
     """Generate mock game data based on packet type"""
@@ -65,6 +66,9 @@ if __name__ == '__main__':
     parser.add_argument('--remote-port', type=int, default=10001, help='Remote port')
     parser.add_argument('--duration', type=float, default=10.0, help='Test duration in seconds')
     parser.add_argument('--rate', type=float, default=20.0, help='Packets per second')
+    add_trace_arguments(parser)
     args = parser.parse_args()
     
+    configure_from_args(args)
     main(args.local_port, args.remote_port, args.duration, args.rate)
+    dump_from_args(args)
@@ -0,0 +1,217 @@
+import argparse
+import copy
+import json
+import random
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from packet import CHANNEL_UNRELIABLE
+from tracing import TRACER, TRACE_EVENTS, EVENT_NO_BASELINE
+
+# Snapshot messages travel on the unreliable channel alongside ordinary payloads and are
+# recognised by their first byte, which JSON payloads (starting with '{') never use
+SNAPSHOT_MARKER = 0x01
+SNAPSHOT_ACK_MARKER = 0x02
+SNAPSHOT_HEADER = struct.Struct('!BII')  # marker, snapshot ID, baseline ID (NO_BASELINE for a full snapshot)
+SNAPSHOT_ACK = struct.Struct('!BI')  # marker, snapshot ID
+NO_BASELINE = 0
+SNAPSHOT_HISTORY = 32  # Snapshots kept on each side to serve as delta baselines
+
+def make_patch(base: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON Merge Patch (RFC 7396) turning base into state: changed keys with their new
+    values, nested dicts diffed recursively, and removed keys set to None.
+
+    As None means removal, a key whose value changes to None is removed by apply_patch
+    instead; states must not hold None values (in dicts, lists are sent whole)"""
+    patch: Dict[str, Any] = {}
+    for key, value in state.items():
+        old = base.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            nested = make_patch(old, value)
+            if nested:
+                patch[key] = nested
+        elif key not in base or old != value:
+            patch[key] = value
+    for key in base:
+        if key not in state:
+            patch[key] = None
+    return patch
+
+def apply_patch(base: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a new state with a merge patch applied to base"""
+    state = dict(base)
+    for key, value in patch.items():
+        if value is None:
+            state.pop(key, None)
+        elif isinstance(value, dict) and isinstance(state.get(key), dict):
+            state[key] = apply_patch(state[key], value)
+        else:
+            state[key] = value
+    return state
+
+def is_snapshot_message(payload: bytes) -> bool:
+    """Whether a received payload belongs to the snapshot layer"""
+    return len(payload) > 0 and payload[0] in (SNAPSHOT_MARKER, SNAPSHOT_ACK_MARKER)
+
+def is_newer(a: int, b: int) -> bool:
+    """Whether snapshot ID a was issued after b, allowing for wraparound"""
+    return 0 < (a - b) % 0xFFFFFFFF < 0x80000000
+
+def _encode_json(value: Dict[str, Any]) -> bytes:
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+class SnapshotEncoder:
+    """Sender side: encodes each state as a delta against the newest snapshot the peer has acknowledged"""
+
+    def __init__(self, history: int = SNAPSHOT_HISTORY):
+        self.history = history
+        self.sent: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()  # snapshot ID -> state, oldest first
+        self.next_id = 1
+        self.acked_id = NO_BASELINE
+        self.lock = threading.Lock()  # encode and on_ack run on the application and receiving threads
+
+    def encode(self, state: Dict[str, Any]) -> Tuple[int, bytes]:
+        """Return the new snapshot ID and its message. A copy of the state is kept as a
+        future baseline, so the caller may go on mutating it. None values are not allowed
+        in its dicts (see make_patch)"""
+        with self.lock:
+            snapshot_id = self.next_id
+            self.next_id = self.next_id % 0xFFFFFFFF + 1  # IDs skip NO_BASELINE when they wrap
+
+            baseline = self.sent.get(self.acked_id)
+            if baseline is None:
+                # Nothing acknowledged yet, or the acknowledged snapshot has left the history
+                body, baseline_id = _encode_json(state), NO_BASELINE
+            else:
+                body, baseline_id = _encode_json(make_patch(baseline, state)), self.acked_id
+
+            self.sent[snapshot_id] = copy.deepcopy(state)
+            while len(self.sent) > self.history:
+                self.sent.popitem(last=False)
+            return snapshot_id, SNAPSHOT_HEADER.pack(SNAPSHOT_MARKER, snapshot_id, baseline_id) + body
+
+    def on_ack(self, snapshot_id: int):
+        """Use an acknowledged snapshot as the baseline if it is newer than the current one"""
+        with self.lock:
+            if snapshot_id in self.sent and (self.acked_id == NO_BASELINE or is_newer(snapshot_id, self.acked_id)):
+                self.acked_id = snapshot_id
+
+
+class SnapshotDecoder:
+    """Receiver side: rebuilds states from full and delta snapshots, ignoring stale ones"""
+
+    def __init__(self, history: int = SNAPSHOT_HISTORY):
+        self.history = history
+        self.received: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()  # snapshot ID -> state, oldest first
+        self.latest_id = NO_BASELINE
+        self.lock = threading.Lock()
+
+    def decode(self, message: bytes) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Return (snapshot ID, state), or None if the snapshot is stale or its baseline is unknown.
+        The state is kept as a baseline for later deltas, so treat it as read-only"""
+        _, snapshot_id, baseline_id = SNAPSHOT_HEADER.unpack_from(message)
+        body = json.loads(bytes(message[SNAPSHOT_HEADER.size:]))
+        with self.lock:
+            if self.latest_id != NO_BASELINE and not is_newer(snapshot_id, self.latest_id):
+                return None
+            if baseline_id == NO_BASELINE:
+                state = body
+            else:
+                baseline = self.received.get(baseline_id)
+                if baseline is None:
+                    if TRACER.level >= TRACE_EVENTS:
+                        TRACER.record(EVENT_NO_BASELINE, CHANNEL_UNRELIABLE, snapshot_id, baseline_id)
+                    return None
+                state = apply_patch(baseline, body)
+
+            self.received[snapshot_id] = state
+            while len(self.received) > self.history:
+                self.received.popitem(last=False)
+            self.latest_id = snapshot_id
+            return snapshot_id, state
+
+
+class SnapshotChannel:
+    """Delta-encoded state updates over the unreliable channel of a GameNetAPI.
+
+    Each snapshot is sent as a delta against the newest one the peer has acknowledged,
+    or in full while there is no such baseline. The receiving side acknowledges every
+    snapshot it applies with a small unreliable ACK, so a lost snapshot or ACK only delays
+    the baseline moving forward. Pass received payloads that satisfy is_snapshot_message to
+    handle(); everything else is left to the application.
+    """
+
+    def __init__(self, api, history: int = SNAPSHOT_HISTORY):
+        self.api = api
+        self.encoder = SnapshotEncoder(history)
+        self.decoder = SnapshotDecoder(history)
+        self.latest: Optional[Dict[str, Any]] = None  # Newest state received from the peer
+
+    def send(self, state: Dict[str, Any]) -> int:
+        """Send a state snapshot and return its ID"""
+        snapshot_id, message = self.encoder.encode(state)
+        self.api.send(message, reliable=False)
+        return snapshot_id
+
+    def handle(self, payload: bytes) -> Optional[Dict[str, Any]]:
+        """Process a snapshot or snapshot ACK, returning the new state if a newer snapshot was applied"""
+        if payload[0] == SNAPSHOT_ACK_MARKER:
+            _, snapshot_id = SNAPSHOT_ACK.unpack_from(payload)
+            self.encoder.on_ack(snapshot_id)
+            return None
+
+        decoded = self.decoder.decode(payload)
+        if decoded is None:
+            return None
+        snapshot_id, self.latest = decoded
+        self.api.send(SNAPSHOT_ACK.pack(SNAPSHOT_ACK_MARKER, snapshot_id), reliable=False)
+        return self.latest
+
+
+def simulate(entities: int, ticks: int, loss: float, seed: int) -> Dict[str, float]:
+    """Bytes per tick of full vs delta snapshots for a world of moving entities, without sockets"""
+    rng = random.Random(seed)
+    world = {str(i): {"x": rng.randint(0, 800), "y": rng.randint(0, 600), "angle": 0, "state": "idle"}
+             for i in range(entities)}
+    encoder, decoder = SnapshotEncoder(), SnapshotDecoder()
+    full_bytes = delta_bytes = applied = 0
+
+    for _ in range(ticks):
+        # A few entities move each tick; most stay put
+        for entity in rng.sample(list(world), max(1, entities // 5)):
+            world[entity] = dict(world[entity], x=world[entity]["x"] + rng.randint(-3, 3),
+                                 angle=(world[entity]["angle"] + rng.randint(0, 10)) % 360)
+        state = {"entities": dict(world)}
+        full_bytes += SNAPSHOT_HEADER.size + len(_encode_json(state))
+        _, message = encoder.encode(state)
+        delta_bytes += len(message)
+        if rng.random() < loss:
+            continue
+        decoded = decoder.decode(message)
+        if decoded is not None:
+            applied += 1
+            assert decoded[1] == state
+            if rng.random() >= loss:
+                encoder.on_ack(decoded[0])
+
+    return {"full": full_bytes / ticks, "delta": delta_bytes / ticks, "applied": applied / ticks}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full and delta snapshot sizes for simulated game state")
+    parser.add_argument("--entities", type=int, default=20, help="Entities in the simulated world")
+    parser.add_argument("--ticks", type=int, default=1000, help="Snapshots to send")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    print(f"{'loss':>6} {'full B/tick':>12} {'delta B/tick':>13} {'ratio':>7} {'applied':>8}")
+    print("-" * 50)
+    for loss in (0.0, 0.05, 0.2):
+        result = simulate(args.entities, args.ticks, loss, args.seed)
+        print(f"{loss:>6.0%} {result['full']:>12.0f} {result['delta']:>13.0f} "
+              f"{result['full'] / result['delta']:>7.1f} {result['applied']:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
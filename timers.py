@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, List, Tuple
+
+class Timer:
+    """Handle for a scheduled callback"""
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline: float, callback: Callable, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the callback. O(1): the heap entry is discarded when it reaches the top"""
+        self.cancelled = True
+
+
+class TimerQueue:
+    """Min-heap of deadlines served by a single thread that sleeps until the earliest one
+
+    call_later mirrors asyncio's loop.call_later, so components that only need
+    call_later(...).cancel() can be driven by either this queue or an event loop.
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int, Timer]] = []
+        self.counter = itertools.count() # Tie-breaker so equal deadlines never compare Timers
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.shutdown = False
+
+        self.timer_thread = threading.Thread(target=self._run, daemon=True)
+        self.timer_thread.start()
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        """Run callback(*args) on the timer thread after delay seconds"""
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def call_at(self, deadline: float, callback: Callable, *args) -> Timer:
+        """Run callback(*args) on the timer thread at the given time.monotonic() deadline"""
+        timer = Timer(deadline, callback, args)
+        with self.lock:
+            heapq.heappush(self.heap, (deadline, next(self.counter), timer))
+            # Only wake the timer thread if its next wake-up time has moved earlier
+            if self.heap[0][2] is timer:
+                self.condition.notify()
+        return timer
+
+    def _run(self):
+        """Background thread that sleeps until the earliest deadline and runs its callback"""
+        while True:
+            with self.lock:
+                while True:
+                    if self.shutdown:
+                        return
+                    # Lazily discard cancelled timers
+                    while self.heap and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    delay = self.heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        _, _, timer = heapq.heappop(self.heap)
+                        break
+                    # self.lock is released while waiting, so call_at can push an earlier deadline
+                    self.condition.wait(delay)
+
+            # Run the callback without holding the lock so it can schedule new timers
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"[Timers] Callback error: {e}")
+
+    def close(self):
+        """Stop the timer thread, discarding pending timers"""
+        with self.lock:
+            self.shutdown = True
+            self.condition.notify()
+        if self.timer_thread.is_alive():
+            self.timer_thread.join()
@@ -0,0 +1,151 @@
+import argparse
+import itertools
+import json
+import socket
+import struct
+import time
+from typing import Dict, Iterator, List, Tuple
+
+# Trace levels: events are recorded when the tracer's level is at least the event's level
+TRACE_OFF = 0
+TRACE_EVENTS = 1  # Loss handling (drops and skips), discarded datagrams and session lifecycle
+TRACE_PACKETS = 2  # Every packet: sends, ACKs, retransmissions, reordering and deliveries
+TRACE_LEVELS = {'off': TRACE_OFF, 'events': TRACE_EVENTS, 'packets': TRACE_PACKETS}
+
+# Event types
+EVENT_SEND = 1  # value: unused
+EVENT_ACK = 2  # value: retries before the packet was acknowledged
+EVENT_RETRANSMIT = 3  # value: attempt number
+EVENT_DROP = 4  # Reliable packet given up after MAX_RETRIES
+EVENT_SKIP = 5  # Receiver skipped a missing reliable packet
+EVENT_REORDER = 6  # value: seq the receiver was waiting for
+EVENT_DELIVER = 7  # value: latency in microseconds
+EVENT_INVALID = 8  # Receiver discarded a malformed or undecodable packet
+EVENT_INCOMPLETE = 9  # Incomplete fragmented message discarded; seq: fragment ID, value: fragments received
+EVENT_NO_BASELINE = 10  # Delta snapshot discarded; seq: snapshot ID, value: its unknown baseline ID
+# Server sessions; channel: unused, seq: peer port, value: peer IPv4 address (see peer_fields)
+EVENT_SESSION_OPEN = 11
+EVENT_SESSION_CLOSE = 12  # Evicted, reset unanswered or server closed
+EVENT_SESSION_REFUSED = 13  # Datagram from a new peer ignored at the session limit
+EVENT_NAMES = {EVENT_SEND: 'send', EVENT_ACK: 'ack', EVENT_RETRANSMIT: 'retransmit', EVENT_DROP: 'drop',
+               EVENT_SKIP: 'skip', EVENT_REORDER: 'reorder', EVENT_DELIVER: 'deliver', EVENT_INVALID: 'invalid',
+               EVENT_INCOMPLETE: 'incomplete', EVENT_NO_BASELINE: 'no_baseline', EVENT_SESSION_OPEN: 'session_open',
+               EVENT_SESSION_CLOSE: 'session_close', EVENT_SESSION_REFUSED: 'session_refused'}
+
+# record index, timestamp (time.time()), event, channel, stream, seq, value
+RECORD = struct.Struct('<QdBBBxII')
+TRACE_MAGIC = b'HUDPTRC1'  # Start of binary trace files, followed by the records oldest first
+DEFAULT_CAPACITY = 65536  # Records kept; older ones are overwritten
+
+class Tracer:
+    """Level-gated event recorder backed by a preallocated ring buffer.
+
+    Call sites check the level before building an event, so tracing costs one attribute
+    comparison when disabled:
+
+        if TRACER.level >= TRACE_PACKETS:
+            TRACER.record(EVENT_ACK, CHANNEL_RELIABLE, seq, retries)
+
+    Recording packs a fixed-size record into the buffer without allocating or locking
+    (slot indices come from an itertools.count, which is atomic under the GIL).
+    """
+
+    def __init__(self, level: int = TRACE_OFF, capacity: int = DEFAULT_CAPACITY, echo: bool = False):
+        self.level = TRACE_OFF
+        self.configure(level, capacity, echo)
+
+    def configure(self, level: int, capacity: int = DEFAULT_CAPACITY, echo: bool = False):
+        """Set the level and reallocate the ring buffer, discarding recorded events.
+        With echo, each event is also printed as it is recorded"""
+        self.level = TRACE_OFF  # Stop recording while the buffer is replaced
+        self.capacity = capacity
+        # Only allocated while tracing is enabled
+        self.buffer = bytearray(capacity * RECORD.size if level > TRACE_OFF else 0)
+        self.counter = itertools.count()
+        self.echo = echo
+        self.level = level
+
+    def record(self, event: int, channel: int, seq: int, value: int = 0, stream: int = 0):
+        """Append an event, overwriting the oldest one once the buffer is full"""
+        index = next(self.counter)
+        timestamp = time.time()
+        RECORD.pack_into(self.buffer, (index % self.capacity) * RECORD.size,
+                         index, timestamp, event, channel, stream, seq & 0xFFFFFFFF, min(value, 0xFFFFFFFF))
+        if self.echo:
+            print(f"[Trace] {EVENT_NAMES[event]} channel={channel} stream={stream} seq={seq} value={value}")
+
+    def _records(self) -> List[tuple]:
+        """Unpacked records currently in the buffer, oldest first"""
+        # Slots that were never written have a zero timestamp; the rest are ordered by their index
+        records = [fields for fields in RECORD.iter_unpack(self.buffer) if fields[1]]
+        records.sort()
+        return records
+
+    def events(self) -> Iterator[Dict]:
+        """Recorded events as dicts, oldest first"""
+        for fields in self._records():
+            yield _event_dict(fields)
+
+    def dump_jsonl(self, path: str) -> int:
+        """Write recorded events as JSON lines and return how many were written"""
+        count = 0
+        with open(path, 'w') as f:
+            for event in self.events():
+                f.write(json.dumps(event) + '\n')
+                count += 1
+        return count
+
+    def dump_binary(self, path: str) -> int:
+        """Write recorded events as packed RECORD structs after TRACE_MAGIC and return how many were written"""
+        records = self._records()
+        with open(path, 'wb') as f:
+            f.write(TRACE_MAGIC)
+            f.writelines(RECORD.pack(*fields) for fields in records)
+        return len(records)
+
+    def dump(self, path: str) -> int:
+        """Write recorded events, as JSON lines if path ends in .jsonl and in binary otherwise"""
+        return self.dump_jsonl(path) if path.endswith('.jsonl') else self.dump_binary(path)
+
+
+def _event_dict(fields: tuple) -> Dict:
+    _, timestamp, event, channel, stream, seq, value = fields
+    return {"time": timestamp, "event": EVENT_NAMES.get(event, event), "channel": channel,
+            "stream": stream, "seq": seq, "value": value}
+
+def peer_fields(addr: Tuple[str, int]) -> Tuple[int, int]:
+    """(port, IPv4 address as an integer) of a peer, recorded as the seq and value of session events"""
+    return addr[1], int.from_bytes(socket.inet_aton(addr[0]), 'big')
+
+def read_binary(path: str) -> Iterator[Dict]:
+    """Read events back from a file written by Tracer.dump_binary"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f"{path} is not an H-UDP trace file")
+    for fields in RECORD.iter_unpack(memoryview(data)[len(TRACE_MAGIC):]):
+        yield _event_dict(fields)
+
+def add_trace_arguments(parser: argparse.ArgumentParser):
+    """Add the --trace-* options shared by the applications to an argparse parser"""
+    parser.add_argument("--trace-level", choices=list(TRACE_LEVELS), default="off",
+                        help="Record protocol events at this level (default: off)")
+    parser.add_argument("--trace-file", type=str, default=None,
+                        help="Dump recorded events here on exit (.jsonl for JSON lines, binary otherwise)")
+    parser.add_argument("--trace-capacity", type=int, default=DEFAULT_CAPACITY,
+                        help="Events kept in the ring buffer")
+    parser.add_argument("--trace-echo", action="store_true", help="Also print each event as it is recorded")
+
+def configure_from_args(args: argparse.Namespace):
+    """Configure the global tracer from the options added by add_trace_arguments"""
+    TRACER.configure(TRACE_LEVELS[args.trace_level], args.trace_capacity, args.trace_echo)
+
+def dump_from_args(args: argparse.Namespace):
+    """Dump the global tracer to --trace-file, if one was given"""
+    if args.trace_file:
+        count = TRACER.dump(args.trace_file)
+        print(f"[Trace] Wrote {count} events to {args.trace_file}")
+
+
+# Process-wide tracer used by the protocol modules
+TRACER = Tracer()